@@ -1,7 +1,9 @@
 from src.data import data
 from src.error import InputError, AccessError
 from src.auth import detokenise
-from src.helpers import find, error_check, data_dump, update_user_stats
+from src.helpers import find, error_check, data_dump, update_user_stats, mark_changed
+from src.indexes import message_ids_of, add_owner, remove_member, joined_positions, remove_sessions, set_message_text
+
 def admin_userpermission_change_v1(token, u_id, p_id):
     '''
     Description:
@@ -51,18 +53,13 @@ def admin_userpermission_change_v1(token, u_id, p_id):
     if p_id not in [1, 2]:
         raise InputError(f"Invalid input permission_id {p_id}, must be 1 or 2.")
     user['permission_id'] = p_id
+    mark_changed('user', u_id)
 
     if p_id == 1:
-        cnl_idx = 0
-        while cnl_idx < len(data['channels']):
-            user_in_cnl = find('channel_is_member', cnl_idx, u_id)
-            if user_in_cnl > -1:
-                cnl = data['channels'][cnl_idx]
-                info = cnl['all_members'][user_in_cnl]
-                user_an_owner = find('channel_is_owner', cnl_idx, u_id)
-                if user_an_owner < 0:
-                    cnl['owner_members'].append(info)
-            cnl_idx += 1
+        for cnl_idx in joined_positions('channel', u_id):
+            cnl = data['channels'][cnl_idx]
+            if add_owner('channel', cnl, user['public_info']):
+                mark_changed('channel', cnl['channel_id'])
 
     data_dump()
     return {}
@@ -95,7 +92,7 @@ def admin_user_remove_v1(token, u_id):
             Check for exceptions
             Valid -
             Replace all message sent by this user with 'Removed user'
-                Go to orgs with messages via msg_positions
+                Go to orgs with messages
             Leave all the orgs this user is a part of.
             Change validity.
             return
@@ -135,32 +132,32 @@ def admin_user_remove_v1(token, u_id):
 
     # Finding all messages then edit the info of those messages sent by the to-be removed user.
     orgs_with_msg_list = []
-    for msg_position_info in data['msg_positions']:
-        this_org_with_msg_position = find(msg_position_info['type'], None, msg_position_info['id'])
-        this_org = data[msg_position_info['type'] + 's'][this_org_with_msg_position]
-        orgs_with_msg_list.append(this_org)
-    for org in orgs_with_msg_list:
+    for org_type_str in ['channel', 'dm']:
+        for this_org in data[org_type_str + 's']:
+            if len(message_ids_of(this_org)) > 0:
+                orgs_with_msg_list.append([org_type_str, this_org[org_type_str + '_id'], this_org])
+    for org_type_str, org_id, org in orgs_with_msg_list:
         for msg in org['messages']:
             if msg['u_id'] == u_id:
-                msg['message'] = 'Removed user'
+                set_message_text(msg, 'Removed user')
+                mark_changed('message', [org_type_str, org_id, msg['message_id']])
 
     # Removing user from all orgs taking this user as a member.
     org_type = ['channel', 'dm']
     count = 0
     while count < len(org_type):
-        for org in data[org_type[count] + 's']:
-            for member in org['all_members']:
-                if u_id == member['u_id']:
-                    org['all_members'].remove(member)
-                    for owner in org['owner_members']:
-                        if u_id == owner['u_id']:
-                            org['owner_members'].remove(owner)
-                    update_user_stats([auth_user_id], org_type[count] + 's', False)
+        for org_idx in joined_positions(org_type[count], u_id):
+            org = data[org_type[count] + 's'][org_idx]
+            remove_member(org_type[count], org, u_id)
+            mark_changed(org_type[count], org[org_type[count] + '_id'])
+            update_user_stats([auth_user_id], org_type[count] + 's', False)
         count += 1
 
     user['is_valid'] = False
+    remove_sessions(user)
     user['public_info']['name_first'] = 'Removed'
     user['public_info']['name_last'] = 'user'
+    mark_changed('user', u_id)
 
     data_dump()
     return {}
@@ -9,7 +9,8 @@ import jwt
 from src.config import url
 from src.error import InputError, AccessError
 from src.data import data
-from src.helpers import find, randomise, error_check, data_dump, update_users_stats
+from src.indexes import index_lock, add_user, email_position, handle_position, add_session, remove_session
+from src.helpers import find, randomise, error_check, data_dump, update_users_stats, mark_changed, mark_pushed
 
 SECRETKEY = "COMP1531"
 re_codes = []
@@ -57,8 +58,9 @@ def auth_login_v2(email, password):
     user = data['users'][user_pos]
     if user['is_valid'] == False:
         raise AccessError("User removed")
-    s_id = randomise('user_id')
-    user['sessions'].append(s_id)
+    s_id = randomise('session_id')
+    add_session(user, s_id)
+    mark_changed('user', user['auth_user_id'])
     token = tokenise(user['auth_user_id'], s_id)
     data_dump()
 
@@ -131,17 +133,40 @@ def auth_register_v2(email, password, name_first, name_last):
     if len(handle_str) > 20:
         handle_str = handle_str[0: 20]
 
-    repeat_idx = -1
-    for user in data['users']:
-        if handle_str == user['public_info']['handle_str']:
-            repeat_idx += 1
+    # Held until the user is added, so that no one takes the handle meanwhile.
+    with index_lock:
+        user_id = add_new_user(email, password, name_first, name_last, handle_str)
+    user_position = email_position(email)
+    users_info = data['users'][user_position]
+    mark_changed('user', user_id)
+    for key in ['channels_joined', 'dms_joined', 'messages_sent']:
+        mark_pushed(['user', user_id, key], users_info['stats'][key])
+    # Find the new user's auth_user_id to return.
+    data_dump()
+    return {
+                'token': tokenise(user_id, users_info['sessions'][0]),
+                'auth_user_id': users_info['auth_user_id']
+            }
+
+def add_new_user(email, password, name_first, name_last, handle_str):
+    '''Adds the user registering to data['users'], with index_lock held.
+
+    handle_str gets the smallest number which makes it unique appended.
 
-    if repeat_idx != -1:
+    Returns the auth_user_id of the new user.
+    '''
+    if email_position(email) >= 0:
+        raise InputError("Email has been registered")
+
+    base_handle_str = handle_str
+    repeat_idx = 0
+    while handle_position(handle_str) >= 0:
         suffix = str(repeat_idx)
-        if len(handle_str) >= 20:
-            handle_str = handle_str[0: 20 - len(suffix)] + suffix
+        if len(base_handle_str) >= 20:
+            handle_str = base_handle_str[0: 20 - len(suffix)] + suffix
         else:
-            handle_str = handle_str + suffix
+            handle_str = base_handle_str + suffix
+        repeat_idx += 1
 
     # Determining the auth_user_id value.
     user_id = randomise('user_id')
@@ -183,13 +208,8 @@ def auth_register_v2(email, password, name_first, name_last):
             'involvement_rate'  : 0
         },
     }
-    data['users'].append(users_info)
-    # Find the new user's auth_user_id to return.
-    data_dump()
-    return {
-                'token': tokenise(user_id, users_info['sessions'][0]),
-                'auth_user_id': users_info['auth_user_id']
-            }
+    add_user(users_info)
+    return user_id
 
 def auth_logout_v1(token):
     '''
@@ -221,10 +241,9 @@ def auth_logout_v1(token):
     user_pos = find('user', None, auth_user_id)
     user = data['users'][user_pos]
     print(f"User with id {auth_user_id} has session {s_id}")
-    for session in user['sessions']:
-        if s_id == session:
-            print("Found")
-            user['sessions'].remove(session)
+    if remove_session(user, s_id):
+        print("Found")
+    mark_changed('user', auth_user_id)
     data_dump()
 
     return {'is_success': True}
@@ -248,12 +267,7 @@ def auth_passwordreset_request_v1(email):
             + Valid email input.
     """
     # user not found with this email
-    use_found = False
-    for user_data in data['users']:
-        if user_data['public_info'].get('email') == email:
-            use_found = True
-            break
-    if not use_found:
+    if email_position(email) < 0:
         raise InputError('Email not registered')
 
     re_code = secrets.token_hex(3)
@@ -323,10 +337,11 @@ def auth_passwordreset_reset_v1(reset_code, new_password):
     encrypt_password = hashlib.sha256(new_password.encode('utf8')).hexdigest()
     password_new = {
         'password': encrypt_password}
-    for user in data['users']:
-        if user['email'] == email:
-            user.update(password_new)
-            break
+    user_position = email_position(email)
+    if user_position >= 0:
+        user = data['users'][user_position]
+        user.update(password_new)
+        mark_changed('user', user['auth_user_id'])
     return { }
 
 # Below are all helpers functions
@@ -339,18 +354,13 @@ def check_email_format(email):
 
 #   Description: Checks if the input email's exists in the database.
 def check_email_existence(email):
-    for user in data['users']:
-        if user['public_info']['email'] == email:
-            return True
-    return False
+    return email_position(email) >= 0
 
 #   Description: Checks if the input password matches the given email in the database.
 def check_password(email, password):
-    for index in range(len(data['users'])):
-        user = data['users'][index]
-        if user['public_info']['email'] == email:
-            if user['password'] == hash(password):
-                return index
+    user_position = email_position(email)
+    if user_position >= 0 and data['users'][user_position]['password'] == hash(password):
+        return user_position
     return -1
 
 # Function the encodes a string.
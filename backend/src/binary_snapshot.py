@@ -0,0 +1,341 @@
+'''Binary format for snapshots of the data store.
+
+    MAGIC
+    section ...                 one per key of the snapshot
+    section '$strings'          the table of the keys of dicts
+    footer                      offset of the table, MAGIC
+
+A section is
+
+    name length (u8), name (utf-8), kind (u8), payload length (u64),
+    crc32 of the payload (u32), payload
+
+where kind is LIST for a list, whose payload is each item prefixed by its
+length (u32), or VALUE for any other value, whose payload is the value.
+
+Values are a tag byte followed by:
+
+    NONE, TRUE, FALSE           nothing
+    INT                         i64
+    BIG_INT                     a string, for ints beyond i64
+    FLOAT                       f64
+    TEXT                        length (u32), utf-8 bytes
+    BIG_TEXT                    length (u32), the digits as utf-8 bytes, for ints beyond i64
+    LIST                        number of items (u32), items
+    DICT                        number of keys (u32), (key index (u32), value) ...
+    STRING, BIG_INT             index in the table (u32), only read from
+                                snapshots which had every string in the table
+
+Keys of dicts are stored once in the table, whose payload is the number
+of keys (u32), then the length (u32) and utf-8 bytes of each key. They
+are the names of the fields of data, so the table stays small however
+much data there is. Any other string, most of them the text of a single
+message, is stored inline where it is.
+
+Sections are written item by item, so that like src/json_stream.py only
+the largest single item is held as bytes at any time, besides the table.
+
+Usage as a converter, from the backend directory:
+
+    python -m src.binary_snapshot to-binary src/backup.json src/backup.bin
+    python -m src.binary_snapshot to-json src/backup.bin src/backup.json
+'''
+import sys
+import zlib
+import struct
+from src import json_stream
+
+MAGIC = b'DREAMSB1'
+STRINGS_SECTION = '$strings'
+
+KIND_LIST = 1
+KIND_VALUE = 2
+
+(NONE, TRUE, FALSE, INT, BIG_INT, FLOAT, STRING, LIST, DICT, TEXT, BIG_TEXT) = range(11)
+
+SECTION_HEADER = struct.Struct('<BQI')
+FOOTER = struct.Struct('<Q8s')
+U32 = struct.Struct('<I')
+I64 = struct.Struct('<q')
+F64 = struct.Struct('<d')
+
+I64_MIN = -(1 << 63)
+I64_MAX = (1 << 63) - 1
+
+def is_binary(path):
+    '''Returns True if the file at path is a binary snapshot.
+    '''
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+# ========== Writing ==========
+
+class Encoder:
+    '''Encodes values, collecting the keys of their dicts in a table.
+    '''
+    def __init__(self):
+        self.strings = {}
+
+    def key_index(self, string):
+        index = self.strings.get(string)
+        if index is None:
+            index = len(self.strings)
+            self.strings[string] = index
+        return index
+
+    def encode(self, value, out):
+        '''Appends the encoding of value to the bytearray out.
+        '''
+        if value is None:
+            out.append(NONE)
+        elif value is True:
+            out.append(TRUE)
+        elif value is False:
+            out.append(FALSE)
+        elif isinstance(value, int):
+            if I64_MIN <= value <= I64_MAX:
+                out.append(INT)
+                out += I64.pack(value)
+            else:
+                out.append(BIG_TEXT)
+                encode_text(str(value), out)
+        elif isinstance(value, float):
+            out.append(FLOAT)
+            out += F64.pack(value)
+        elif isinstance(value, str):
+            out.append(TEXT)
+            encode_text(value, out)
+        elif isinstance(value, (list, tuple)):
+            out.append(LIST)
+            out += U32.pack(len(value))
+            for item in value:
+                self.encode(item, out)
+        elif isinstance(value, dict):
+            out.append(DICT)
+            out += U32.pack(len(value))
+            for key, item in value.items():
+                out += U32.pack(self.key_index(key))
+                self.encode(item, out)
+        else:
+            raise TypeError(f"Cannot store {type(value).__name__} in a snapshot")
+
+    def encode_item(self, value):
+        '''Returns the encoding of value, encoding it again if a handler
+        changed it meanwhile, see json_stream.encode_changing().
+        '''
+        return json_stream.encode_changing(self.encode_once, value)
+
+    def encode_once(self, value):
+        out = bytearray()
+        self.encode(value, out)
+        return out
+
+def encode_text(string, out):
+    encoded = string.encode()
+    out += U32.pack(len(encoded))
+    out += encoded
+
+def write_section(file, name, kind, chunks):
+    '''Description: Write a section whose payload is the concatenation of chunks.
+
+    The length and checksum are filled in once the payload is written.
+    '''
+    name_bytes = name.encode()
+    file.write(bytes([len(name_bytes)]) + name_bytes)
+    header_at = file.tell()
+    file.write(SECTION_HEADER.pack(kind, 0, 0))
+    length = 0
+    crc = 0
+    for chunk in chunks:
+        file.write(chunk)
+        length += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+    end = file.tell()
+    file.seek(header_at)
+    file.write(SECTION_HEADER.pack(kind, length, crc))
+    file.seek(end)
+
+def list_chunks(encoder, items):
+    for item in list(items):
+        encoded = encoder.encode_item(item)
+        yield U32.pack(len(encoded))
+        yield bytes(encoded)
+
+def string_chunks(strings):
+    yield U32.pack(len(strings))
+    for string in strings:
+        encoded = string.encode()
+        yield U32.pack(len(encoded)) + encoded
+
+def write_object(file, obj):
+    '''Description: Write the dictionary obj as a binary snapshot to file,
+    opened in binary mode.
+    '''
+    encoder = Encoder()
+    file.write(MAGIC)
+    for key in list(obj):
+        value = obj[key]
+        if isinstance(value, list):
+            write_section(file, key, KIND_LIST, list_chunks(encoder, value))
+        else:
+            write_section(file, key, KIND_VALUE, [bytes(encoder.encode_item(value))])
+    strings_at = file.tell()
+    write_section(file, STRINGS_SECTION, KIND_VALUE, string_chunks(list(encoder.strings)))
+    file.write(FOOTER.pack(strings_at, MAGIC))
+
+# ========== Reading ==========
+
+class Decoder:
+    '''Decodes values given the table of keys.
+    '''
+    def __init__(self, strings):
+        self.strings = strings
+
+    def decode(self, buffer, pos):
+        '''Returns (value, position after the value).
+        '''
+        tag = buffer[pos]
+        pos += 1
+        if tag == NONE:
+            return None, pos
+        if tag == TRUE:
+            return True, pos
+        if tag == FALSE:
+            return False, pos
+        if tag == INT:
+            return I64.unpack_from(buffer, pos)[0], pos + 8
+        if tag == BIG_INT:
+            return int(self.strings[U32.unpack_from(buffer, pos)[0]]), pos + 4
+        if tag == FLOAT:
+            return F64.unpack_from(buffer, pos)[0], pos + 8
+        if tag == TEXT or tag == BIG_TEXT:
+            length = U32.unpack_from(buffer, pos)[0]
+            end = pos + 4 + length
+            if end > len(buffer):
+                raise IndexError("Text beyond the end of its item")
+            text = bytes(buffer[pos + 4:end]).decode()
+            return (text if tag == TEXT else int(text)), end
+        if tag == STRING:
+            return self.strings[U32.unpack_from(buffer, pos)[0]], pos + 4
+        if tag == LIST:
+            count = U32.unpack_from(buffer, pos)[0]
+            pos += 4
+            items = []
+            for _ in range(count):
+                item, pos = self.decode(buffer, pos)
+                items.append(item)
+            return items, pos
+        if tag == DICT:
+            count = U32.unpack_from(buffer, pos)[0]
+            pos += 4
+            value = {}
+            for _ in range(count):
+                key = self.strings[U32.unpack_from(buffer, pos)[0]]
+                value[key], pos = self.decode(buffer, pos + 4)
+            return value, pos
+        raise ValueError(f"Unknown tag {tag} in snapshot")
+
+class SectionReader:
+    '''Reads the payload of a section, checking it against its checksum at the end.
+    '''
+    def __init__(self, file, name, length, crc):
+        self.file = file
+        self.name = name
+        self.remaining = length
+        self.expected_crc = crc
+        self.crc = 0
+
+    def read(self, size):
+        if size > self.remaining:
+            raise ValueError(f"Section {self.name} of snapshot is cut short")
+        chunk = self.file.read(size)
+        if len(chunk) != size:
+            raise ValueError(f"Section {self.name} of snapshot is cut short")
+        self.remaining -= size
+        self.crc = zlib.crc32(chunk, self.crc)
+        return chunk
+
+    def done(self):
+        return self.remaining == 0
+
+    def check(self):
+        if self.crc != self.expected_crc:
+            raise ValueError(f"Checksum mismatch in section {self.name} of snapshot")
+
+def read_section_header(file):
+    '''Returns (name, kind, SectionReader of the payload).
+    '''
+    name_length = file.read(1)[0]
+    name = file.read(name_length).decode()
+    kind, length, crc = SECTION_HEADER.unpack(file.read(SECTION_HEADER.size))
+    return name, kind, SectionReader(file, name, length, crc)
+
+def read_strings(section):
+    count = U32.unpack(section.read(4))[0]
+    strings = []
+    for _ in range(count):
+        length = U32.unpack(section.read(4))[0]
+        strings.append(section.read(length).decode())
+    section.check()
+    return strings
+
+def read_object(file):
+    '''Description: Read a binary snapshot from file, opened in binary mode.
+
+    Raises ValueError if the file is not a binary snapshot, or a section
+    does not match its checksum or cannot be decoded.
+
+    Returns the snapshot as a dictionary.
+    '''
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError("Not a binary snapshot")
+    file.seek(-FOOTER.size, 2)
+    strings_at, magic = FOOTER.unpack(file.read(FOOTER.size))
+    if magic != MAGIC:
+        raise ValueError("Binary snapshot is cut short")
+    file.seek(strings_at)
+    name, kind, section = read_section_header(file)
+    decoder = Decoder(read_strings(section))
+
+    obj = {}
+    file.seek(len(MAGIC))
+    while file.tell() < strings_at:
+        name, kind, section = read_section_header(file)
+        try:
+            obj[name] = read_section(section, kind, decoder)
+        except (IndexError, struct.error) as error:
+            raise ValueError(f"Section {name} of snapshot is corrupt") from error
+        section.check()
+    return obj
+
+def read_section(section, kind, decoder):
+    if kind == KIND_VALUE:
+        return decoder.decode(section.read(section.remaining), 0)[0]
+    items = []
+    while not section.done():
+        length = U32.unpack(section.read(4))[0]
+        items.append(decoder.decode(section.read(length), 0)[0])
+    return items
+
+# ========== Converter ==========
+
+def json_to_binary(json_path, binary_path):
+    with open(json_path, 'r') as file:
+        obj = json_stream.read_object(file)
+    with open(binary_path, 'wb') as file:
+        write_object(file, obj)
+
+def binary_to_json(binary_path, json_path):
+    with open(binary_path, 'rb') as file:
+        obj = read_object(file)
+    with open(json_path, 'w') as file:
+        json_stream.write_object(file, obj)
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4 or sys.argv[1] not in ['to-binary', 'to-json']:
+        print("Usage: python -m src.binary_snapshot to-binary|to-json SOURCE DESTINATION")
+        sys.exit(1)
+    if sys.argv[1] == 'to-binary':
+        json_to_binary(sys.argv[2], sys.argv[3])
+    else:
+        binary_to_json(sys.argv[2], sys.argv[3])
@@ -1,7 +1,10 @@
 from src.data       import data
 from src.error      import AccessError, InputError, DuplicateError
-from src.helpers    import find, error_check, send_notification, data_dump, update_user_stats
+from src.helpers    import find, error_check, send_notification, data_dump, update_user_stats, mark_changed
+from src.helpers    import messages_page, message_view
 from src.auth       import detokenise
+from src.indexes    import add_member, add_owner, remove_member, remove_owner
+from src.lookup     import Lookup
 
 def channel_invite_v2(token, channel_id, u_id):
     '''
@@ -38,38 +41,36 @@ def channel_invite_v2(token, channel_id, u_id):
     payload         = detokenise(token)
     auth_user_id    = payload['auth_user_id']
     session_id      = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup          = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
     # InputError: invalid channel_id
-    error_check(InputError, 'db_channel', [channel_id])
-    operating_channel_position_in_db = find('channel', None, channel_id)
+    error_check(InputError, 'db_channel', [channel_id], lookup)
+    operating_channel_position_in_db = lookup.find('channel', None, channel_id)
 
     # AccessError: authorised user with auth_user_id does not belong to the channel with channel_id
-    error_check(AccessError, operating_channel_position_in_db, [auth_user_id])
+    error_check(AccessError, operating_channel_position_in_db, [auth_user_id], lookup)
 
     # InputError: invalid u_id
-    error_check(InputError, 'db_user', [u_id])
-    invited_user_position_in_db = find('user', None, u_id)
+    error_check(InputError, 'db_user', [u_id], lookup)
+    invited_user_position_in_db = lookup.find('user', None, u_id)
 
     # Duplicate?
-    is_dup = error_check(DuplicateError, operating_channel_position_in_db, [u_id, 'channel'])
+    is_dup = error_check(DuplicateError, operating_channel_position_in_db, [u_id, 'channel'], lookup)
     if is_dup == -3:
         return {}
 
     # Add user to the channel all_members
     operating_channel = data['channels'][operating_channel_position_in_db]
     invited_user = data['users'][invited_user_position_in_db]
-    operating_channel['all_members'].append(
-        invited_user['public_info']
-    )
+    add_member('channel', operating_channel, invited_user['public_info'])
     # Admin
     if invited_user['permission_id'] == 1:
-        operating_channel['owner_members'].append(
-            invited_user['public_info']
-        )
+        add_owner('channel', operating_channel, invited_user['public_info'])
+    mark_changed('channel', channel_id)
 
-    send_notification([u_id, auth_user_id], None, 'invite', ['channel', channel_id])
-    update_user_stats([u_id], 'channels', True)
+    send_notification([u_id, auth_user_id], None, 'invite', ['channel', channel_id], lookup)
+    update_user_stats([u_id], 'channels', True, lookup)
     data_dump()
 
     return {}
@@ -107,43 +108,38 @@ def channel_join_v2(token, channel_id):
     payload         = detokenise(token)
     auth_user_id    = payload['auth_user_id']
     session_id      = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup          = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
-    user_position_in_db = find('user', None, auth_user_id)
+    user_position_in_db = lookup.find('user', None, auth_user_id)
     user = data['users'][user_position_in_db]
 
     # InputError: invalid channel_id
-    error_check(InputError, 'db_channel', [channel_id])
-    operating_channel_position_in_db = find('channel', None, channel_id)
+    error_check(InputError, 'db_channel', [channel_id], lookup)
+    operating_channel_position_in_db = lookup.find('channel', None, channel_id)
     this_channel = data['channels'][operating_channel_position_in_db]
 
     if this_channel['is_public'] is False:
         # If admin, append
         if user['permission_id'] == 1:
-            this_channel['owner_members'].append(
-                user['public_info']
-            )
-            this_channel['all_members'].append(
-                user['public_info']
-            )
+            add_owner('channel', this_channel, user['public_info'])
+            add_member('channel', this_channel, user['public_info'])
+            mark_changed('channel', channel_id)
             return {}
         raise AccessError(f'User with auth_user_id {auth_user_id} \
             is not an admin is trying to join a private channel.')
         # If not admin, error
 
     is_dup = error_check(
-        DuplicateError, operating_channel_position_in_db, [auth_user_id, 'channel']
+        DuplicateError, operating_channel_position_in_db, [auth_user_id, 'channel'], lookup
     )
     if is_dup == -3:
         return {}
-    this_channel['all_members'].append(
-        user['public_info']
-    )
+    add_member('channel', this_channel, user['public_info'])
     if user['permission_id'] == 1:
-        this_channel['owner_members'].append(
-            user['public_info']
-        )
-    update_user_stats([auth_user_id], 'channels', True)
+        add_owner('channel', this_channel, user['public_info'])
+    mark_changed('channel', channel_id)
+    update_user_stats([auth_user_id], 'channels', True, lookup)
     data_dump()
 
     return {}
@@ -209,7 +205,7 @@ def channel_details_v2(token, channel_id):
         detail_list['all_members'].append(all_m)
     return detail_list
 
-def channel_messages_v2(token, channel_id, start):
+def channel_messages_v2(token, channel_id, start, before=None, after=None, cursor=None, limit=50):
     '''
     Description:
         Given a Channel with ID channel_id that the authorised user is part of,
@@ -219,6 +215,9 @@ def channel_messages_v2(token, channel_id, start):
         or, if this function has returned the least recent messages in the channel,
         returns -1 in "end" to indicate there are no more messages to load after this return.
 
+        Given before, after or cursor instead, return up to limit messages
+        sent right before or after a message, see messages_page() in src/helpers.py.
+
     Arguements:
         - token        (type string):   A string to be detokenised which contains payload containing
                                 auth_user_id and session_id.
@@ -226,11 +225,17 @@ def channel_messages_v2(token, channel_id, start):
             - session_id      (type_int):   An integer indicating a user's session.
         - channel_id (type integer): An integer refering to a channel's id in the database.
         - start      (type integer): An integer as an index for the starting position of messages.
+        - before     (type integer): Optional, the id of the message to return the messages before.
+        - after      (type integer): Optional, the id of the message to return the messages after.
+        - cursor      (type string): Optional, the 'next_cursor' of a page returned before.
+        - limit      (type integer): The number of messages in a page, from 1 to 50.
 
     Exceptions:
         InputError Occurs when:
             * channel_id is not a valid channel
             * start is greater than the total number of messages in the channel
+            * the message of before, after or cursor is not in the channel
+            * cursor is invalid, or limit is not from 1 to 50
         AccessError Occurs when:
             * authorised user is not a member of channel with channel_id
             * the authorised user does not exist in the database.
@@ -246,6 +251,8 @@ def channel_messages_v2(token, channel_id, start):
         - 'messages' (type dictionary): contains a list of dictionary message,
         - 'start'       (type integer): An integer as an index for the starting position of messages.
         - 'end'        (type interger): An interger as an index for the ending position of messages.
+
+        Returns { 'messages', 'next_cursor' } given before, after or cursor.
     '''
 
 
@@ -263,6 +270,12 @@ def channel_messages_v2(token, channel_id, start):
     # AccessError: authorised user with auth_user_id does not belong to the channel with channel_id
     error_check(AccessError, operating_channel_position_in_db, [auth_user_id])
 
+    if before is not None or after is not None or cursor is not None:
+        return messages_page(
+            'channel', data['channels'][operating_channel_position_in_db],
+            auth_user_id, before, after, cursor, limit
+        )
+
     # Check if start is in the range of total number of messages.
     if start > len(messages_of_this_channel):
         raise InputError('Start is greater than the total number of messages in the channel')
@@ -277,40 +290,17 @@ def channel_messages_v2(token, channel_id, start):
         'end': end,
     }
     message_idx = start
+    # Messages are stored oldest first, message_idx counts from the most recent.
     # Add messages into messages_list
     if end > 0:
         while message_idx < len(messages_of_this_channel) and message_idx < end:
-            message = messages_of_this_channel[message_idx]
-            output_reacts = message['reacts']
-            if auth_user_id in output_reacts[0]['u_ids']:
-                output_reacts[0]['is_this_user_reacted'] = True
-            else:
-                output_reacts[0]['is_this_user_reacted'] = False
-            messages_list['messages'].append({
-                'message_id': message['message_id'],
-                'u_id': message['u_id'],
-                'message': message['message'],
-                'time_created': message['time_created'],
-                'is_pinned': message['is_pinned'],
-                'reacts': output_reacts,
-            })
+            message = messages_of_this_channel[-1 - message_idx]
+            messages_list['messages'].append(message_view(message, auth_user_id))
             message_idx += 1
     else:
         while message_idx < len(messages_of_this_channel):
-            message = messages_of_this_channel[message_idx]
-            output_reacts = message['reacts']
-            if auth_user_id in output_reacts[0]['u_ids']:
-                output_reacts[0]['is_this_user_reacted'] = True
-            else:
-                output_reacts[0]['is_this_user_reacted'] = False
-            messages_list['messages'].append({
-                'message_id': message['message_id'],
-                'u_id': message['u_id'],
-                'message': message['message'],
-                'time_created': message['time_created'],
-                'is_pinned': message['is_pinned'],
-                'reacts': output_reacts,
-            })
+            message = messages_of_this_channel[-1 - message_idx]
+            messages_list['messages'].append(message_view(message, auth_user_id))
             message_idx += 1
     return messages_list
 
@@ -356,12 +346,8 @@ def channel_leave_v1(token, channel_id):
     error_check(AccessError, org_position, [auth_user_id])
 
     org = data[org_type + 's'][org_position]
-    for all_member in org['all_members']:
-        if all_member['u_id'] == auth_user_id:
-            org['all_members'].remove(all_member)
-    for owner_member in org['owner_members']:
-        if owner_member['u_id'] == auth_user_id:
-            org['owner_members'].remove(owner_member)
+    remove_member(org_type, org, auth_user_id)
+    mark_changed('channel', channel_id)
     update_user_stats([auth_user_id], 'channels', False)
     data_dump()
 
@@ -431,12 +417,13 @@ def channel_addowner_v1(token, channel_id, u_id):
     user = data['users'][find('user', None, u_id)]
 
     if find('channel_is_member', org_position, u_id) < 0:
-        org['all_members'].append(user['public_info'])
-        org['owner_members'].append(user['public_info'])
+        add_member(org_type, org, user['public_info'])
+        add_owner(org_type, org, user['public_info'])
         send_notification([u_id, auth_user_id], None, 'invite', ['channel', channel_id])
         update_user_stats([u_id], 'channels', True)
     else:
-        org['owner_members'].append(user['public_info'])
+        add_owner(org_type, org, user['public_info'])
+    mark_changed('channel', channel_id)
     data_dump()
 
     return {
@@ -513,7 +500,8 @@ def channel_removeowner_v1(token, channel_id, u_id):
 
     user = data['users'][find('user', None, u_id)]
 
-    org['owner_members'].remove(user['public_info'])
+    remove_owner(org_type, org, u_id)
+    mark_changed('channel', channel_id)
 
     data_dump()
 
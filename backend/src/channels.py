@@ -1,8 +1,9 @@
 # Imports
 from src.data import data
+from src.indexes import add_org, joined_positions
 from src.auth import detokenise
 from src.error import InputError, AccessError
-from src.helpers import find, pack, error_check, randomise, data_dump, update_users_stats, update_user_stats
+from src.helpers import find, pack, error_check, randomise, data_dump, update_users_stats, update_user_stats, mark_changed
 
 #Functions
 def channels_list_v2(token):
@@ -39,15 +40,11 @@ def channels_list_v2(token):
     session_id = payload['session_id']
     error_check(AccessError, 'db_user', [auth_user_id, session_id])
 
-    channels_idx = 0
-    while channels_idx < len(data['channels']):
-        find_result = find('channel_is_member', channels_idx, auth_user_id)
-        if find_result not in [-1, -2]:
-            tmp_dict = {}
-            tmp_dict = pack('channel_id', channels_idx, tmp_dict)
-            tmp_dict = pack('name', channels_idx, tmp_dict)
-            list_of_channels_with_auth_user.append(tmp_dict)
-        channels_idx += 1
+    for channels_idx in joined_positions('channel', auth_user_id):
+        tmp_dict = {}
+        tmp_dict = pack('channel_id', channels_idx, tmp_dict)
+        tmp_dict = pack('name', channels_idx, tmp_dict)
+        list_of_channels_with_auth_user.append(tmp_dict)
 
     return {
         'channels'  : list_of_channels_with_auth_user,
@@ -163,13 +160,8 @@ def channels_create_v2(token, name, is_public):
     if len(name) > 20:
         raise InputError("Channel name is too long.")
 
-    # Determine how many channels are in data.
-    channel_idx = 0
-    while channel_idx <= len(data['channels']):
-        channel_idx += 1
-
     # Add the new channel to the 'channels' dictionary.
-    data['channels'].append({
+    dict_idx = add_org('channel', {
         'channel_id'    : randomise('channel_id'),
         'channel_name'  : name,
         'is_public'     : is_public,
@@ -183,8 +175,7 @@ def channels_create_v2(token, name, is_public):
         },
     })
 
-    # Create a dict index for searching in 'channels' list.
-    dict_idx = channel_idx - 1
+    mark_changed('channel', data['channels'][dict_idx]['channel_id'])
     update_user_stats([auth_user_id], 'channels', True)
     update_users_stats('channels', True)
     data_dump()
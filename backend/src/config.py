@@ -1,3 +1,24 @@
+import os
+
 port = 8080
 
-url = f"http://localhost:{port}/"
\ No newline at end of file
+url = f"http://localhost:{port}/"
+
+# Storage of the data store, see src/persistence.py
+storage_mode = os.environ.get('DREAMS_STORAGE', 'json')   # 'json', 'wal', 'sqlite' or 'shards'
+snapshot_format = os.environ.get('DREAMS_SNAPSHOT_FORMAT', 'json')   # 'json' or 'binary'
+backup_path = 'src/backup.bin' if snapshot_format == 'binary' else 'src/backup.json'
+initial_backup_path = 'src/backup.json'   # loaded while there is no snapshot at backup_path
+wal_path = 'src/backup.wal'
+commit_window = 0.02     # seconds dumps are grouped into one write, 0 to write in the request
+strict_commit = os.environ.get('DREAMS_STRICT_COMMIT') == '1'   # wait for the write before responding
+fork_snapshots = os.environ.get('DREAMS_FORK_SNAPSHOTS') == '1'   # write full snapshots from a forked child
+compact_interval = 60    # seconds between snapshots of the log in 'wal' mode
+sqlite_path = 'src/backup.db'   # written through only: reads go through data in memory, see src/sqlite_store.py
+shard_dir = 'src/backup'
+lazy_messages = os.environ.get('DREAMS_LAZY_MESSAGES') == '1'   # read messages on first use in 'shards' mode
+message_idle_seconds = 600   # unused messages of a channel or dm are dropped after this
+evict_interval = 60          # seconds between looks for unused messages
+load_processes = os.cpu_count() or 1   # processes parsing shards at startup
+parallel_load_min_shards = 256       # fewer shards are parsed in the server process
+verify_indexes = os.environ.get('DREAMS_VERIFY_INDEXES') == '1'   # check the indexes against data on every dump, see src/verify_indexes.py
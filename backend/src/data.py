@@ -36,13 +36,6 @@ data = {
             'messages'      : type_messages,
         },
     ],
-    'msg_position'  : [
-        {
-            'message_ids'   : [],
-            'type'          : type_string,
-            'id'            : type_int,
-        }
-    ]
     'dreams_stats': {
         'users_exist'   : [{
                             'num_users_exist'   :type_int,
@@ -57,7 +50,15 @@ data = {
                             'num_messages_exist':type_int,
                             'time_stamp'        :type_int}],
         'utilization_rate' = type_float
-    }
+    },
+    'ids'           : {
+        'key'           : type_string,
+        'user_id'       : type_int,
+        'channel_id'    : type_int,
+        'dm_id'         : type_int,
+        'message_id'    : type_int,
+        'session_id'    : type_int,
+    }   # state of src/ids.py, empty until the first id is given out
 
 }
 
@@ -142,9 +143,6 @@ data = {
     ],
     'dms'           : [
 
-    ],
-    'msg_positions' : [
-
     ],
     'dreams_stats'  :{
         'channels_exist': [{
@@ -158,4 +156,7 @@ data = {
             'time_stamp': datetime.now().replace(tzinfo=timezone.utc).timestamp()}],
         'utilization_rate':  0,
     },
+    'ids'           : {
+
+    },
 }
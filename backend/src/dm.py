@@ -1,6 +1,9 @@
 from src.data import data
+from src.indexes import add_org, remove_org, unindex_org_messages, add_member, remove_member, joined_positions
 from src.error import AccessError, InputError, DuplicateError
-from src.helpers import find, error_check, randomise, send_notification, data_dump, update_user_stats, update_users_stats
+from src.lookup import Lookup
+from src.helpers import find, error_check, randomise, send_notification, data_dump, update_user_stats, update_users_stats, mark_changed
+from src.helpers import messages_page, message_view
 from src.auth import detokenise
 
 def dm_create_v1(token, u_ids):
@@ -75,15 +78,14 @@ def dm_create_v1(token, u_ids):
     name_dm = ', '.join(handles_user)
 
     dm_id = randomise('dm_id')
-    data['dms'].append({
+    add_org('dm', {
         'dm_id'    : dm_id,
         'dm_name'  : name_dm,
         'owner_members' : owner_members,
         'all_members'   : all_members,
         'messages'      : [],
     })
-
-    print(f"In create, creating dm called by user with id {auth_user_id}")
+    mark_changed('dm', dm_id)
 
     for u_id in u_ids:
         send_notification([u_id, auth_user_id], None, 'invite', ['dm', dm_id])
@@ -121,24 +123,16 @@ def dm_list_v1(token):
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
     error_check(AccessError, 'db_user', [auth_user_id, session_id])
-    print(f"In list, beginning, user is {auth_user_id}")
     # Initialise dm list containing the dms.
     dm_list = []
 
     # Go through dms to find user's dms.
-    dm_idx = 0
-    while dm_idx < len(data['dms']):
-        find_result = find('dm_is_member', dm_idx, auth_user_id)
-        if find_result not in [-1, -2]:
-            dm_info = {
-                'dm_id': data['dms'][dm_idx]['dm_id'],
-                'name': data['dms'][dm_idx]['dm_name']
-            }
-            dm_list.append(dm_info)
-        dm_idx += 1
-    print(f"In list, finished. found_dm: {dm_list}")
-
-    data_dump()
+    for dm_idx in joined_positions('dm', auth_user_id):
+        dm_info = {
+            'dm_id': data['dms'][dm_idx]['dm_id'],
+            'name': data['dms'][dm_idx]['dm_name']
+        }
+        dm_list.append(dm_info)
 
     return {
         'dms'   : dm_list,
@@ -174,32 +168,32 @@ def dm_invite_v1(token, dm_id, u_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError , 'db_user' , [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError , 'db_user' , [auth_user_id, session_id], lookup)
 
     # InputError: invalid dm_id.
-    error_check(InputError  , 'db_dm'   , [dm_id])
-    org_position = find('dm', None, dm_id)
+    error_check(InputError  , 'db_dm'   , [dm_id], lookup)
+    org_position = lookup.find('dm', None, dm_id)
 
     # AccessError: token corresponding user is not in the DM.
-    error_check(InputError , dm_id, [auth_user_id])
+    error_check(InputError , dm_id, [auth_user_id], lookup)
 
     # InputError: invalid u_id.
-    error_check(InputError  , 'db_user' , [u_id])
-    invited_user_position_in_db = find('user', None, u_id)
+    error_check(InputError  , 'db_user' , [u_id], lookup)
+    invited_user_position_in_db = lookup.find('user', None, u_id)
 
     # Check if user is already in dm.
-    is_dup = error_check(DuplicateError, org_position, [u_id, 'db'])
+    is_dup = error_check(DuplicateError, org_position, [u_id, 'db'], lookup)
     if is_dup == -3:
         return {}
 
     # Add user to the dm all_members.
     invited_user = data['users'][invited_user_position_in_db]
-    data['dms'][org_position]['all_members'].append(
-        invited_user['public_info']
-    )
-    send_notification([u_id, auth_user_id], None, 'invite', ['dm', dm_id])
+    add_member('dm', data['dms'][org_position], invited_user['public_info'])
+    mark_changed('dm', dm_id)
+    send_notification([u_id, auth_user_id], None, 'invite', ['dm', dm_id], lookup)
 
-    update_user_stats([u_id], 'dms', True)
+    update_user_stats([u_id], 'dms', True, lookup)
     data_dump()
 
     return {}
@@ -241,14 +235,8 @@ def dm_leave_v1(token, dm_id):
     error_check(InputError , dm_id, [auth_user_id])
 
     org = data[org_type + 's'][org_position]
-    # Get information of the member to leave.
-    for all_member in org['all_members']:
-        if all_member['u_id'] == auth_user_id:
-            org['all_members'].remove(all_member)
-    for owner_member in org['owner_members']:
-        if owner_member['u_id'] == auth_user_id:
-            org['owner_members'].remove(owner_member)
-    print("dm leave called")
+    remove_member(org_type, org, auth_user_id)
+    mark_changed('dm', dm_id)
     update_user_stats([auth_user_id], 'dms', False)
     data_dump()
 
@@ -336,8 +324,6 @@ def dm_remove_v1(token, dm_id):
         Returns an empty dictionary when:
         - none of the exception are raised
     '''
-
-    print(f"Data before remove: {data['dms']}, {data['msg_positions']}")
     # AccessError: invalid token
     payload         = detokenise(token)
     auth_user_id    = payload['auth_user_id']
@@ -357,19 +343,18 @@ def dm_remove_v1(token, dm_id):
     member_id_list = []
     for member in to_remove_org['all_members']:
         member_id_list.append(member['u_id'])
-    data['dms'].remove(to_remove_org)
+    remove_org('dm', org_position)
+    mark_changed('dm', dm_id)
 
-    for history in data['msg_positions']:
-        if history['type'] == 'dm' and history['id'] == dm_id:
-            data['msg_positions'].remove(history)
-            update_users_stats('messages', False)
+    if unindex_org_messages(to_remove_org) > 0:
+        update_users_stats('messages', False)
 
     update_user_stats(member_id_list, 'dms', False)
     update_users_stats('dms', False)
     data_dump()
     return {}
 
-def dm_messages_v1(token, dm_id, start):
+def dm_messages_v1(token, dm_id, start, before=None, after=None, cursor=None, limit=50):
     ''' Description:
        Given a DM with ID dm_id that the authorised user is part of, 
        return up to 50 messages between index "start" and "start + 50". 
@@ -377,11 +362,17 @@ def dm_messages_v1(token, dm_id, start):
        This function returns a new index "end" which is the value of "start + 50", 
        or, if this function has returned the least recent messages in the channel, 
        returns -1 in "end" to indicate there are no more messages to load after this return.
+       Given before, after or cursor instead, return up to limit messages
+       sent right before or after a message, see messages_page() in src/helpers.py.
 
         Arguements:
         - token (JWTs encode data): A token refering to a user's id in the database.
         - dm_id (type integer): An integer refering to a dm's id in the database.
         - start (type integer): An integer as an index for the starting position of messages.
+        - before (type integer): Optional, the id of the message to return the messages before.
+        - after (type integer): Optional, the id of the message to return the messages after.
+        - cursor (type string): Optional, the 'next_cursor' of a page returned before.
+        - limit (type integer): The number of messages in a page, from 1 to 50.
 
         Exceptions:
         AccessError Occurs when:
@@ -390,8 +381,12 @@ def dm_messages_v1(token, dm_id, start):
         InputError Occurs when:
             - DM ID is not a valid DM
             - start is greater than the total number of messages in the channel
+            - the message of before, after or cursor is not in the DM
+            - cursor is invalid, or limit is not from 1 to 50
 
         Return Value:
+        Returns a dictionary containing keys: 'messages' and 'next_cursor'
+        given before, after or cursor, see messages_page() in src/helpers.py.
         Returns a dictionary containing keys: 'messages', 'start' and 'end' when:
         - none of the exception are raised
         where:
@@ -421,6 +416,9 @@ def dm_messages_v1(token, dm_id, start):
     # AccessError: token corresponding user is not in the DM.
     error_check(InputError , dm_id, [auth_user_id])
 
+    if before is not None or after is not None or cursor is not None:
+        return messages_page('dm', org, auth_user_id, before, after, cursor, limit)
+
     # Check if start is in the range of total number of messages.
     if start > len(org['messages']):
         raise InputError('Start is greater than the total number of messages in the dm')
@@ -436,40 +434,17 @@ def dm_messages_v1(token, dm_id, start):
     }
 
     message_idx = start
+    # Messages are stored oldest first, message_idx counts from the most recent.
     # Add messages into messages_list
     if end > 0:
         while message_idx < len(org['messages']) and message_idx < end:
-            message = org['messages'][message_idx]
-            output_reacts = message['reacts']
-            if auth_user_id in output_reacts[0]['u_ids']:
-                output_reacts[0]['is_this_user_reacted'] = True
-            else:
-                output_reacts[0]['is_this_user_reacted'] = False
-            messages_list['messages'].append({
-                'message_id': message['message_id'],
-                'u_id': message['u_id'],
-                'message': message['message'],
-                'time_created': message['time_created'],
-                'is_pinned': message['is_pinned'],
-                'reacts': output_reacts,
-            })
+            message = org['messages'][-1 - message_idx]
+            messages_list['messages'].append(message_view(message, auth_user_id))
             message_idx += 1
     else:
         while message_idx < len(org['messages']):
-            message = org['messages'][message_idx]
-            output_reacts = message['reacts']
-            if auth_user_id in output_reacts[0]['u_ids']:
-                output_reacts[0]['is_this_user_reacted'] = True
-            else:
-                output_reacts[0]['is_this_user_reacted'] = False
-            messages_list['messages'].append({
-                'message_id': message['message_id'],
-                'u_id': message['u_id'],
-                'message': message['message'],
-                'time_created': message['time_created'],
-                'is_pinned': message['is_pinned'],
-                'reacts': output_reacts,
-            })
+            message = org['messages'][-1 - message_idx]
+            messages_list['messages'].append(message_view(message, auth_user_id))
             message_idx += 1
 
     return messages_list
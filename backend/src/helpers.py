@@ -1,8 +1,13 @@
-import random
-import json
+import base64
 from datetime import datetime, timezone
+from src import config
+from src import verify_indexes
 from src.data import data
 from src.error import AccessError, InputError, DuplicateError
+from src.ids import RANGES, allocate
+from src.persistence import request_flush, load, mark_changed, mark_pushed, mark_reset
+from src.indexes import user_position, handle_position, org_position, index_message, message_location
+from src.indexes import is_org_member, is_org_owner, is_session, message_position, reacted_users
 
 def find(string_type, position, search_object):
     '''Description: Find user, channel, dm or message
@@ -57,49 +62,31 @@ def find_handle(to_find_handle):
 
     Returns index of user if found, otherwise returns -1
     '''
-    for user_idx in range(len(data['users'])):
-        user = data['users'][user_idx]['public_info']
-        handle = user['handle_str']
-        if to_find_handle == handle:
-            return user_idx
+    return handle_position(to_find_handle)
 
 def find_session(to_search_session, user_position_in_db):
-    '''Find index of session_id with given position of user(search_object)
+    '''Find session_id with given position of user(search_object)
+    in the session table, see src/indexes.py.
 
-    Returns index of session if found, otherwise returns -1
+    Returns index of user if found, otherwise returns -1
     '''
     user = data['users'][user_position_in_db]
-    for session_idx in range(len(user['sessions'])):
-        session = user['sessions'][session_idx]
-        if to_search_session == session:
-            return session_idx
+    if is_session(user['auth_user_id'], to_search_session):
+        return user_position_in_db
     return -1
 
 def find_user(search_object, data_channel_idx, is_owner):
     '''Find index of user with auth_user_id(search_object)
     in the database or in the channel - data['channels'][data_channel_idx]
 
-    Returns index of user if found, otherwise returns -1
+    Returns index of user in the database if found, otherwise returns -1
     '''
-    searching_domain = []
     if data_channel_idx is None:
-        searching_domain = data['users']
-        for user_idx in range(len(searching_domain)):
-            if search_object == searching_domain[user_idx]['public_info']['u_id']:
-                if check_validity(user_idx) is False:
-                    return -1
-                return user_idx
-        return -1
-    else:
-        if is_owner:
-            searching_domain = data['channels'][data_channel_idx]['owner_members']
-        else:
-            searching_domain = data['channels'][data_channel_idx]['all_members']
-    return_user_idx = 0
-    for return_user_idx in range(len(searching_domain)):
-        if search_object == searching_domain[return_user_idx]['u_id']:
-            return return_user_idx
-    return -1
+        user_idx = user_position(search_object)
+        if user_idx < 0 or check_validity(user_idx) is False:
+            return -1
+        return user_idx
+    return find_org_member('channel', data_channel_idx, search_object, is_owner)
 
 def check_validity(user_position):
     '''Checks whether the user at user_position is valid or not.
@@ -109,33 +96,31 @@ def check_validity(user_position):
 def find_user_dm(search_object, data_dm_idx, is_owner):
     '''Find user index corresponding to given search_object.
 
-    Returns index of user if found, otherwise returns -1
+    Returns index of user in the database if found, otherwise returns -1
     '''
-    operator = data['dms'][data_dm_idx]
+    return find_org_member('dm', data_dm_idx, search_object, is_owner)
 
-    member_list = []
+def find_org_member(org_type, org_idx, u_id, is_owner):
+    '''Find user with u_id among the members, or owners if is_owner,
+    of the channel or dm - data[org_type + 's'][org_idx].
+
+    Returns index of user in the database if found, otherwise returns -1
+    '''
+    org_id = data[org_type + 's'][org_idx][org_type + '_id']
     if is_owner:
-        member_list = operator['owner_members']
+        found = is_org_owner(org_type, org_id, u_id)
     else:
-        member_list = operator['all_members']
-
-    for member_idx in range(len(member_list)):
-        if search_object == member_list[member_idx]['u_id']:
-            return member_idx
-
-    return -1
+        found = is_org_member(org_type, org_id, u_id)
+    if not found:
+        return -1
+    return user_position(u_id)
 
 def find_channel(channel_id, is_public):
     '''Find channel corresponding to given channel_id.
 
     Returns index of channel if found, otherwise returns -1
     '''
-    return_channel_idx = -1
-    for channel_idx in range(len(data['channels'])):
-        if channel_id == data['channels'][channel_idx]['channel_id']:
-            # print("Found")
-            return_channel_idx = channel_idx
-            break
+    return_channel_idx = org_position('channel', channel_id)
     if is_public and return_channel_idx != -1:
         # in this case it's channel_idX
         channel = data['channels'][return_channel_idx]
@@ -149,41 +134,24 @@ def find_dm(dm_id):
 
     Returns index of dm if found, otherwise returns -1
     '''
-    for dm_idx in range(len(data['dms'])):
-        dmi = data['dms'][dm_idx]
-        if dm_id == dmi['dm_id']:
-            return dm_idx
-    return -1
+    return org_position('dm', dm_id)
 
 def find_message(message_id):
-    '''Find the position of a message in the msg_position list]
-    as well as its position in the channel.
+    '''Find a message and the channel or dm it is in, see src/indexes.py.
 
-    Returns the idx of msg in org and msg_p,
+    Returns the message,
     exact org,
-    msg_po_idx for data['msg_positions'][msg_po_idx]
+    type of the org ('channel' or 'dm'),
+    id of the org
     '''
-    # Find which org this msg belongs to
-    for po_idx in range(len(data['msg_positions'])):
-        msg_po_idx = data['msg_positions'][po_idx]
-        # Found org, find msg_idx
-        for msg_idx in range(len(msg_po_idx['message_ids'])):
-            # Found position index of msg in org
-            if message_id == msg_po_idx['message_ids'][msg_idx]:
-                org_id = msg_po_idx['id']
-                # print(f"Found msg in position db. {msg_po_idx}")
-                if msg_po_idx['type'] == 'channel':
-                    # print("Finding msg in a channel")
-                    operating_position_in_db = find('channel', None, org_id)
-                    operation = data['channels'][operating_position_in_db]
-                elif msg_po_idx['type'] == 'dm':
-                    # print("Finding msg in a dm")
-                    operating_position_in_db = find('dm', None, org_id)
-                    operation = data['dms'][operating_position_in_db]
-                return msg_idx, operation, msg_po_idx
-    return -1
+    location = message_location(message_id)
+    if location is None:
+        return -1
+    org_type, org_id, message = location
+    org = data[org_type + 's'][org_position(org_type, org_id)]
+    return message, org, org_type, org_id
 
-def update_user_stats(ids, org_type, is_add):
+def update_user_stats(ids, org_type, is_add, lookup=None):
     '''Update statistics for an individual user.
 
     Parameters:
@@ -191,6 +159,7 @@ def update_user_stats(ids, org_type, is_add):
     * org_type is one string out of the three: 'channels' or 'dms' or 'messages'.
     * is_add is a bool type value.
     '''
+    find_by_id = finder(lookup)
     current_time = datetime.now().replace(tzinfo=timezone.utc).timestamp()
     if org_type == 'messages':
         key_a = org_type +'_sent'
@@ -198,7 +167,7 @@ def update_user_stats(ids, org_type, is_add):
         key_a = org_type + '_joined'
     key_b = 'num_' + key_a
     for auth_user_id in ids:
-        user_idx = find('user', None, auth_user_id)
+        user_idx = find_by_id('user', None, auth_user_id)
         this_user = data['users'][user_idx]
         curr_num = this_user['stats'][key_a][-1][key_b]
         if is_add:
@@ -206,6 +175,7 @@ def update_user_stats(ids, org_type, is_add):
         else:
             curr_org_joined = {key_b: curr_num - 1, 'time_stamp': current_time}
         this_user['stats'][key_a].append(curr_org_joined)
+        mark_pushed(['user', auth_user_id, key_a], this_user['stats'][key_a])
 
 def update_users_stats(org_type, is_add):
     '''Update statistics for the dream system.
@@ -226,6 +196,7 @@ def update_users_stats(org_type, is_add):
                            'time_stamp': current_time,
                            }
     data['dreams_stats'][key_a].append(curr_orgs_exist)
+    mark_pushed(['dreams_stats', None, key_a], data['dreams_stats'][key_a])
 
 def pack(type_string, pack_object, return_dict):
     '''Pack type_string into a dictionary in respect of pack_object.
@@ -241,7 +212,14 @@ def pack(type_string, pack_object, return_dict):
 
     return return_dict
 
-def error_check(error_type, domain, check_objects):
+def finder(lookup):
+    '''Returns find(), or the find() of lookup if one is given, see src/lookup.py.
+    '''
+    if lookup is None:
+        return find
+    return lookup.find
+
+def error_check(error_type, domain, check_objects, lookup=None):
     '''Check whether the operation with check_object requires an exception or not.
 
     Error_type is the exact error.
@@ -250,10 +228,12 @@ def error_check(error_type, domain, check_objects):
     that haven't been covered yet.
 
     * raises an AccessError if check_object is type _id and check_object is not in domain
+    * lookup is the Lookup of the request if it has one, see src/lookup.py
     '''
+    find_by_id = finder(lookup)
     if error_type == AccessError:
         if domain == 'db_user':
-            found_auth_user_id = find('user', None, check_objects[0])
+            found_auth_user_id = find_by_id('user', None, check_objects[0])
             if found_auth_user_id < 0:
                 raise AccessError(description = f"Invalid auth_user_id {check_objects[0]}")
             found_session = find('session', found_auth_user_id, check_objects[1])
@@ -262,30 +242,22 @@ def error_check(error_type, domain, check_objects):
         elif domain == 'message_auth':
             is_sender       = False
             is_authorised   = False
-            results = find('message', None, check_objects[0])
+            results = find_by_id('message', None, check_objects[0])
             operating_org = results[1]
-            actual_msg = operating_org['messages'][results[0]]
+            actual_msg = results[0]
             u_id = check_objects[1]
             if u_id == actual_msg['u_id']:
                 is_sender = True
-            for owners in operating_org['owner_members']:
-                if u_id == owners['u_id']:
-                    is_authorised = True
-                    break
+            if is_org_owner(results[2], results[3], u_id):
+                is_authorised = True
             if is_sender is False and is_authorised is False:
-                dis_p = data['users'][find('user', None, u_id)]
+                dis_p = data['users'][find_by_id('user', None, u_id)]
                 raise AccessError(description =
                     f"The user attempting to edit this message has no authorisation."\
                     f"auth_id: {dis_p}, owner_members: {operating_org['owner_members']}"
                 )
         elif domain == 'owner':
-            member_idx = 0
-            is_owner = False
-            while member_idx < len(check_objects[1]['owner_members']):
-                if check_objects[0] == check_objects[1]['owner_members'][member_idx]['u_id']:
-                    is_owner = True
-                member_idx += 1
-            if is_owner is False:
+            if not is_org_owner(check_objects[1], check_objects[2], check_objects[0]):
                 raise AccessError(f"User with id is not an owner")
         elif isinstance(domain, int):
             # find_result = find('user', domain, check_object)
@@ -294,28 +266,28 @@ def error_check(error_type, domain, check_objects):
                 raise AccessError(description = f"Invalid auth_user_id {check_objects[0]} not in domain {domain}")
     if error_type == InputError:
         if domain == 'db_channel':
-            find_result = find('channel', None, check_objects[0])
+            find_result = find_by_id('channel', None, check_objects[0])
             # print(f"Result found for finding channel with {check_objects[0]} is {find_result}")
             if find_result < 0:
                 raise InputError(description = f"Invalid channel_id {check_objects[0]}")
         if domain == 'db_user':
-            find_result = find('user', None, check_objects[0])
+            find_result = find_by_id('user', None, check_objects[0])
             if find_result < 0:
                 raise InputError(description = f"Invalid auth_user_id {check_objects[0]}")
         if domain == 'db_dm':
-            find_result = find('dm', None, check_objects[0])
+            find_result = find_by_id('dm', None, check_objects[0])
             if find_result < 0:
                 raise InputError(description = f"Invalid dm_id {check_objects[0]}")
         if domain == 'message':
-            find_result = find('message', None, check_objects[0])
+            find_result = find_by_id('message', None, check_objects[0])
             if find_result == -1:
                 raise InputError(f"Message with id {check_objects[0]} does not exist.")
         if domain == 'check_pin':
-            if check_objects[0]['messages'][check_objects[1]]['is_pinned'] is True:
-                raise InputError(f"Message with ID {check_objects[1]} is already pinned")
+            if check_objects[0]['is_pinned'] is True:
+                raise InputError(f"Message with ID {check_objects[0]['message_id']} is already pinned")
         if domain == 'check_unpin':
-            if check_objects[0]['messages'][check_objects[1]]['is_pinned'] is False:
-                raise InputError(f"Message with ID {check_objects[1]} is not pinned")
+            if check_objects[0]['is_pinned'] is False:
+                raise InputError(f"Message with ID {check_objects[0]['message_id']} is not pinned")
         if domain == 'time':
             if check_objects[0] < 0:
                 raise InputError("Time given is in the past")
@@ -346,52 +318,30 @@ def randomise(type_string):
     '''Description: randomise an id corresponding to the type described by the string.
 
     Type_string is a string that follows one of the following:
-        - 'user_id' or 'channel_id' or 'message_id'.
+        - 'user_id' or 'channel_id' or 'dm_id' or 'message_id' or 'session_id'.
     (we can modify string_type, for instance let u for user and c for channel etc)
+    Ids are given out by src/ids.py.
     Returns this id.
     '''
-    if type_string == 'user_id':
-        uid = random.randint(1000000, 9999999)
-        if len(data['users']) >= 9000000:
-            raise InputError("Too many users.")
-        while find('user', None, uid) != -1:
-            uid = random.randint(1000000, 9999999)
-        return uid
-    if type_string == 'channel_id':
-        cid = random.randint(1000000, 9999999)
-        if len(data['channels']) >= 9000000:
-            raise InputError("Too many channels.")
-        while find('channel', None, cid) != -1:
-            cid = random.randint(1000000, 9999999)
-        return cid
-    if type_string == 'dm_id':
-        dmid = random.randint(1000000, 9999999)
-        if len(data['dms']) >= 9000000:
-            raise InputError("Too many dms.")
-        while find('dm', None, dmid) != -1:
-            dmid = random.randint(1000000, 9999999)
-        return dmid
-    if type_string == 'message_id':
-        mid = random.randint(10000000, 99999999)
-        while find('message', None, mid) != -1:
-            mid = random.randint(10000000, 99999999)
-        return mid
-    raise InputError("Wrong input string.")
-
-def send_notification(user_ids, notification_message, trigger_type, place):
+    if type_string not in RANGES:
+        raise InputError("Wrong input string.")
+    return allocate(type_string)
+
+def send_notification(user_ids, notification_message, trigger_type, place, lookup=None):
     '''Description: Send the notification to the user with user_id
     '''
+    find_by_id = finder(lookup)
     tagged_user_id = user_ids[0]
 
     tager_id = user_ids[1]
-    tager_position = find('user', None, tager_id)
+    tager_position = find_by_id('user', None, tager_id)
     tager = data['users'][tager_position]['public_info']
 
     place_type = place[0]
     place_id = place[1]
 
     key = place_type + '_name'
-    place_name = data[place_type + 's'][find(place_type, None, place_id)][key]
+    place_name = data[place_type + 's'][find_by_id(place_type, None, place_id)][key]
 
     if trigger_type == 'tagged':
         tag_msg = notification_message[0:19]
@@ -399,15 +349,16 @@ def send_notification(user_ids, notification_message, trigger_type, place):
     else:
         to_notify_message = f"{tager['handle_str']} added you to {place_name}"
 
-    tagged_user = insert_message('notification', tagged_user_id, to_notify_message)
+    tagged_user = insert_message('notification', tagged_user_id, to_notify_message, lookup)
     if place_type == 'channel':
-        tagged_user['notifications'][0]['dm_id'] = -1
+        tagged_user['notifications'][-1]['dm_id'] = -1
     else:
-        tagged_user['notifications'][0]['channel_id'] = -1
-    tagged_user['notifications'][0][place_type + '_id'] = place_id
+        tagged_user['notifications'][-1]['channel_id'] = -1
+    tagged_user['notifications'][-1][place_type + '_id'] = place_id
 
-def insert_message(org_type, org_id, to_insert_message):
-    '''Description: Insert the message string into the target position
+def insert_message(org_type, org_id, to_insert_message, lookup=None):
+    '''Description: Append the message string to the messages of the channel or dm,
+    or the notifications of the user, which are kept oldest first.
 
     org_type is a string that follows one of the following:
         - 'channel' or 'dm' or 'notification'.
@@ -418,53 +369,169 @@ def insert_message(org_type, org_id, to_insert_message):
     Returns this id if not notification.
     No reaction if notification.
     '''
+    find_by_id = finder(lookup)
     if org_type == 'notification':
-        user_idx = find('user', None, org_id)
+        user_idx = find_by_id('user', None, org_id)
         user = data['users'][user_idx]
         notification = {
             'notification_message': to_insert_message,
         }
-        user['notifications'].insert(0, notification)
+        user['notifications'].append(notification)
+        mark_pushed(['user', org_id, 'notifications'], user['notifications'])
         return user
 
     if len(to_insert_message['message']) == 0:
         return
-    doc_idx = 0
-    while doc_idx < len(data['msg_positions']):
-        doc = data['msg_positions'][doc_idx]
-        if doc['type'] == org_type:
-            if org_id == doc['id']:
-                doc['message_ids'].insert(0, to_insert_message['message_id'])
-                break
-        doc_idx += 1
-    if doc_idx == len(data['msg_positions']):
-        data['msg_positions'].append(
-            {
-                'message_ids'   : [
-                    to_insert_message['message_id'],
-                ],
-                'type'          : org_type,
-                'id'            : org_id,
-            },
-        )
-    # print(f"Msg insert called. MSG_POSITION DATA is now:\n{data['msg_positions']}")
     # print(f"Sending in type {org_type} with id {org_id} with msg {to_insert_message}")
-    org_position_in_db = find(org_type, None, org_id)
+    org_position_in_db = find_by_id(org_type, None, org_id)
     org = data[org_type + 's'][org_position_in_db]
-    org['messages'].insert(0, to_insert_message)
+    org['messages'].append(to_insert_message)
+    index_message(org_type, org_id, to_insert_message)
+    mark_changed('message', [org_type, org_id, to_insert_message['message_id']])
+
+def message_view(message, auth_user_id):
+    '''Returns message as shown to the user with auth_user_id,
+    with 'is_this_user_reacted' set in each of its reacts.
+
+    The stored message is left as it is, so reading it does not change data.
+    '''
+    return {
+        'message_id': message['message_id'],
+        'u_id': message['u_id'],
+        'message': message['message'],
+        'time_created': message['time_created'],
+        'is_pinned': message['is_pinned'],
+        'reacts': [
+            {
+                'react_id': react['react_id'],
+                'u_ids': list(react['u_ids']),
+                'is_this_user_reacted': auth_user_id in reacted_users(message, react['react_id']),
+            }
+            for react in message['reacts']
+        ],
+    }
+
+def encode_cursor(direction, messages, position):
+    '''Returns the cursor of the page of messages 'before' or 'after'
+    (direction) the message at position in messages.
+
+    The cursor holds the message_id and time_created of the message, and
+    the number of messages before it sent at the same time_created.
+    '''
+    message = messages[position]
+    ties = position - time_position(messages, message['time_created'], True)
+    value = f"{direction}:{message['message_id']}:{message['time_created']!r}:{ties}"
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+def decode_cursor(cursor):
+    '''Returns (direction, message_id, time_created, ties) of a cursor given
+    by encode_cursor(). time_created is None for cursors given before it
+    was part of them, and ties 0 for those given before ties were.
 
-# Function that dumps the current state of data into the file json file
-# backup.json.
+    Raises an InputError if cursor was not given by it.
+    '''
+    try:
+        fields = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        direction, message_id = fields[0], int(fields[1])
+        time_created = float(fields[2]) if len(fields) > 2 else None
+        ties = int(fields[3]) if len(fields) > 3 else 0
+        if len(fields) > 4 or ties < 0:
+            raise ValueError(cursor)
+    except (ValueError, IndexError, UnicodeError, AttributeError):
+        raise InputError(description = "Invalid cursor") from None
+    if direction not in ['before', 'after']:
+        raise InputError(description = "Invalid cursor")
+    return direction, message_id, time_created, ties
+
+def time_position(messages, time_created, inclusive):
+    '''Returns the position of the first of messages, which are oldest first,
+    sent after time_created, or at it if inclusive, len(messages) if none is.
+    '''
+    low, high = 0, len(messages)
+    while low < high:
+        middle = (low + high) // 2
+        sent = messages[middle]['time_created']
+        if sent < time_created or (sent == time_created and not inclusive):
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def messages_page(org_type, org, auth_user_id, before, after, cursor, limit):
+    '''Description: Return up to limit messages of the channel or dm org
+    sent right before the message with id before, or right after the
+    message with id after, or as described by cursor.
+
+    The message they are relative to is found through the index of
+    positions, see message_position() in src/indexes.py, so a page costs
+    the same however far back in the history it is. If the message of a
+    cursor was removed since, the page goes on from where it was, found
+    by its time_created, and among the messages sent at the same time by
+    how many of them were before it.
+
+    Returns { 'messages', 'next_cursor' } where messages are most recent first,
+    and next_cursor gives the next page further in the same direction,
+    None if there are no more messages that way.
+    '''
+    if cursor is not None:
+        if before is not None or after is not None:
+            raise InputError(description = "Give either a cursor or before or after")
+        direction, anchor_id, anchor_time, anchor_ties = decode_cursor(cursor)
+    elif before is not None and after is not None:
+        raise InputError(description = "Give either before or after")
+    elif before is not None:
+        direction, anchor_id, anchor_time, anchor_ties = 'before', before, None, 0
+    else:
+        direction, anchor_id, anchor_time, anchor_ties = 'after', after, None, 0
+    if not isinstance(limit, int) or limit < 1 or limit > 50:
+        raise InputError(description = f"Invalid limit {limit}, must be from 1 to 50")
+
+    # Messages are stored oldest first.
+    messages = org['messages']
+    # The page is of the messages before start, or from end on.
+    location = message_location(anchor_id)
+    if location is not None and location[0] == org_type and location[1] == org[org_type + '_id']:
+        start = message_position(anchor_id)
+        end = start + 1
+    elif anchor_time is not None:
+        ties_at = time_position(messages, anchor_time, True)
+        start = min(ties_at + anchor_ties, time_position(messages, anchor_time, False))
+        end = start
+    else:
+        raise InputError(description = f"Message with id {anchor_id} is not in this {org_type}")
+
+    if direction == 'before':
+        first = max(start - limit, 0)
+        positions = range(start - 1, first - 1, -1)
+        has_more = first > 0
+    else:
+        last = min(end + limit - 1, len(messages) - 1)
+        positions = range(last, end - 1, -1)
+        has_more = last < len(messages) - 1
+
+    page = []
+    for position in positions:
+        message = messages[position]
+        page.append(message_view(message, auth_user_id))
+
+    next_cursor = None
+    if has_more and len(page) > 0:
+        if direction == 'before':
+            next_cursor = encode_cursor('before', messages, first)
+        else:
+            next_cursor = encode_cursor('after', messages, last)
+    return {
+        'messages': page,
+        'next_cursor': next_cursor,
+    }
+
+# Function that writes the changes made to data into storage,
+# see src/persistence.py.
 def data_dump():
-    with open('src/backup.json', 'w') as file:
-        file.write(json.dumps(data))
+    if config.verify_indexes:
+        verify_indexes.verify()
+    request_flush()
 
 # Function that loads data into the server.
 def data_load():
-    with open('src/backup.json', 'r') as file:
-        data_backup = json.loads(file.read())
-        data['users'] = data_backup['users']
-        data['channels'] = data_backup['channels']
-        data['dms'] = data_backup['dms']
-        data['msg_positions'] = data_backup['msg_positions']
-        data['dreams_stats'] = data_backup['dreams_stats']
+    load()
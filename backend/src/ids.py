@@ -0,0 +1,117 @@
+'''Allocation of ids for users, channels, dms, messages and sessions.
+
+Each kind of id has a counter of the ids given out so far. The next id is
+the counter passed through a permutation of the range of that kind, keyed
+by a secret and the kind, so ids are unique without looking through data and cannot be
+told from one another without the key.
+
+The permutation is a Feistel network over the smallest even number of bits
+covering the range, applied again while the result falls outside of it.
+
+User ids keep seven digits, so there can be at most 9000000 accounts over
+the lifetime of the store, as users are never removed. Ids of channels,
+dms, messages and sessions are given out over every count up to
+MAX_ID, the largest integer a JavaScript number holds exactly, which is
+not reached in practice. These ranges were seven and eight digits wide
+before. Counters kept from then carry on in the wider range, and ids
+given out from it which are still in use are skipped like any other
+taken id.
+
+data['ids'] holds the key and the counters, and is stored along with the
+rest of data. It is empty until the first id is given out, which is also
+the case for data stored before ids were allocated this way: ids already
+taken in data are then skipped.
+'''
+import hashlib
+import secrets
+import threading
+from src.data import data
+from src.error import InputError
+from src.indexes import index, user_position, org_position, is_session_id_taken
+from src.persistence import mark_changed
+
+MAX_ID = 2 ** 53 - 1
+
+# (lowest id, highest id, name used when there are no ids left)
+RANGES = {
+    'user_id'   : (1000000, 9999999, 'users'),
+    'channel_id': (1000000, MAX_ID, 'channels'),
+    'dm_id'     : (1000000, MAX_ID, 'dms'),
+    'message_id': (10000000, MAX_ID, 'messages'),
+    'session_id': (1000000, MAX_ID, 'sessions'),
+}
+
+ROUNDS = 4
+
+# Held while an id is given out.
+ids_lock = threading.Lock()
+
+def new_state():
+    '''Returns the state of an allocator which has not given out any id.
+    '''
+    state = {'key': secrets.token_hex(16)}
+    for kind in RANGES:
+        state[kind] = 0
+    return state
+
+def half_bits(size):
+    '''Returns the number of bits in each half of a Feistel network covering size values.
+    '''
+    bits = max(size - 1, 1).bit_length()
+    return (bits + 1) // 2
+
+def feistel(key, kind, half, value):
+    '''Returns value permuted by the Feistel network of kind with halves of half bits.
+    '''
+    mask = (1 << half) - 1
+    left = value >> half
+    right = value & mask
+    for round_idx in range(ROUNDS):
+        digest = hashlib.blake2b(
+            f"{kind}:{round_idx}:{right}".encode(), key=key, digest_size=8
+        ).digest()
+        left, right = right, left ^ (int.from_bytes(digest, 'big') & mask)
+    return (left << half) | right
+
+def permute(key, kind, size, value):
+    '''Returns the position value in [0, size) is moved to by the keyed permutation of kind.
+    '''
+    half = half_bits(size)
+    value = feistel(key, kind, half, value)
+    while value >= size:
+        value = feistel(key, kind, half, value)
+    return value
+
+def is_taken(kind, new_id):
+    '''Returns True if new_id is already the id of something of kind in data.
+    '''
+    if kind == 'user_id':
+        return user_position(new_id) >= 0
+    if kind in ['channel_id', 'dm_id']:
+        return org_position(kind[:-3], new_id) >= 0
+    if kind == 'message_id':
+        return new_id in index['messages']
+    # Sessions stored before they had a counter were drawn from the same range.
+    return is_session_id_taken(new_id)
+
+def allocate(kind):
+    '''Description: Give out the next id of kind, one of the keys of RANGES.
+
+    Returns this id.
+    '''
+    low, high, name = RANGES[kind]
+    size = high - low + 1
+    with ids_lock:
+        if not data['ids']:
+            data['ids'].update(new_state())
+        state = data['ids']
+        key = bytes.fromhex(state['key'])
+        while True:
+            if state[kind] >= size:
+                raise InputError(f"Too many {name}.")
+            new_id = low + permute(key, kind, size, state[kind])
+            state[kind] += 1
+            if not is_taken(kind, new_id):
+                break
+    mark_changed('ids', None)
+    return new_id
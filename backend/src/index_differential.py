@@ -0,0 +1,186 @@
+'''Differential test of the indexes against going through data.
+
+Loads a backup, then makes random handler calls on it, checking the
+indexes with src/verify_indexes.py after each of them. The calls are
+made by users the test registers, on the users, channels, dms and
+messages of the backup as well as their own, and with missing ids now
+and then. Calls raising InputError or AccessError are counted, as most
+random calls are not allowed, and the check runs after them too. Any
+other exception is a bug in the handler, and ends the run as a
+difference.
+
+Usage, from the backend directory:
+
+    python -m src.index_differential [BACKUP [CALLS [SEED]]]
+
+BACKUP is src/backup.json by default and CALLS 200. Nothing is written
+to BACKUP: dumps go to a temporary directory. The same SEED makes the
+same calls again, so a difference found can be reproduced.
+'''
+import sys
+import random
+import tempfile
+import traceback
+from src import config
+from src.error import InputError, AccessError
+from src.data import data
+from src.helpers import data_load
+from src.indexes import index
+from src.verify_indexes import check_indexes
+import src.auth as auth, src.admin as admin, src.channel as channel, src.channels as channels
+import src.dm as dm, src.message as message, src.user as user, src.other as other
+
+NAMES = ['alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot']
+PASSWORD = 'password'
+
+class Caller:
+    '''Makes random handler calls, as users registered for the test.
+    '''
+    def __init__(self, rng):
+        self.rng = rng
+        self.users = []     # [email, token, None while logged out]
+
+    def any_id(self, ids):
+        if len(ids) == 0 or self.rng.random() < 0.1:
+            return self.rng.choice([-1, 0])
+        return self.rng.choice(ids)
+
+    def u_id(self):
+        return self.any_id([user['auth_user_id'] for user in data['users']])
+
+    def org_id(self, org_type):
+        return self.any_id([org[org_type + '_id'] for org in data[org_type + 's']])
+
+    def message_id(self):
+        return self.any_id(list(index['messages']))
+
+    def text(self):
+        if self.rng.random() < 0.05:
+            return ''
+        words = [self.rng.choice(NAMES) for _ in range(self.rng.randint(1, 4))]
+        if self.rng.random() < 0.3 and len(data['users']) > 0:
+            words.append('@' + self.rng.choice(data['users'])['public_info']['handle_str'])
+        return ' '.join(words)
+
+    def query(self):
+        name = self.rng.choice(NAMES)
+        start = self.rng.randint(0, len(name) - 1)
+        return self.rng.choice([name, name[start:], ' ' + name, name + ' ', '@', ''])
+
+    def register(self):
+        email = f"differential{len(self.users)}@example.com"
+        name = self.rng.choice(NAMES)
+        token = auth.auth_register_v2(email, PASSWORD, name, name)['token']
+        self.users.append([email, token])
+
+    def login(self):
+        entry = self.rng.choice(self.users)
+        entry[1] = auth.auth_login_v2(entry[0], PASSWORD)['token']
+
+    def logout(self, token):
+        auth.auth_logout_v1(token)
+        for entry in self.users:
+            if entry[1] == token:
+                entry[1] = None
+
+    def next_call(self):
+        '''Returns (name, function, args) of the next call to make.
+        '''
+        tokens = [token for _, token in self.users if token is not None]
+        if len(tokens) == 0 or self.rng.random() < 0.08:
+            return 'register', self.register, ()
+        token = self.rng.choice(tokens)
+        rng = self.rng
+        calls = [
+            (channels.channels_create_v2, lambda: (token, rng.choice(NAMES), rng.random() < 0.7)),
+            (channel.channel_join_v2, lambda: (token, self.org_id('channel'))),
+            (channel.channel_invite_v2, lambda: (token, self.org_id('channel'), self.u_id())),
+            (channel.channel_leave_v1, lambda: (token, self.org_id('channel'))),
+            (channel.channel_addowner_v1, lambda: (token, self.org_id('channel'), self.u_id())),
+            (channel.channel_removeowner_v1, lambda: (token, self.org_id('channel'), self.u_id())),
+            (dm.dm_create_v1, lambda: (token, [self.u_id() for _ in range(rng.randint(0, 2))])),
+            (dm.dm_invite_v1, lambda: (token, self.org_id('dm'), self.u_id())),
+            (dm.dm_leave_v1, lambda: (token, self.org_id('dm'))),
+            (dm.dm_remove_v1, lambda: (token, self.org_id('dm'))),
+            (message.message_send_v2, lambda: (token, self.org_id('channel'), self.text())),
+            (message.message_senddm_v1, lambda: (token, self.org_id('dm'), self.text())),
+            (message.message_edit_v2, lambda: (token, self.message_id(), self.text())),
+            (message.message_remove_v1, lambda: (token, self.message_id())),
+            (message.message_share_v1, lambda: (
+                token, self.message_id(), self.text(),
+                *rng.choice([(self.org_id('channel'), -1), (-1, self.org_id('dm'))])
+            )),
+            (message.message_pin_v1, lambda: (token, self.message_id())),
+            (message.message_unpin_v1, lambda: (token, self.message_id())),
+            (channel.channel_messages_v2, lambda: (
+                token, self.org_id('channel'), 0, *rng.choice([(self.message_id(), None), (None, self.message_id())])
+            )),
+            (dm.dm_messages_v1, lambda: (
+                token, self.org_id('dm'), 0, *rng.choice([(self.message_id(), None), (None, self.message_id())])
+            )),
+            (other.search_v2, lambda: (token, self.query())),
+            (message.message_react_v1, lambda: (token, self.message_id(), 1)),
+            (message.message_unreact_v1, lambda: (token, self.message_id(), 1)),
+            (user.user_profile_sethandle_v1, lambda: (token, rng.choice(NAMES) + str(rng.randint(0, 9)))),
+            (admin.admin_user_remove_v1, lambda: (token, self.u_id())),
+            (admin.admin_userpermission_change_v1, lambda: (token, self.u_id(), rng.choice([1, 2]))),
+            (self.logout, lambda: (token,)),
+            (self.login, lambda: ()),
+        ]
+        function, make_args = rng.choice(calls)
+        return function.__name__, function, make_args()
+
+def run(backup_path, calls, seed):
+    '''Description: Load backup_path and check the indexes after each of
+    calls random handler calls chosen from seed.
+
+    Returns the differences found after the first call that has any,
+    or the traceback of the first call raising anything other than
+    InputError or AccessError, an empty list if there are neither.
+    '''
+    config.storage_mode = 'json'
+    config.snapshot_format = 'json'
+    config.commit_window = 0
+    config.fork_snapshots = False
+    config.verify_indexes = False
+    config.backup_path = f"{tempfile.mkdtemp()}/backup.json"
+    config.initial_backup_path = backup_path
+
+    data_load()
+    differences = check_indexes()
+    if len(differences) > 0:
+        print(f"After loading {backup_path}:")
+        return differences
+
+    caller = Caller(random.Random(seed))
+    errors = {}
+    for number in range(1, calls + 1):
+        name, function, args = caller.next_call()
+        try:
+            function(*args)
+        except (InputError, AccessError) as error:
+            errors[type(error).__name__] = errors.get(type(error).__name__, 0) + 1
+        except Exception:
+            print(f"Call {number}, {name}{args!r}, raised:")
+            return traceback.format_exc().splitlines()
+        differences = check_indexes()
+        if len(differences) > 0:
+            print(f"After call {number}, {name}{args!r}:")
+            return differences
+    print(f"{calls} calls with seed {seed}, errors raised: {errors or 'none'}")
+    return []
+
+if __name__ == '__main__':
+    if len(sys.argv) > 4:
+        print("Usage: python -m src.index_differential [BACKUP [CALLS [SEED]]]")
+        sys.exit(1)
+    backup = sys.argv[1] if len(sys.argv) > 1 else 'src/backup.json'
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    seed_value = int(sys.argv[3]) if len(sys.argv) > 3 else random.randrange(1 << 30)
+    found = run(backup, count, seed_value)
+    for difference in found:
+        print(difference)
+    if len(found) > 0:
+        print(f"Indexes differ from data (seed {seed_value})")
+        sys.exit(1)
+    print("Indexes agree with data")
@@ -0,0 +1,630 @@
+'''Indexes over data, so that lookups by id do not scan whole lists.
+
+    index['users']  : u_id -> position of the user in data['users']
+    index['emails'] : email -> position of the user in data['users']
+    index['handles']: handle_str -> position of the user in data['users']
+    index['sessions']: set of (u_id, session_id) of the sessions of valid users
+    index['session_ids']: session_id -> number of the sessions in index['sessions']
+                      with session_id
+    index['channels']: channel_id -> position of the channel in data['channels']
+    index['dms']    : dm_id -> position of the dm in data['dms']
+    index['messages']: message_id -> [org_type, org_id, message] locating the
+                      message in the 'messages' of its channel or dm
+    index['positions']: (org_type, org_id) -> {'seqs': {message_id: sequence
+                      number of the message}, 'order': sorted list of the sequence
+                      numbers of the messages in the 'messages' of the channel or dm,
+                      'next': sequence number of the next message appended}
+    index['reacts'] : message_id -> {react_id: set of the u_ids who reacted}
+    index['tokens'] : token -> set of the ids of the messages with the token
+    index['message_tokens']: message_id -> set of the tokens of the message
+    index['trigrams']: trigram -> set of the ids of the messages with the trigram
+    index['message_trigrams']: message_id -> set of the trigrams of the message
+    index['untokenised']: set of (org_type, org_id) of the channels and dms
+                      whose messages are not in index['tokens'] and index['trigrams']
+    index['members']: (org_type, org_id) -> set of the u_ids in 'all_members'
+    index['owners'] : (org_type, org_id) -> set of the u_ids in 'owner_members'
+    index['joined'] : (org_type, u_id) -> set of the ids of the channels or dms
+                      the user is a member of
+
+Users are never removed from data['users'], removed users are only
+marked as invalid, so their positions stay valid. Removed users keep
+their email and handle_str, which stay taken.
+
+Sessions are started and ended through add_session(), remove_session()
+and remove_sessions(), which keep the 'sessions' of the user and the
+session table together.
+
+Channels and dms are added and removed through add_org() and remove_org(),
+which move the positions of the orgs after one removed along with it.
+
+Members and owners of orgs are added and removed through add_member(),
+add_owner(), remove_member() and remove_owner(), which keep the lists of
+the org and its sets together. The lists hold the public_info of each
+user, in the order they joined, which is what is shown of them.
+
+Emails and handles are unique: they are only set through add_user() and
+set_unique_info(), which check and update the index under index_lock.
+
+Messages are indexed by insert_message() and unindexed when removed.
+The message of an entry is None while the history it is in is not read,
+see src/lazy_messages.py, and is filled in by message_location().
+
+The positions of the messages of an org are only indexed once asked for
+through message_position(). Each message is given a sequence number in
+the order of the 'messages' of the org, and its position is where its
+number is in 'order'. Appending a message appends the next number, and
+removing one removes its number, so neither moves the numbers of the
+others.
+
+The reacts of a message are indexed once asked for through reacted_users(),
+and are added and removed through add_react() and remove_react(), which
+keep the 'reacts' of the message and its sets together.
+
+The tokens of a message are the runs of word characters in its text, as
+they are, see TOKEN, and its trigrams are the runs of three characters in
+it. Both are indexed with the message, and the text of an indexed message
+is changed through set_message_text(), which indexes them again.
+The messages of a history which is not read are tokenised when search
+first asks for them through tokenise_orgs(), until then the org is in
+index['untokenised'].
+
+Functions adding to data keep the indexes up to date, and
+rebuild_indexes() is called whenever data is replaced as a whole,
+by data_load() and clear_v1().
+'''
+import re
+import bisect
+import threading
+from src.data import data
+from src.lazy_messages import LazyMessages
+
+index = {
+    'users'     : {},
+    'emails'    : {},
+    'handles'   : {},
+    'sessions'  : set(),
+    'session_ids': {},
+    'channels'  : {},
+    'dms'       : {},
+    'messages'  : {},
+    'positions' : {},
+    'reacts'    : {},
+    'tokens'    : {},
+    'message_tokens': {},
+    'trigrams'  : {},
+    'message_trigrams': {},
+    'untokenised': set(),
+    'members'   : {},
+    'owners'    : {},
+    'joined'    : {},
+}
+
+TOKEN = re.compile(r'\w+')
+
+# Held while an email or handle is checked and taken,
+# while a channel or dm is added or removed,
+# and while a member or owner is added or removed.
+index_lock = threading.RLock()
+
+UNIQUE_INFO_INDEXES = {
+    'email'     : 'emails',
+    'handle_str': 'handles',
+}
+
+def rebuild_indexes():
+    '''Description: Build every index from the current content of data.
+    '''
+    with index_lock:
+        index['users'] = {}
+        index['emails'] = {}
+        index['handles'] = {}
+        index['sessions'] = set()
+        index['session_ids'] = {}
+        for position in range(len(data['users'])):
+            index_user(position)
+        index['messages'] = {}
+        index['positions'] = {}
+        index['reacts'] = {}
+        index['tokens'] = {}
+        index['message_tokens'] = {}
+        index['trigrams'] = {}
+        index['message_trigrams'] = {}
+        index['untokenised'] = set()
+        index['members'] = {}
+        index['owners'] = {}
+        index['joined'] = {}
+        for org_type in ['channel', 'dm']:
+            index[org_type + 's'] = {}
+            index_orgs_from(org_type, 0)
+            for org in data[org_type + 's']:
+                index_org_members(org_type, org)
+                index_org_messages(org_type, org)
+
+def index_user(position):
+    '''Description: Add the user at position in data['users'] to the indexes.
+
+    If an email or handle is shared by several users, as may be the case in
+    data stored before it was indexed, the first of them is kept.
+    '''
+    user = data['users'][position]
+    index['users'][user['auth_user_id']] = position
+    index['emails'].setdefault(user['public_info']['email'], position)
+    index['handles'].setdefault(user['public_info']['handle_str'], position)
+    if user['is_valid']:
+        for session_id in user['sessions']:
+            index_session(user['auth_user_id'], session_id)
+
+def add_user(user):
+    '''Description: Append user to data['users'] and index it,
+    unless its email or handle is taken.
+
+    Returns True if the user was added.
+    '''
+    with index_lock:
+        if email_position(user['public_info']['email']) >= 0:
+            return False
+        if handle_position(user['public_info']['handle_str']) >= 0:
+            return False
+        data['users'].append(user)
+        index_user(len(data['users']) - 1)
+    return True
+
+def set_unique_info(position, key, value):
+    '''Description: Set the 'email' or 'handle_str' of the public_info of the user
+    at position in data['users'] to value, unless another user has it.
+
+    Returns True if it was set.
+    '''
+    unique_index = index[UNIQUE_INFO_INDEXES[key]]
+    with index_lock:
+        if unique_index.get(value, position) != position:
+            return False
+        public_info = data['users'][position]['public_info']
+        if unique_index.get(public_info[key]) == position:
+            del unique_index[public_info[key]]
+        unique_index[value] = position
+        public_info[key] = value
+    return True
+
+def add_session(user, session_id):
+    '''Description: Start the session with session_id for user.
+    '''
+    user['sessions'].append(session_id)
+    index_session(user['auth_user_id'], session_id)
+
+def remove_session(user, session_id):
+    '''Description: End the session with session_id of user.
+
+    Returns True if it was a session of user.
+    '''
+    if (user['auth_user_id'], session_id) not in index['sessions']:
+        return False
+    unindex_session(user['auth_user_id'], session_id)
+    user['sessions'].remove(session_id)
+    return True
+
+def remove_sessions(user):
+    '''Description: End every session of user.
+    '''
+    for session_id in user['sessions']:
+        unindex_session(user['auth_user_id'], session_id)
+    user['sessions'].clear()
+
+def index_session(u_id, session_id):
+    if (u_id, session_id) in index['sessions']:
+        return
+    index['sessions'].add((u_id, session_id))
+    index['session_ids'][session_id] = index['session_ids'].get(session_id, 0) + 1
+
+def unindex_session(u_id, session_id):
+    if (u_id, session_id) not in index['sessions']:
+        return
+    index['sessions'].discard((u_id, session_id))
+    index['session_ids'][session_id] -= 1
+    if index['session_ids'][session_id] == 0:
+        del index['session_ids'][session_id]
+
+def index_orgs_from(org_type, first_position):
+    '''Description: Index the channels or dms from first_position to the end of their list.
+    '''
+    orgs = data[org_type + 's']
+    for position in range(first_position, len(orgs)):
+        index[org_type + 's'][orgs[position][org_type + '_id']] = position
+
+def add_org(org_type, org):
+    '''Description: Append org to data['channels'] or data['dms'] and index it.
+
+    Returns the position of org.
+    '''
+    with index_lock:
+        data[org_type + 's'].append(org)
+        position = len(data[org_type + 's']) - 1
+        index[org_type + 's'][org[org_type + '_id']] = position
+        index_org_members(org_type, org)
+    return position
+
+def remove_org(org_type, position):
+    '''Description: Remove the channel or dm at position, moving the positions
+    of the orgs after it back by one.
+    '''
+    with index_lock:
+        org = data[org_type + 's'].pop(position)
+        del index[org_type + 's'][org[org_type + '_id']]
+        for u_id in index['members'].get((org_type, org[org_type + '_id']), ()):
+            index['joined'][(org_type, u_id)].discard(org[org_type + '_id'])
+        index['members'].pop((org_type, org[org_type + '_id']), None)
+        index['owners'].pop((org_type, org[org_type + '_id']), None)
+        index['positions'].pop((org_type, org[org_type + '_id']), None)
+        index['untokenised'].discard((org_type, org[org_type + '_id']))
+        index_orgs_from(org_type, position)
+
+def index_org_members(org_type, org):
+    '''Description: Index the members and owners of the channel or dm org.
+    '''
+    key = (org_type, org[org_type + '_id'])
+    index['members'][key] = {member['u_id'] for member in org['all_members']}
+    index['owners'][key] = {owner['u_id'] for owner in org['owner_members']}
+    for u_id in index['members'][key]:
+        index['joined'].setdefault((org_type, u_id), set()).add(org[org_type + '_id'])
+
+def add_member(org_type, org, public_info):
+    '''Description: Add the user with public_info to the members of the channel or dm org.
+
+    Returns True if the user was not a member already.
+    '''
+    members = index['members'][(org_type, org[org_type + '_id'])]
+    with index_lock:
+        if public_info['u_id'] in members:
+            return False
+        members.add(public_info['u_id'])
+        org['all_members'].append(public_info)
+        joined = index['joined'].setdefault((org_type, public_info['u_id']), set())
+        joined.add(org[org_type + '_id'])
+    return True
+
+def add_owner(org_type, org, public_info):
+    '''Description: Add the user with public_info to the owners of the channel or dm org.
+
+    Returns True if the user was not an owner already.
+    '''
+    owners = index['owners'][(org_type, org[org_type + '_id'])]
+    with index_lock:
+        if public_info['u_id'] in owners:
+            return False
+        owners.add(public_info['u_id'])
+        org['owner_members'].append(public_info)
+    return True
+
+def remove_member(org_type, org, u_id):
+    '''Description: Remove the user with u_id from the members and owners
+    of the channel or dm org.
+    '''
+    with index_lock:
+        remove_owner(org_type, org, u_id)
+        members = index['members'][(org_type, org[org_type + '_id'])]
+        if u_id in members:
+            members.discard(u_id)
+            index['joined'][(org_type, u_id)].discard(org[org_type + '_id'])
+            org['all_members'][:] = [
+                member for member in org['all_members'] if member['u_id'] != u_id
+            ]
+
+def remove_owner(org_type, org, u_id):
+    '''Description: Remove the user with u_id from the owners of the channel or dm org.
+    '''
+    owners = index['owners'][(org_type, org[org_type + '_id'])]
+    with index_lock:
+        if u_id in owners:
+            owners.discard(u_id)
+            org['owner_members'][:] = [
+                owner for owner in org['owner_members'] if owner['u_id'] != u_id
+            ]
+
+def index_org_messages(org_type, org):
+    '''Description: Index the messages of the channel or dm org.
+
+    The messages of a history which is not read are indexed by id only,
+    and left to tokenise_orgs().
+    '''
+    org_id = org[org_type + '_id']
+    messages = org['messages']
+    if isinstance(messages, LazyMessages) and not messages.loaded:
+        for message_id in message_ids_of(org):
+            index['messages'][message_id] = [org_type, org_id, None]
+        index['untokenised'].add((org_type, org_id))
+        return
+    for message in list.__iter__(messages):
+        index['messages'][message['message_id']] = [org_type, org_id, message]
+        index_text(message)
+
+def message_ids_of(org):
+    '''Returns the ids of the messages of the channel or dm org,
+    without reading them if they are a LazyMessages.
+    '''
+    if isinstance(org['messages'], LazyMessages):
+        return org['messages'].message_ids()
+    return [message['message_id'] for message in org['messages']]
+
+def index_message(org_type, org_id, message):
+    '''Description: Index message, just appended to the channel or dm of org_type with org_id.
+    '''
+    index['messages'][message['message_id']] = [org_type, org_id, message]
+    positions = index['positions'].get((org_type, org_id))
+    if positions is not None:
+        positions['seqs'][message['message_id']] = positions['next']
+        positions['order'].append(positions['next'])
+        positions['next'] += 1
+    if (org_type, org_id) not in index['untokenised']:
+        index_text(message)
+
+def unindex_message(message_id):
+    '''Description: Remove the message with message_id from the index.
+    '''
+    entry = index['messages'].pop(message_id, None)
+    if entry is not None:
+        positions = index['positions'].get((entry[0], entry[1]))
+        if positions is not None and message_id in positions['seqs']:
+            order = positions['order']
+            del order[bisect.bisect_left(order, positions['seqs'].pop(message_id))]
+    index['reacts'].pop(message_id, None)
+    unindex_text(message_id)
+
+def tokens_of(text):
+    return set(TOKEN.findall(text))
+
+def trigrams_of(text):
+    return {text[start:start + 3] for start in range(len(text) - 2)}
+
+# (posting index, index of the message, function giving the keys of a text)
+TEXT_INDEXES = [
+    ('tokens'   , 'message_tokens'  , tokens_of),
+    ('trigrams' , 'message_trigrams', trigrams_of),
+]
+
+def index_text(message):
+    '''Description: Add message to the posting sets of its tokens and trigrams.
+    '''
+    for postings, keys_of_message, keys_of in TEXT_INDEXES:
+        keys = keys_of(message['message'])
+        index[keys_of_message][message['message_id']] = keys
+        for key in keys:
+            index[postings].setdefault(key, set()).add(message['message_id'])
+
+def unindex_text(message_id):
+    '''Description: Remove the message with message_id from the posting sets
+    of its tokens and trigrams.
+    '''
+    for postings, keys_of_message, _ in TEXT_INDEXES:
+        for key in index[keys_of_message].pop(message_id, ()):
+            posting = index[postings][key]
+            posting.discard(message_id)
+            if len(posting) == 0:
+                del index[postings][key]
+
+def set_message_text(message, text):
+    '''Description: Set the text of the indexed message to text,
+    and index its tokens and trigrams.
+    '''
+    with index_lock:
+        message['message'] = text
+        # Messages of a history not tokenised yet are tokenised with it.
+        if message['message_id'] in index['message_tokens']:
+            unindex_text(message['message_id'])
+            index_text(message)
+
+def tokenise_orgs(keys):
+    '''Description: Index the tokens and trigrams of the messages of the channels and dms
+    with the (org_type, org_id) in keys which are not tokenised yet.
+    '''
+    with index_lock:
+        for key in keys:
+            if key not in index['untokenised']:
+                continue
+            position = org_position(key[0], key[1])
+            if position >= 0:
+                for message in data[key[0] + 's'][position]['messages']:
+                    index_text(message)
+            index['untokenised'].discard(key)
+
+def token_candidates(query_str):
+    '''Returns the set of the ids of the tokenised messages which may contain
+    query_str, None if query_str has no word characters to go by.
+
+    Each run of word characters in query_str lies within a token of a message
+    containing it. A run with other characters on both sides is a whole token,
+    one with other characters before it the start of one, one with other
+    characters after it the end of one, and a run that is all of query_str
+    can be anywhere in one.
+    '''
+    matches = list(TOKEN.finditer(query_str))
+    if len(matches) == 0:
+        return None
+    postings = []
+    for match in matches:
+        piece = match.group()
+        starts = match.start() > 0
+        ends = match.end() < len(query_str)
+        if starts and ends:
+            postings.append(index['tokens'].get(piece, set()))
+            continue
+        posting = set()
+        for token, message_ids in index['tokens'].items():
+            if (
+                (starts and token.startswith(piece))
+                or (ends and token.endswith(piece))
+                or (not starts and not ends and piece in token)
+            ):
+                posting |= message_ids
+        postings.append(posting)
+    return intersection(postings)
+
+def trigram_candidates(query_str):
+    '''Returns the set of the ids of the tokenised messages which have every
+    trigram of query_str, None if query_str is too short to have one.
+    '''
+    trigrams = trigrams_of(query_str)
+    if len(trigrams) == 0:
+        return None
+    return intersection([index['trigrams'].get(trigram, set()) for trigram in trigrams])
+
+def intersection(postings):
+    postings = sorted(postings, key=len)
+    candidates = set(postings[0])
+    for posting in postings[1:]:
+        if len(candidates) == 0:
+            break
+        candidates &= posting
+    return candidates
+
+def unindex_org_messages(org):
+    '''Description: Remove the messages of the channel or dm org from the index.
+
+    Returns the number of messages removed.
+    '''
+    message_ids = message_ids_of(org)
+    for message_id in message_ids:
+        unindex_message(message_id)
+    return len(message_ids)
+
+def forget_org_messages(org):
+    '''Description: Drop the messages of the channel or dm org from their entries,
+    keeping them indexed by id, once its history is evicted.
+    '''
+    for message_id in message_ids_of(org):
+        entry = index['messages'].get(message_id)
+        if entry is not None:
+            entry[2] = None
+
+def message_location(message_id):
+    '''Returns [org_type, org_id, message] of the message with message_id,
+    None if there is none.
+    '''
+    entry = index['messages'].get(message_id)
+    if entry is None or entry[2] is not None:
+        return entry
+    # The history of the message was not read when it was indexed.
+    position = org_position(entry[0], entry[1])
+    if position < 0:
+        return None
+    org = data[entry[0] + 's'][position]
+    for message in org['messages']:
+        found = index['messages'].get(message['message_id'])
+        if found is not None:
+            found[2] = message
+    return index['messages'].get(message_id)
+
+def message_position(message_id):
+    '''Returns the position of the message with message_id in the 'messages'
+    of its channel or dm, -1 if there is none.
+    '''
+    location = message_location(message_id)
+    if location is None:
+        return -1
+    key = (location[0], location[1])
+    positions = index['positions'].get(key)
+    if positions is None:
+        org = data[key[0] + 's'][org_position(key[0], key[1])]
+        message_ids = message_ids_of(org)
+        positions = {
+            'seqs'  : {message_id: seq for seq, message_id in enumerate(message_ids)},
+            'order' : list(range(len(message_ids))),
+            'next'  : len(message_ids),
+        }
+        index['positions'][key] = positions
+    seq = positions['seqs'].get(message_id)
+    if seq is None:
+        return -1
+    return bisect.bisect_left(positions['order'], seq)
+
+def reacted_users(message, react_id):
+    '''Returns the set of the u_ids of the users who reacted to message with react_id.
+    '''
+    reacts = index['reacts'].get(message['message_id'])
+    if reacts is None:
+        reacts = {react['react_id']: set(react['u_ids']) for react in message['reacts']}
+        index['reacts'][message['message_id']] = reacts
+    return reacts.get(react_id, set())
+
+def add_react(message, react_id, u_id):
+    '''Description: Add the react with react_id of the user with u_id to message.
+
+    Returns True if the user had not reacted with it already.
+    '''
+    with index_lock:
+        if u_id in reacted_users(message, react_id):
+            return False
+        for react in message['reacts']:
+            if react['react_id'] == react_id:
+                break
+        else:
+            react = {'react_id': react_id, 'u_ids': []}
+            message['reacts'].append(react)
+        react['u_ids'].append(u_id)
+        index['reacts'][message['message_id']].setdefault(react_id, set()).add(u_id)
+    return True
+
+def remove_react(message, react_id, u_id):
+    '''Description: Remove the react with react_id of the user with u_id from message.
+
+    Returns True if the user had reacted with it.
+    '''
+    with index_lock:
+        if u_id not in reacted_users(message, react_id):
+            return False
+        index['reacts'][message['message_id']][react_id].discard(u_id)
+        for react in message['reacts']:
+            if react['react_id'] == react_id:
+                react['u_ids'].remove(u_id)
+    return True
+
+def is_org_member(org_type, org_id, u_id):
+    '''Returns True if the user with u_id is a member of the channel or dm
+    of org_type with org_id.
+    '''
+    return u_id in index['members'].get((org_type, org_id), ())
+
+def is_org_owner(org_type, org_id, u_id):
+    '''Returns True if the user with u_id is an owner of the channel or dm
+    of org_type with org_id.
+    '''
+    return u_id in index['owners'].get((org_type, org_id), ())
+
+def joined_positions(org_type, u_id):
+    '''Returns the positions in data['channels'] or data['dms'] of the orgs
+    of org_type the user with u_id is a member of, in order.
+    '''
+    return sorted(
+        org_position(org_type, org_id) for org_id in index['joined'].get((org_type, u_id), ())
+    )
+
+def is_session(u_id, session_id):
+    '''Returns True if session_id is a session of the user with u_id.
+    '''
+    return (u_id, session_id) in index['sessions']
+
+def is_session_id_taken(session_id):
+    '''Returns True if session_id is a session of any valid user.
+    '''
+    return session_id in index['session_ids']
+
+def user_position(u_id):
+    '''Returns the position in data['users'] of the user with u_id,
+    removed users included, -1 if there is none.
+    '''
+    return index['users'].get(u_id, -1)
+
+def org_position(org_type, org_id):
+    '''Returns the position in data['channels'] or data['dms'] of the org
+    of org_type ('channel' or 'dm') with org_id, -1 if there is none.
+    '''
+    return index[org_type + 's'].get(org_id, -1)
+
+def email_position(email):
+    '''Returns the position in data['users'] of the user with email, -1 if there is none.
+    '''
+    return index['emails'].get(email, -1)
+
+def handle_position(handle_str):
+    '''Returns the position in data['users'] of the user with handle_str, -1 if there is none.
+    '''
+    return index['handles'].get(handle_str, -1)
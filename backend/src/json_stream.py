@@ -0,0 +1,152 @@
+'''Streaming json for snapshots of the data store.
+
+A snapshot is a json object whose values are mostly lists of entities.
+write_object() encodes it one list item at a time and read_object()
+decodes it the same way from chunks of the file, so neither holds more
+than the largest single item as text besides the objects themselves.
+'''
+import json
+import time
+
+CHUNK_SIZE = 1 << 16
+
+# Times an item is encoded before giving up if handlers keep changing it.
+ENCODE_ATTEMPTS = 5
+# Seconds waited before encoding an item again, times the attempts made.
+ENCODE_BACKOFF = 0.001
+
+decoder = json.JSONDecoder()
+
+def encode_changing(encode_once, value):
+    '''Returns encode_once(value), calling it again if a handler changed a
+    dict or set in value while it was encoded, up to ENCODE_ATTEMPTS times.
+
+    Raises the error of the last attempt if value kept changing, and any
+    other error, a RecursionError for a value nested too deep included,
+    at once.
+    '''
+    for attempt in range(1, ENCODE_ATTEMPTS + 1):
+        try:
+            return encode_once(value)
+        except RecursionError:
+            raise
+        except RuntimeError as error:
+            if 'during iteration' not in str(error) or attempt == ENCODE_ATTEMPTS:
+                raise
+        time.sleep(ENCODE_BACKOFF * attempt)
+
+def encode(value):
+    '''Returns value as json, encoding it again if a handler changed it meanwhile,
+    see encode_changing().
+    '''
+    return encode_changing(json.dumps, value)
+
+def write_object(file, obj):
+    '''Description: Write the dictionary obj as a json object to file.
+
+    Values that are lists are written item by item.
+    '''
+    file.write('{')
+    for key_idx, key in enumerate(list(obj)):
+        if key_idx > 0:
+            file.write(', ')
+        file.write(json.dumps(key) + ': ')
+        value = obj[key]
+        if not isinstance(value, list):
+            file.write(encode(value))
+            continue
+        file.write('[')
+        for item_idx, item in enumerate(list(value)):
+            if item_idx > 0:
+                file.write(', ')
+            file.write(encode(item))
+        file.write(']')
+    file.write('}')
+
+class Reader:
+    '''Reads json values from a file, CHUNK_SIZE characters at a time.
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ''
+        self.pos = 0
+
+    def fill(self, size):
+        '''Reads size more characters into the buffer, dropping those used.
+        Returns False at the end of the file.
+        '''
+        text = self.file.read(size)
+        if text == '':
+            return False
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''Returns the next character which is not whitespace, '' at the end of the file.
+        '''
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in ' \t\n\r':
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.fill(CHUNK_SIZE):
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in snapshot")
+        self.pos += 1
+
+    def value(self):
+        '''Returns the next json value, reading more of the file until it is complete.
+        '''
+        self.peek()
+        size = CHUNK_SIZE
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # A number at the end of the buffer may go on in the file.
+            if end == len(self.buffer) and self.fill(size):
+                continue
+            self.pos = end
+            return value
+
+def read_object(file):
+    '''Description: Read a json object from file, one list item at a time.
+
+    Returns the object as a dictionary.
+    '''
+    reader = Reader(file)
+    obj = {}
+    reader.expect('{')
+    if reader.peek() == '}':
+        return obj
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if reader.peek() == '[':
+            reader.expect('[')
+            items = []
+            if reader.peek() == ']':
+                reader.expect(']')
+            else:
+                while True:
+                    items.append(reader.value())
+                    if reader.peek() != ',':
+                        break
+                    reader.expect(',')
+                reader.expect(']')
+            obj[key] = items
+        else:
+            obj[key] = reader.value()
+        if reader.peek() != ',':
+            break
+        reader.expect(',')
+    reader.expect('}')
+    return obj
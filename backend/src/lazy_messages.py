@@ -0,0 +1,138 @@
+'''Message histories read from their segment file on first use.
+
+With config.lazy_messages, data_load() puts a LazyMessages in place of
+the 'messages' list of each channel and dm. It is empty until any list
+operation is used on it, which reads the segment file first, so handlers
+use it as the plain list it stands for. An idle history can be evicted,
+to be read again on its next use.
+
+A segment is the json list of the messages as last written whole, followed
+by the log next to it, which holds one json line per message changed since:
+
+    ['put', message]        the message as it is now, added at the end
+                            if it is not in the list yet
+    ['del', message_id]     the message was removed
+
+Applying a line twice leaves the messages as applying it once.
+'''
+import os
+import json
+import time
+import threading
+
+# Held while a history is read or evicted.
+segment_lock = threading.Lock()
+
+def read_log(log_path):
+    '''Returns (ops, torn) where ops are the lines of the log at log_path,
+    and torn is True if the last one was cut short, as left by a crash
+    while writing, in which case it is left out.
+    '''
+    ops = []
+    if not os.path.exists(log_path):
+        return ops, False
+    with open(log_path, 'r') as file:
+        for line in file:
+            try:
+                ops.append(json.loads(line))
+            except ValueError:
+                return ops, True
+    return ops, False
+
+def apply_log(items, ops, ids_only=False):
+    '''Description: Apply the lines of a log to items, the messages of a
+    segment, or the ids of its messages if ids_only is set.
+    '''
+    if len(ops) == 0:
+        return
+    positions = {}
+    for position, item in enumerate(items):
+        positions[item if ids_only else item['message_id']] = position
+    removed = False
+    for op in ops:
+        if op[0] == 'del':
+            if op[1] in positions:
+                items[positions.pop(op[1])] = None
+                removed = True
+            continue
+        message_id = op[1]['message_id']
+        item = message_id if ids_only else op[1]
+        if message_id in positions:
+            items[positions[message_id]] = item
+        else:
+            positions[message_id] = len(items)
+            items.append(item)
+    if removed:
+        items[:] = [item for item in items if item is not None]
+
+def read_segment(path, log_path):
+    '''Returns the messages of the segment at path with its log at log_path applied.
+    '''
+    messages = []
+    if os.path.exists(path):
+        with open(path, 'r') as file:
+            messages = json.loads(file.read())
+    apply_log(messages, read_log(log_path)[0])
+    return messages
+
+class LazyMessages(list):
+    '''The messages of a channel or dm, oldest first, read from the segment
+    at path and its log at log_path on first use.
+
+    message_ids are the ids of the messages, as recorded with the channel or dm
+    and its log, so that they are known without reading the segment.
+    '''
+    def __init__(self, path, log_path, message_ids):
+        super().__init__()
+        self.path = path
+        self.log_path = log_path
+        self.loaded = False
+        self.unloaded_ids = list(message_ids)
+        self.last_used = time.time()
+
+    def ensure_loaded(self):
+        self.last_used = time.time()
+        if self.loaded:
+            return
+        with segment_lock:
+            if self.loaded:
+                return
+            list.extend(self, read_segment(self.path, self.log_path))
+            self.loaded = True
+
+    def message_ids(self):
+        '''Returns the ids of the messages, without reading the segment.
+        '''
+        if self.loaded:
+            return [message['message_id'] for message in list.__iter__(self)]
+        return list(self.unloaded_ids)
+
+    def evict(self, idle_seconds):
+        '''Description: Drop the messages if unused for idle_seconds.
+
+        Returns True if they were dropped.
+        '''
+        with segment_lock:
+            if not self.loaded or time.time() - self.last_used < idle_seconds:
+                return False
+            self.unloaded_ids = self.message_ids()
+            list.clear(self)
+            self.loaded = False
+        return True
+
+def loading(name):
+    method = getattr(list, name)
+    def wrapper(self, *args, **kwargs):
+        self.ensure_loaded()
+        return method(self, *args, **kwargs)
+    wrapper.__name__ = name
+    return wrapper
+
+for method_name in [
+    '__len__', '__iter__', '__reversed__', '__getitem__', '__setitem__',
+    '__delitem__', '__contains__', '__eq__', '__ne__', '__lt__', '__le__',
+    '__gt__', '__ge__', '__add__', '__iadd__', '__mul__', '__imul__',
+    '__repr__', 'append', 'extend', 'insert', 'remove', 'pop', 'index',
+    'count', 'clear', 'sort', 'reverse', 'copy',
+]:
+    setattr(LazyMessages, method_name, loading(method_name))
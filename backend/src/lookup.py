@@ -0,0 +1,31 @@
+'''Lookups shared by the steps of one request.
+
+A handler creates a Lookup and passes it to error_check() and the helpers
+it calls, so the caller, the channel or dm and the message it is about are
+each found once, however many checks use them.
+
+Only lookups of users, handles, channels, dms and messages by id are kept,
+as membership and sessions change within a request. A Lookup is not to be
+kept past the request, nor used by one which removes a channel or dm,
+since that moves the positions of the orgs after it.
+'''
+from src.helpers import find
+
+class Lookup:
+    '''Results of find() by id for the request it is created for.
+    '''
+    KINDS = ['user', 'handle', 'channel', 'dm', 'message']
+
+    def __init__(self):
+        self.found = {}
+
+    def find(self, string_type, position, search_object):
+        '''Same as find() in src/helpers.py, found once per request
+        for the string_type in KINDS.
+        '''
+        if string_type not in self.KINDS or isinstance(position, int):
+            return find(string_type, position, search_object)
+        key = (string_type, search_object)
+        if key not in self.found:
+            self.found[key] = find(string_type, position, search_object)
+        return self.found[key]
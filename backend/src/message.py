@@ -8,7 +8,9 @@ from datetime import datetime, timezone
 from src.data import data
 from src.auth import detokenise
 from src.error import AccessError, InputError
-from src.helpers import find, error_check, randomise, insert_message, send_notification, data_dump, update_user_stats, update_users_stats, find_message
+from src.helpers import find, error_check, randomise, insert_message, send_notification, data_dump, update_user_stats, update_users_stats, mark_changed
+from src.indexes import unindex_message, is_org_member, add_react, remove_react, set_message_text
+from src.lookup import Lookup
 
 def message_send_v2(token, channel_id, message):
     '''
@@ -42,8 +44,8 @@ def message_send_v2(token, channel_id, message):
             'time_created'  : ,
         }
         Generate msg_id,
-        Add position info into data['msg_positions'],
-        Insert into channel['messages'][0]
+        Add the message to the message index,
+        Append to channel['messages']
 
     Return Value:
         Returns { } on condition of:
@@ -56,11 +58,12 @@ def message_send_v2(token, channel_id, message):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
-    error_check(InputError, 'db_channel', [channel_id])
-    operating_channel_position_in_db = find('channel', None, channel_id)
-    error_check(AccessError, operating_channel_position_in_db, [auth_user_id])
+    error_check(InputError, 'db_channel', [channel_id], lookup)
+    operating_channel_position_in_db = lookup.find('channel', None, channel_id)
+    error_check(AccessError, operating_channel_position_in_db, [auth_user_id], lookup)
     if len(message) > 1000:
         raise InputError("Message length too long.")
 
@@ -79,7 +82,7 @@ def message_send_v2(token, channel_id, message):
 
     to_send_message['message_id'] = randomise('message_id')
     # Channel contains messages
-    insert_message('channel', channel_id, to_send_message)
+    insert_message('channel', channel_id, to_send_message, lookup)
 
     # check if tagged
     tagged_list = is_tagged(message)
@@ -87,7 +90,7 @@ def message_send_v2(token, channel_id, message):
 
     if len(tagged_list) != 0:
         for tag in tagged_list:
-            user_position = find('handle', None, tag['handle'])
+            user_position = lookup.find('handle', None, tag['handle'])
             tagged_user = data['users'][user_position]
             if user_position > -1:
                 user_in_channel = find(
@@ -97,12 +100,11 @@ def message_send_v2(token, channel_id, message):
                 if user_in_channel > -1:
                     send_notification(
                         [tagged_user['public_info']['u_id'], auth_user_id], message,
-                        'tagged', ['channel', channel_id]
+                        'tagged', ['channel', channel_id], lookup
                     )
-    update_user_stats([auth_user_id], 'messages', True)
+    update_user_stats([auth_user_id], 'messages', True, lookup)
     update_users_stats('messages', True)
     data_dump()
-    print(f"Message sent by user {data['users'][find('user', None, auth_user_id)]['public_info']['name_first']} successfully")
     return {
         'message_id': to_send_message['message_id'],
     }
@@ -129,8 +131,8 @@ def message_remove_v1(token, message_id):
 
     Execution:
         Check for three exceptions,
-        Goto position info in data['msg_positions'] for position,
-        Remove msg_positions
+        Find the message through the message index,
+        Remove it from the index
         Remove actual msg in db as well
 
     Return Value:
@@ -144,22 +146,20 @@ def message_remove_v1(token, message_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
-    find_results = find('message', None, message_id)
+    find_results = lookup.find('message', None, message_id)
     if isinstance(find_results, int):
         raise InputError("Message not exist")
-    msg_idx = find_results[0]
+    message = find_results[0]
     operating_org = find_results[1] # Exact organisation containing this message
-    message = operating_org['messages'][msg_idx]
-    position_info_in_msg_po = find_results[2]   # message position info
 
-    error_check(AccessError, 'message_auth', [message_id, auth_user_id])
+    error_check(AccessError, 'message_auth', [message_id, auth_user_id], lookup)
 
     operating_org['messages'].remove(message)
-    position_info_in_msg_po['message_ids'].remove(message_id)
-    if len(position_info_in_msg_po['message_ids']) == 0:
-        data['msg_positions'].remove(position_info_in_msg_po)
+    unindex_message(message_id)
+    mark_changed('message', [find_results[2], find_results[3], message_id])
 
     update_users_stats('messages', False)
     data_dump()
@@ -190,8 +190,8 @@ def message_edit_v2(token, message_id, message):
 
     Execution:
         Check for five exceptions,
-        Goto position info in data['msg_positions'] for position,
-        Apply change into channel['messages'][msg_positions]
+        Find the message through the message index,
+        Apply change into the message
 
     Return Value:
         Returns { } on condition of:
@@ -206,40 +206,38 @@ def message_edit_v2(token, message_id, message):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
-    find_results = find('message', None, message_id)
+    find_results = lookup.find('message', None, message_id)
     if isinstance(find_results, int):
         raise InputError("Message not exist")
-    msg_idx = find_results[0]
     operating_org = find_results[1]
 
-    operator_type = find_results[2]['type']
-    operator_id = find_results[2]['id']
-    operator_pos = find(operator_type, None, operator_id)
+    operator_type = find_results[2]
+    operator_id = find_results[3]
+    operator_pos = lookup.find(operator_type, None, operator_id)
 
-    actual_msg = operating_org['messages'][msg_idx]
+    actual_msg = find_results[0]
 
-    error_check(AccessError, 'message_auth', [message_id, auth_user_id])
+    error_check(AccessError, 'message_auth', [message_id, auth_user_id], lookup)
 
     if len(message) > 1000:
         raise InputError("Message length too long.")
 
     if len(message) == 0:
-        actual_msg = operating_org['messages'][msg_idx]
         update_users_stats('messages', False)
         operating_org['messages'].remove(actual_msg)
-        position_info_in_msg_po = find_results[2]
-        position_info_in_msg_po['message_ids'].remove(message_id)
-        if len(position_info_in_msg_po['message_ids']) == 0:
-            data['msg_positions'].remove(position_info_in_msg_po)
-
-    actual_msg['message'] = message
+        unindex_message(message_id)
+        actual_msg['message'] = message
+    else:
+        set_message_text(actual_msg, message)
+    mark_changed('message', [operator_type, operator_id, message_id])
 
     tagged_list = is_tagged(message)
     if len(tagged_list) != 0:
         for tag in tagged_list:
-            user_position = find('handle', None, tag['handle'])
+            user_position = lookup.find('handle', None, tag['handle'])
             tagged_user = data['users'][user_position]
 
             if user_position > -1:
@@ -250,7 +248,7 @@ def message_edit_v2(token, message_id, message):
                 if user_in_channel > -1:
                     send_notification(
                         [tagged_user['public_info']['u_id'], auth_user_id], message,
-                        'tagged', [operator_type, operator_id]
+                        'tagged', [operator_type, operator_id], lookup
                     )
 
     data_dump()
@@ -288,8 +286,8 @@ def message_senddm_v1(token, dm_id, message):
             'time_created'  : ,
         }
         Generate msg_id,
-        Add position info into data['msg_positions'],
-        Insert into dm['messages'][0]
+        Add the message to the message index,
+        Append to dm['messages']
 
     Return Value:
         Returns { 'message_id' } on condition of:
@@ -307,12 +305,13 @@ def message_senddm_v1(token, dm_id, message):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
     # DM not exist InputError
-    error_check(InputError  , 'db_dm'   , [dm_id])
-    operating_dm_position_in_db = find('dm', None, dm_id)
+    error_check(InputError  , 'db_dm'   , [dm_id], lookup)
+    operating_dm_position_in_db = lookup.find('dm', None, dm_id)
     # User not in DM Access Error
-    error_check(InputError, dm_id, [auth_user_id])
+    error_check(InputError, dm_id, [auth_user_id], lookup)
     if len(message) > 1000:
         raise InputError("Message length too long.")
 
@@ -331,13 +330,13 @@ def message_senddm_v1(token, dm_id, message):
 
     to_send_message['message_id'] = randomise('message_id')
 
-    insert_message('dm', dm_id, to_send_message)
+    insert_message('dm', dm_id, to_send_message, lookup)
 
     # check if tagged
     tagged_list = is_tagged(message)
     if len(tagged_list) != 0:
         for tag in tagged_list:
-            user_position = find('handle', None, tag['handle'])
+            user_position = lookup.find('handle', None, tag['handle'])
             tagged_user = data['users'][user_position]
             if user_position > -1:
                 user_in_dm = find(
@@ -347,10 +346,10 @@ def message_senddm_v1(token, dm_id, message):
                 if user_in_dm > -1:
                     send_notification(
                         [tagged_user['public_info']['u_id'], auth_user_id], message,
-                        'tagged', ['dm', dm_id]
+                        'tagged', ['dm', dm_id], lookup
                     )
 
-    update_user_stats([auth_user_id], 'messages', True)
+    update_user_stats([auth_user_id], 'messages', True, lookup)
     update_users_stats('messages', True)
     data_dump()
 
@@ -418,7 +417,8 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    lookup = Lookup()
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
     operator_type  = None
     operator_id    = -1
@@ -429,23 +429,19 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
         operator_type  = 'channel'
         operator_id    = channel_id
 
-    authen = False
-    operator_target_position = find(operator_type, None, operator_id)
-    for member in data[operator_type + 's'][operator_target_position]['all_members']:
-        if auth_user_id == member['u_id']:
-            authen = True
-    if authen is False:
+    operator_target_position = lookup.find(operator_type, None, operator_id)
+    if not is_org_member(operator_type, operator_id, auth_user_id):
         raise AccessError(
             f"User with auth_user_id: {auth_user_id} has no permission to\
             {operator_type} with id {operator_id}"
         )
     # print(f"In share, about to call find message. Share Target Type = {operator_type}, Share Target Id = {operator_id}")
     # print(f"Passing in parameters into find: msg_id is {og_message_id}")
-    og_message_relevant_results = find('message', None, og_message_id)
+    og_message_relevant_results = lookup.find('message', None, og_message_id)
     # print(f"in share, find result: {og_message_relevant_results}")
-    operator = og_message_relevant_results[1]
-    msg_idx = og_message_relevant_results[0]
-    original_message = operator['messages'][msg_idx]
+    if isinstance(og_message_relevant_results, int):
+        raise InputError("Message not exist")
+    original_message = og_message_relevant_results[0]
     dist = '\n' + ''''''
 
     to_share_message = message + dist + original_message['message'] + dist
@@ -464,12 +460,12 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
         ]
     }
 
-    insert_message(operator_type, operator_id, final_message)
+    insert_message(operator_type, operator_id, final_message, lookup)
 
     tagged_list = is_tagged(message)
     if len(tagged_list) != 0:
         for tag in tagged_list:
-            user_position = find('handle', None, tag['handle'])
+            user_position = lookup.find('handle', None, tag['handle'])
             tagged_user = data['users'][user_position]
 
             if user_position > -1:
@@ -480,10 +476,10 @@ def message_share_v1(token, og_message_id, message, channel_id, dm_id):
                 if user_in_channel > -1:
                     send_notification(
                         [tagged_user['public_info']['u_id'], auth_user_id], message,
-                        'tagged', [operator_type, operator_id]
+                        'tagged', [operator_type, operator_id], lookup
                     )
 
-    update_user_stats([auth_user_id], 'messages', True)
+    update_user_stats([auth_user_id], 'messages', True, lookup)
     update_users_stats('messages', True)
     data_dump()
 
@@ -523,25 +519,26 @@ def message_pin_v1(token, message_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
+    lookup = Lookup()
 
     # Check if auth_user_id invalid
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
     # Check is message exist
-    error_check(InputError, 'message', [message_id])
+    error_check(InputError, 'message', [message_id], lookup)
 
     # Find the channel that message belongs to
-    result = find('message', None, message_id)
+    result = lookup.find('message', None, message_id)
 
-    msg_idx_in_org = result[0]
-    org = result[1]
+    msg = result[0]
     # Check if the user is the owner of the channel or dm
-    error_check(AccessError, 'owner', [auth_user_id, org])
+    error_check(AccessError, 'owner', [auth_user_id, result[2], result[3]])
 
     # Check if the message is already pinned, if not, pin the message
-    error_check(InputError, 'check_pin', [org, msg_idx_in_org])
+    error_check(InputError, 'check_pin', [msg])
 
-    org['messages'][msg_idx_in_org]['is_pinned'] = True
+    msg['is_pinned'] = True
+    mark_changed('message', [result[2], result[3], message_id])
 
     return {}
 
@@ -577,25 +574,26 @@ def message_unpin_v1(token, message_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
+    lookup = Lookup()
 
     # Check if auth_user_id invalid
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
 
     # Check is message exist
-    error_check(InputError, 'message', [message_id])
+    error_check(InputError, 'message', [message_id], lookup)
 
     # Find the channel that message belongs to
-    result = find('message', None, message_id)
+    result = lookup.find('message', None, message_id)
 
-    msg_idx_in_org = result[0]
-    org = result[1]
+    msg = result[0]
     # Check if the user is the owner of the channel or dm
-    error_check(AccessError, 'owner', [auth_user_id, org])
+    error_check(AccessError, 'owner', [auth_user_id, result[2], result[3]])
 
     # Check if the message is already unpinned, if not, unpin the message
-    error_check(InputError, 'check_unpin', [org, msg_idx_in_org])
+    error_check(InputError, 'check_unpin', [msg])
 
-    org['messages'][msg_idx_in_org]['is_pinned'] = False
+    msg['is_pinned'] = False
+    mark_changed('message', [result[2], result[3], message_id])
 
     return {}
 
@@ -629,8 +627,8 @@ def message_sendlater_v1(token, channel_id, message, time_sent):
             'time_created'  : ,
         }
         Generate msg_id,
-        Add position info into data['msg_positions'],
-        Insert into channel['messages'][0]
+        Add the message to the message index,
+        Append to channel['messages']
 
     Return Value:
         Returns { } on condition of:
@@ -786,31 +784,21 @@ def message_react_v1(token, message_id, react_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
+    lookup = Lookup()
     # check token valid
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
     # check message_id valid
-    find_results = find('message', None, message_id)
+    find_results = lookup.find('message', None, message_id)
     if isinstance(find_results, int):
         raise InputError(description="Message not exist")
     # check that this user is in where the message belongs to
-    AccessError_exist = True
-    msg_op = find_message(message_id)
-    for member in msg_op[1]['all_members']:
-        if member['u_id'] == auth_user_id:
-            AccessError_exist = False
-            break
-    if AccessError_exist:
+    if not is_org_member(find_results[2], find_results[3], auth_user_id):
         raise AccessError(description='token with no authorisation')
     if react_id != 1:
         raise InputError(description='Invalid react_id entered')
-    # wait to use the helper to simplify
-    msg = find_results[1]['messages'][find_results[0]]
-    react_info = msg['reacts'][0]
-    if react_info['react_id'] == 1:
-        if auth_user_id not in react_info['u_ids']:
-            react_info['u_ids'].append(auth_user_id)
-        else:
-            raise InputError(description='You have already reacted to this message')
+    if not add_react(find_results[0], react_id, auth_user_id):
+        raise InputError(description='You have already reacted to this message')
+    mark_changed('message', [find_results[2], find_results[3], message_id])
 
     return {
     }
@@ -849,31 +837,22 @@ def message_unreact_v1(token, message_id, react_id):
     payload = detokenise(token)
     auth_user_id = payload['auth_user_id']
     session_id = payload['session_id']
+    lookup = Lookup()
     # check token valid
-    error_check(AccessError, 'db_user', [auth_user_id, session_id])
+    error_check(AccessError, 'db_user', [auth_user_id, session_id], lookup)
     # check message_id valid
-    find_results = find('message', None, message_id)
+    find_results = lookup.find('message', None, message_id)
     if isinstance(find_results, int):
         raise InputError(description="Message not exist")
     # check that this user is in where the message belongs to
-    AccessError_exist = True
-    msg_op = find_message(message_id)
-    for member in msg_op[1]['all_members']:
-        if member['u_id'] == auth_user_id:
-            AccessError_exist = False
-            break
-    if AccessError_exist:
+    if not is_org_member(find_results[2], find_results[3], auth_user_id):
         raise AccessError(description='token with no authorisation')
     if react_id != 1:
         raise InputError(description='Invalid react_id entered')
 
-    msg = find_results[1]['messages'][find_results[0]]
-    react_info = msg['reacts'][0]
-    if react_info['react_id'] == 1:
-        if auth_user_id in react_info['u_ids']:
-            react_info['u_ids'].remove(auth_user_id)
-        else:
-            raise InputError(description='You have not reacted to this message')
+    if not remove_react(find_results[0], react_id, auth_user_id):
+        raise InputError(description='You have not reacted to this message')
+    mark_changed('message', [find_results[2], find_results[3], message_id])
     return {
     }
 
@@ -923,9 +902,8 @@ def notifications_get_v1(token):
     user_position = find('user', None, auth_user_id)
     user = data['users'][user_position]
 
-    notifications = user['notifications']
-    if len(notifications) > 20:
-        notifications = notifications[0: 20]
+    # Notifications are stored oldest first, the 20 most recent are shown most recent first.
+    notifications = list(reversed(user['notifications'][-20:]))
 
     # print(data)
     # print("data above============noti below")
@@ -2,9 +2,9 @@ from datetime       import datetime, timezone
 from src.data       import data
 from src.auth       import detokenise
 from src.error      import AccessError, InputError
-from src.channels   import channels_list_v2 as channels_list
-from src.dm         import dm_list_v1       as dm_list
-from src.helpers    import find, error_check, data_dump
+from src.helpers    import find, error_check, data_dump, mark_reset
+from src.indexes    import rebuild_indexes, index, index_lock, joined_positions, tokenise_orgs
+from src.indexes    import trigram_candidates, token_candidates, message_location, message_position
 
 def clear_v1():
     '''
@@ -23,7 +23,6 @@ def clear_v1():
 
     data['users']           = []
     data['channels']        = []
-    data['msg_positions']   = []
     data['dms']             = []
     data['dreams_stats']={
         'channels_exist': [{
@@ -37,6 +36,9 @@ def clear_v1():
                         'time_stamp': datetime.now().replace(tzinfo=timezone.utc).timestamp()}],
         'utilization_rate':  0,
     }
+    data['ids']             = {}
+    rebuild_indexes()
+    mark_reset()
 
     data_dump()
     return {}
@@ -89,34 +91,56 @@ def search_v2(token, query_str):
         raise InputError("Query string is too long!\
             Reduce it so the length is below 1000 characters :3")
 
-    channels    = channels_list(token)['channels']
-    dms         = dm_list(token)['dms']
+    # Orgs the user joined, channels first, each in the order of data.
+    keys = []
+    for org_type in ['channel', 'dm']:
+        for position in joined_positions(org_type, auth_user_id):
+            keys.append((org_type, data[org_type + 's'][position][org_type + '_id']))
+    with index_lock:
+        tokenise_orgs(keys)
+        # Queries of three characters or more go by their trigrams, wherever
+        # they fall in a word, shorter ones by the tokens they touch.
+        candidates = trigram_candidates(query_str)
+        if candidates is None:
+            candidates = token_candidates(query_str)
+
+    if candidates is None:
+        # Nothing in query_str to look up by, so every message is checked.
+        return_list = []
+        for org_type, org_id in keys:
+            find_and_append(org_type, org_id, return_list, query_str)
+        return {
+            'messages': return_list,
+        }
+
+    candidates_by_org = {}
+    for message_id in candidates:
+        entry = index['messages'][message_id]
+        candidates_by_org.setdefault((entry[0], entry[1]), []).append(message_id)
     return_list = []
-    find_and_append('channel'   , channels  , return_list   , query_str)
-    find_and_append('dm'        , dms       , return_list   , query_str)
+    for key in keys:
+        # Most recent first, as in the history of the org.
+        message_ids = sorted(candidates_by_org.get(key, []), key=message_position, reverse=True)
+        for message_id in message_ids:
+            message = message_location(message_id)[2]
+            if query_str in message['message']:
+                return_list.append(search_info(message))
 
     return {
         'messages': return_list,
     }
 
-def find_and_append(type_string, org_list, return_list, query_str):
-    print(f"In find & append, {org_list}")
-    if len(org_list) == 0:
-        return
-    if type_string == 'channel':
-        org_id = 'channel_id'
-    else:
-        org_id = 'dm_id'
-    for org in org_list:
-        position = find(type_string, None, org[org_id])
-        checking_org = data[type_string + 's'][position]
-        for message in checking_org['messages']:
-            if query_str in message['message']:
-                msg = message
-                append_info = {
-                    'message_id'    : msg['message_id'],
-                    'u_id'          : msg['u_id'],
-                    'message'       : msg['message'],
-                    'time_created'  : msg['time_created'],
-                }
-                return_list.append(append_info)
+def find_and_append(org_type, org_id, return_list, query_str):
+    position = find(org_type, None, org_id)
+    checking_org = data[org_type + 's'][position]
+    for message in reversed(checking_org['messages']):
+        if query_str in message['message']:
+            return_list.append(search_info(message))
+
+def search_info(msg):
+    return {
+        'message_id'    : msg['message_id'],
+        'u_id'          : msg['u_id'],
+        'message'       : msg['message'],
+        'time_created'  : msg['time_created'],
+    }
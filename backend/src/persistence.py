@@ -0,0 +1,1132 @@
+'''Persistence of the data store.
+
+helpers.data_dump() and helpers.data_load() hand over to this module.
+The storage used is chosen by config.storage_mode:
+
+    'json'  : every dump rewrites the whole of `data` to config.backup_path.
+    'wal'   : every dump appends one record, holding what changed since the
+              last dump, to the write-ahead log at config.wal_path.
+              data_load() reads the snapshot at config.backup_path and
+              replays the records of the log which are newer than it.
+              A background compactor writes a new snapshot every
+              config.compact_interval seconds and drops the records
+              it covers from the log.
+    'sqlite': every dump writes the rows of what changed since the last
+              dump to the database at config.sqlite_path, see
+              src/sqlite_store.py. data_load() reads the whole database,
+              which is filled from config.backup_path if it is empty.
+              Handlers never query it, see the limitation noted there.
+    'shards': every dump rewrites the file of each user, channel and dm
+              that changed since the last dump, under config.shard_dir.
+              The messages of a channel or dm have a segment file of
+              their own, and a log of the messages changed since it was
+              written, see src/lazy_messages.py. A dump appends the
+              messages it changed to the log, and the segment is only
+              written again once its log is as long as its history.
+              Items added to the series of a user or to dreams_stats
+              are appended to a log next to its shard the same way.
+              data_load() reads every file, or config.backup_path if
+              there are none yet. With config.lazy_messages, segments
+              are only read when first used, see src/lazy_messages.py,
+              and dropped again after config.message_idle_seconds unused.
+
+Snapshots at config.backup_path are json, or the binary format of
+src/binary_snapshot.py if config.snapshot_format is 'binary'. Either is
+recognised when loading. If there is no snapshot at config.backup_path
+yet, the one at config.initial_backup_path is loaded instead.
+
+The messages of channels and dms and the notifications of users are kept
+oldest first, so that new ones are appended. Snapshots and shards record
+this as MESSAGE_ORDER, and those stored before, most recent first, are
+turned around when loaded.
+
+A dump with nothing marked since the last one does not write anything.
+
+With config.fork_snapshots, full snapshots ('json' dumps and compactions
+of the log) are written by a forked child from its copy-on-write view of
+data, so the server keeps serving while they are encoded. Only one such
+snapshot is written at a time.
+
+Unless config.commit_window is 0, a dump only wakes the writer thread,
+which waits commit_window seconds for more dumps and then writes all of
+them at once, synced to disk. With config.strict_commit the dump also
+waits for that write to be done before returning.
+
+Functions mutating `data` report what they changed with mark_changed(),
+mark_pushed() or mark_reset(), so that a dump knows what to write.
+Marking only waits for lock, which a flush holds while it takes what
+was marked and turns it into what to write. The writing itself, synced
+to disk, is done under write_lock, which marking never waits for.
+
+A log record is one line of json:
+
+    {'seq': type_int, 'ops': [op, op, ...]}
+
+where op is one of
+    ['put', kind, key, value]       the current state of an entity
+    ['del', kind, key]              the entity no longer exists
+    ['push', path, length, item]    an item added to a series
+    (see mark_changed and mark_pushed for kind, key and path)
+
+Replaying a record twice leaves `data` as replaying it once,
+so a snapshot that already contains some of the records is fine.
+'''
+import os
+import json
+import time
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from src import config
+from src import json_stream
+from src import binary_snapshot
+from src import sqlite_store
+from src.data import data
+from src.indexes import rebuild_indexes, message_ids_of, forget_org_messages, index_user
+from src.indexes import add_org, remove_org, user_position, org_position
+from src.indexes import message_location, message_position
+from src.lazy_messages import LazyMessages, read_log, apply_log
+
+# Recorded with snapshots and shards whose messages and notifications are
+# stored oldest first. Those stored without it are most recent first.
+MESSAGE_ORDER = 'oldest_first'
+
+# Keys of users and orgs that are not logged with the entity itself.
+USER_SERIES_KEYS = ['notifications', 'stats']
+ORG_SERIES_KEYS = ['messages']
+
+# Held while changes are marked and taken.
+lock = threading.RLock()
+
+# Held while a flush writes, so that flushes write in the order they took
+# their changes, and by whatever else writes to or reads from storage.
+write_lock = threading.RLock()
+
+# Held while a snapshot of the log is written, so that only one is in progress.
+# Taken before write_lock and lock when held along with them.
+compact_lock = threading.RLock()
+
+changes = {
+    'entities'  : {},
+    'pushes'    : [],
+    'reset'     : False,
+}
+
+writer_state = {
+    'requested' : 0,
+    'committed' : 0,
+    'thread'    : None,
+    'condition' : threading.Condition(),
+}
+
+snapshot_state = {
+    'pid'       : None,
+    'started'   : None,
+    'path'      : None,
+    'pending'   : None,
+    'last'      : None,
+    'condition' : threading.Condition(),
+}
+
+shard_state = {
+    'order'     : None,
+    'evictor'   : None,
+    'log_lengths': {},
+}
+
+wal_state = {
+    'seq'           : 0,
+    'file'          : None,
+    'snapshot_seq'  : 0,
+    'compactor'     : None,
+}
+
+# ========== Change tracking ==========
+
+def mark_changed(kind, key):
+    '''Description: Record that an entity was created, modified or removed.
+
+    Parameters:
+    * kind is one of 'user', 'channel', 'dm', 'message' or 'ids'.
+    * key is the u_id, channel_id or dm_id of the entity,
+    * [org_type, org_id, message_id] for a message,
+    * or None for data['ids'], the state of src/ids.py.
+    '''
+    if kind == 'message':
+        key = tuple(key)
+    with lock:
+        changes['entities'][(kind, key)] = None
+
+def mark_pushed(path, series):
+    '''Description: Record that an item was added to a series.
+
+    Parameters:
+    * path is ['user', u_id, series_key] for the stats series and the
+    * notifications of a user, or ['dreams_stats', None, series_key].
+    * series is the list just added to.
+    '''
+    with lock:
+        changes['pushes'].append([list(path), len(series), series[-1]])
+
+def mark_reset():
+    '''Description: Record that the whole of data was replaced.
+    '''
+    with lock:
+        changes['reset'] = True
+
+def take_changes():
+    '''Description: Hand over everything marked since the last call.
+
+    Returns (reset, entities, pushes).
+    '''
+    with lock:
+        taken = (changes['reset'], changes['entities'], changes['pushes'])
+        changes['reset'] = False
+        changes['entities'] = {}
+        changes['pushes'] = []
+    return taken
+
+# ========== Entities ==========
+
+def find_org(org_type, org_id):
+    '''Returns the channel or dm with given id, None if not found.
+    '''
+    position = org_position(org_type, org_id)
+    if position < 0:
+        return None
+    return data[org_type + 's'][position]
+
+def find_entity(kind, key):
+    '''Returns the user, channel, dm or message described by kind and key,
+    None if it does not exist anymore.
+
+    Entities are found through the indexes of src/indexes.py, which are
+    kept up to date while the log is replayed too, see apply_ops.
+    '''
+    if kind == 'user':
+        position = user_position(key)
+        if position < 0:
+            return None
+        return data['users'][position]
+    if kind == 'ids':
+        return data['ids']
+    if kind == 'message':
+        location = message_location(key[2])
+        if location is None or location[0] != key[0] or location[1] != key[1]:
+            return None
+        return location[2]
+    return find_org(kind, key)
+
+def entity_core(kind, entity):
+    '''Returns the part of an entity which is logged by a 'put'.
+
+    Series are left out since they are logged item by item, and messages
+    of an org are logged as entities of their own.
+    '''
+    if kind == 'user':
+        skip = USER_SERIES_KEYS
+    elif kind in ['channel', 'dm']:
+        skip = ORG_SERIES_KEYS
+    else:
+        skip = []
+    return {k: v for k, v in entity.items() if k not in skip}
+
+def collect_ops(entities, pushes):
+    '''Turns marked changes into log ops, reading the current state of data.
+    '''
+    ops = []
+    for kind, key in entities:
+        entity = find_entity(kind, key)
+        log_key = list(key) if kind == 'message' else key
+        if entity is None:
+            ops.append(['del', kind, log_key])
+        else:
+            ops.append(['put', kind, log_key, entity_core(kind, entity)])
+    for path, length, item in pushes:
+        ops.append(['push', path, length, item])
+    return ops
+
+# ========== Replay ==========
+
+def new_user_series():
+    return {
+        'notifications' : [],
+        'stats'         : {
+            'channels_joined'   : [],
+            'dms_joined'        : [],
+            'messages_sent'     : [],
+            'involvement_rate'  : 0,
+        },
+    }
+
+def apply_ops(ops, messages_by_id):
+    '''Description: Apply log ops to data.
+
+    messages_by_id maps message_id to the stored message and is kept up to date,
+    as are the positions of users, channels and dms in the indexes. The rest
+    of the indexes is built again once the log is replayed.
+    '''
+    for op in ops:
+        if op[0] == 'push':
+            apply_push(op[1], op[2], op[3])
+            continue
+        kind, key = op[1], op[2]
+        if kind == 'message':
+            apply_message_op(op, messages_by_id)
+        elif op[0] == 'put':
+            entity = find_entity(kind, key)
+            if entity is not None:
+                entity.update(op[3])
+            elif kind == 'user':
+                user = new_user_series()
+                user.update(op[3])
+                data['users'].append(user)
+                index_user(len(data['users']) - 1)
+            else:
+                org = dict(op[3])
+                org['messages'] = []
+                add_org(kind, org)
+        else:
+            position = org_position(kind, key)
+            if position >= 0:
+                for message in data[kind + 's'][position]['messages']:
+                    messages_by_id.pop(message['message_id'], None)
+                remove_org(kind, position)
+
+def apply_message_op(op, messages_by_id):
+    org_type, org_id, message_id = op[2]
+    existing = messages_by_id.get(message_id)
+    if op[0] == 'del':
+        if existing is not None:
+            existing[0]['messages'].remove(existing[1])
+            del messages_by_id[message_id]
+        return
+    if existing is not None:
+        existing[1].clear()
+        existing[1].update(op[3])
+        return
+    org = find_org(org_type, org_id)
+    if org is None:
+        return
+    message = dict(op[3])
+    org['messages'].append(message)
+    messages_by_id[message_id] = (org, message)
+
+def apply_push(path, length, item):
+    if path[0] == 'user':
+        user = find_entity('user', path[1])
+        if user is None:
+            return
+        push_item(user, path, length, item)
+    else:
+        push_item(data['dreams_stats'], path, length, item)
+
+def push_item(owner, path, length, item):
+    '''Description: Add item to the series at path of owner, the user of the path
+    or data['dreams_stats'], unless the series is length items long already.
+    '''
+    if path[0] == 'user' and path[2] != 'notifications':
+        series = owner['stats'][path[2]]
+    else:
+        series = owner[path[2]]
+    if len(series) >= length:
+        return
+    series.append(item)
+
+def relink_members():
+    '''Description: Point members of orgs back at the public_info of their user,
+    as they are when the server is running, instead of the copies read from disk.
+    '''
+    public_infos = {}
+    for user in data['users']:
+        public_infos[user['auth_user_id']] = user['public_info']
+    for org_type in ['channel', 'dm']:
+        for org in data[org_type + 's']:
+            for key in ['owner_members', 'all_members']:
+                org[key] = [
+                    public_infos.get(member['u_id'], member) for member in org[key]
+                ]
+
+def build_indexes():
+    '''Description: Build what is derived from data once it is loaded,
+    see src/indexes.py.
+    '''
+    relink_members()
+    rebuild_indexes()
+
+# ========== Snapshots ==========
+
+def write_json(path, value):
+    '''Description: Write value as json to path, replacing it at once.
+
+    Handlers may change value while it is being encoded, in which case
+    it is encoded again.
+    '''
+    text = json_stream.encode(value)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.write(text)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def write_snapshot(path, extra):
+    '''Description: Write the whole of data to path, replacing it at once.
+
+    extra is a dictionary of additional keys written alongside data.
+    Entities are encoded and written one at a time, see src/json_stream.py
+    and src/binary_snapshot.py.
+    '''
+    snapshot = dict(data)
+    snapshot['message_order'] = MESSAGE_ORDER
+    snapshot.update(extra)
+    tmp_path = path + '.tmp'
+    if config.snapshot_format == 'binary':
+        file = open(tmp_path, 'wb')
+        write_object = binary_snapshot.write_object
+    else:
+        file = open(tmp_path, 'w')
+        write_object = json_stream.write_object
+    with file:
+        write_object(file, snapshot)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+def background_snapshot(path, extra, queue=False):
+    '''Description: Write a snapshot of data to path from a forked child process.
+
+    If a snapshot is already being written, no other one is started.
+    With queue, the snapshot is then written once the running one is done.
+
+    Returns the pid of the child, None if no snapshot was started.
+    '''
+    condition = snapshot_state['condition']
+    with condition:
+        if snapshot_state['pid'] is not None:
+            if queue:
+                snapshot_state['pending'] = (path, extra)
+            else:
+                print(f"Snapshot to {snapshot_state['path']} still running, not starting another one")
+            return None
+        return start_snapshot_child(path, extra)
+
+def start_snapshot_child(path, extra):
+    '''Forks the child writing a snapshot, with snapshot_state['condition'] held.
+    '''
+    started = time.time()
+    pid = os.fork()
+    if pid == 0:
+        status = 0
+        try:
+            write_snapshot(path, extra)
+        except BaseException:
+            status = 1
+        os._exit(status)
+    snapshot_state['pid'] = pid
+    snapshot_state['started'] = started
+    snapshot_state['path'] = path
+    threading.Thread(target=reap_snapshot, args=(pid,), daemon=True).start()
+    return pid
+
+def reap_snapshot(pid):
+    '''Description: Wait for the child writing a snapshot and report how it went,
+    then start the snapshot queued meanwhile if any.
+    '''
+    _, status = os.waitpid(pid, 0)
+    condition = snapshot_state['condition']
+    with condition:
+        path = snapshot_state['path']
+        last = {
+            'path'      : path,
+            'ok'        : status == 0,
+            'duration'  : time.time() - snapshot_state['started'],
+            'size'      : os.path.getsize(path) if status == 0 else 0,
+        }
+        if last['ok']:
+            print(f"Snapshot of {last['size']} bytes written to {path} in {last['duration']:.3f}s")
+        else:
+            print(f"Snapshot to {path} failed after {last['duration']:.3f}s")
+        snapshot_state['last'] = last
+        snapshot_state['pid'] = None
+        pending = snapshot_state['pending']
+        snapshot_state['pending'] = None
+        if pending is not None:
+            start_snapshot_child(pending[0], pending[1])
+        condition.notify_all()
+
+def wait_snapshot():
+    '''Description: Wait until no snapshot is being written, queued ones included.
+
+    Returns the report of the last snapshot written, see reap_snapshot.
+    '''
+    condition = snapshot_state['condition']
+    with condition:
+        while snapshot_state['pid'] is not None:
+            condition.wait()
+        return snapshot_state['last']
+
+def read_snapshot(path):
+    '''Description: Load the snapshot at path into data.
+
+    Returns the snapshot as read.
+    '''
+    if not os.path.exists(path):
+        path = config.initial_backup_path
+    if binary_snapshot.is_binary(path):
+        with open(path, 'rb') as file:
+            data_backup = binary_snapshot.read_object(file)
+    else:
+        with open(path, 'r') as file:
+            data_backup = json_stream.read_object(file)
+    install_snapshot(data_backup)
+    if data_backup.get('message_order') != MESSAGE_ORDER:
+        reverse_histories()
+    return data_backup
+
+def install_snapshot(data_backup):
+    '''Description: Replace the content of data with a snapshot.
+    '''
+    data['users'] = data_backup['users']
+    data['channels'] = data_backup['channels']
+    data['dms'] = data_backup['dms']
+    data['dreams_stats'] = data_backup['dreams_stats']
+    data['ids'] = data_backup.get('ids', {})
+
+def reverse_histories():
+    '''Description: Turn the messages of every channel and dm and the
+    notifications of every user, as stored most recent first, oldest first.
+    '''
+    for user in data['users']:
+        user['notifications'].reverse()
+    for org_type in ['channel', 'dm']:
+        for org in data[org_type + 's']:
+            org['messages'].reverse()
+
+# ========== Write-ahead log ==========
+
+def wal_append(ops):
+    '''Description: Append one record holding ops to the log.
+    '''
+    if wal_state['file'] is None:
+        wal_state['file'] = open(config.wal_path, 'a')
+    wal_state['seq'] += 1
+    record = {'seq': wal_state['seq'], 'ops': ops}
+    wal_state['file'].write(json.dumps(record, separators=(',', ':')) + '\n')
+    wal_state['file'].flush()
+    os.fsync(wal_state['file'].fileno())
+
+def wal_records(after_seq):
+    '''Description: Read the records of the log newer than after_seq.
+
+    A record that is cut short, as left by a crash while writing, ends the log.
+    '''
+    if not os.path.exists(config.wal_path):
+        return []
+    records = []
+    with open(config.wal_path, 'r') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            if record['seq'] > after_seq:
+                records.append(record)
+    return records
+
+def trim_log(upto_seq):
+    '''Description: Drop the records of the log up to and including upto_seq.
+    '''
+    with write_lock:
+        records = wal_records(upto_seq)
+        if wal_state['file'] is not None:
+            wal_state['file'].close()
+        tmp_path = config.wal_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            for record in records:
+                file.write(json.dumps(record, separators=(',', ':')) + '\n')
+        os.replace(tmp_path, config.wal_path)
+        wal_state['file'] = open(config.wal_path, 'a')
+
+def compact():
+    '''Description: Write a snapshot of data and drop the records of the log it covers.
+
+    Only reading the sequence number and trimming the log hold up flushes.
+    Data may change while the snapshot is being written, which only means
+    that some records kept in the log are part of the snapshot already.
+    If another snapshot is being written, this one waits for it to finish,
+    so that data as it is now is always covered.
+
+    Returns True if the snapshot was written and the log trimmed.
+    '''
+    with compact_lock:
+        with write_lock:
+            snapshot_seq = wal_state['seq']
+        if config.fork_snapshots:
+            while background_snapshot(config.backup_path, {'wal_seq': snapshot_seq}) is None:
+                wait_snapshot()
+                with write_lock:
+                    snapshot_seq = wal_state['seq']
+            if not wait_snapshot()['ok']:
+                return False
+        else:
+            write_snapshot(config.backup_path, {'wal_seq': snapshot_seq})
+        trim_log(snapshot_seq)
+        wal_state['snapshot_seq'] = snapshot_seq
+    return True
+
+def compactor():
+    '''Description: Compact the log every config.compact_interval seconds
+    as long as records were added since the last snapshot.
+    '''
+    while True:
+        time.sleep(config.compact_interval)
+        if wal_state['seq'] != wal_state['snapshot_seq']:
+            compact()
+
+def start_compactor():
+    if wal_state['compactor'] is None:
+        wal_state['compactor'] = threading.Thread(target=compactor, daemon=True)
+        wal_state['compactor'].start()
+
+def wal_load():
+    snapshot = read_snapshot(config.backup_path)
+    wal_state['seq'] = snapshot.get('wal_seq', 0)
+    build_indexes()
+    records = wal_records(wal_state['seq'])
+    if len(records) > 0:
+        messages_by_id = {}
+        for org_type in ['channel', 'dm']:
+            for org in data[org_type + 's']:
+                for message in org['messages']:
+                    messages_by_id[message['message_id']] = (org, message)
+        for record in records:
+            apply_ops(record['ops'], messages_by_id)
+            wal_state['seq'] = record['seq']
+        build_indexes()
+    compact()
+    start_compactor()
+
+# ========== SQLite ==========
+
+def sqlite_load():
+    if sqlite_store.connect():
+        read_snapshot(config.backup_path)
+        sqlite_store.write_all(data)
+    install_snapshot(sqlite_store.read_all())
+    build_indexes()
+
+# ========== Shards ==========
+
+SHARD_KINDS = ['user', 'channel', 'dm']
+ORG_KINDS = ['channel', 'dm']
+# Keys of data stored whole in a shard of their own.
+DATA_SHARDS = ['dreams_stats', 'ids']
+# Lines a log holds at least before the segment or shard it follows is written again.
+LOG_MIN_LINES = 64
+
+def shard_path(kind, key):
+    return os.path.join(config.shard_dir, kind + 's', str(key) + '.json')
+
+def segment_path(org_type, org_id):
+    return os.path.join(config.shard_dir, org_type + 's', str(org_id) + '.messages.json')
+
+def segment_log_path(org_type, org_id):
+    return os.path.join(config.shard_dir, org_type + 's', str(org_id) + '.messages.log')
+
+def shard_log_path(kind, key):
+    '''Returns the path of the log of the items added to the series of the
+    user with u_id key, or of data[kind] if kind is 'dreams_stats'.
+    '''
+    if kind == 'user':
+        return os.path.join(config.shard_dir, 'users', str(key) + '.log')
+    return os.path.join(config.shard_dir, kind + '.log')
+
+def id_of(kind, entity):
+    if kind == 'user':
+        return entity['auth_user_id']
+    return entity[kind + '_id']
+
+def current_order():
+    '''Returns the ids of all users, channels and dms, in the order of data,
+    along with the order messages are stored in.
+    '''
+    order = {
+        kind: [id_of(kind, entity) for entity in data[kind + 's']] for kind in SHARD_KINDS
+    }
+    order['message_order'] = MESSAGE_ORDER
+    return order
+
+def dirty_shards(entities, pushes):
+    '''Turns marked changes into the shards to rewrite.
+
+    Returns (dirty, segments, pushed) where dirty is a set of (kind, key),
+    with (key, None) for data[key] of each of DATA_SHARDS, segments maps
+    (org_type, org_id) to the set of the ids of its messages that changed,
+    and pushed maps (kind, key) of a user or of dreams_stats to the pushes
+    of its series, as [path, length, item].
+    '''
+    dirty = set()
+    segments = {}
+    pushed = {}
+    for kind, key in entities:
+        if kind == 'message':
+            segments.setdefault((key[0], key[1]), set()).add(key[2])
+        else:
+            dirty.add((kind, key))
+    for path, length, item in pushes:
+        pushed.setdefault((path[0], path[1]), []).append([path, length, item])
+    return dirty, segments, pushed
+
+def write_shards(dirty, segments, pushed=None):
+    '''Description: Write the messages that changed of each org in segments
+    and the pushes of each entity in pushed to their logs, then rewrite the
+    shard of each dirty entity, removing those of entities that no longer
+    exist, then the order of entities if it changed.
+
+    segments maps (org_type, org_id) to the ids of the messages that changed,
+    or to None to write the whole segment. A segment or shard whose log
+    would get too long is written whole instead.
+    '''
+    for kind in SHARD_KINDS:
+        os.makedirs(os.path.join(config.shard_dir, kind + 's'), exist_ok=True)
+    dirty = set(dirty)
+    for (org_type, org_id), message_ids in segments.items():
+        org = find_org(org_type, org_id)
+        if org is None:
+            continue
+        if message_ids is None or not append_segment_log(org_type, org_id, org, message_ids):
+            write_segment(org_type, org_id, org)
+            # The shard of the org records the ids of the messages of the segment.
+            dirty.add((org_type, org_id))
+    for key, lines in (pushed or {}).items():
+        if key not in dirty and not append_shard_log(key[0], key[1], lines):
+            dirty.add(key)
+    for kind, key in dirty:
+        if kind in DATA_SHARDS:
+            write_json(os.path.join(config.shard_dir, kind + '.json'), data[kind])
+            remove_log(kind, key, shard_log_path(kind, key))
+            continue
+        entity = find_entity(kind, key)
+        if entity is None:
+            for path in [shard_path(kind, key), segment_path(kind, key)]:
+                if os.path.exists(path):
+                    os.remove(path)
+            remove_log(kind, key, segment_log_path(kind, key))
+        elif kind == 'user':
+            write_json(shard_path(kind, key), entity)
+            remove_log(kind, key, shard_log_path(kind, key))
+        else:
+            shard = entity_core(kind, entity)
+            shard['message_ids'] = message_ids_of(entity)
+            write_json(shard_path(kind, key), shard)
+    order = current_order()
+    if order != shard_state['order']:
+        write_json(os.path.join(config.shard_dir, 'order.json'), order)
+        shard_state['order'] = order
+
+def append_log(kind, key, log_path, lines, limit):
+    '''Description: Append lines to the log at log_path of the segment or shard
+    of kind and key, synced to disk.
+
+    Returns False, appending nothing, if the log would get limit lines long,
+    for what it follows to be written whole instead.
+    '''
+    length = shard_state['log_lengths'].get((kind, key), 0) + len(lines)
+    if length >= max(LOG_MIN_LINES, limit):
+        return False
+    with open(log_path, 'a') as file:
+        for line in lines:
+            file.write(json.dumps(line, separators=(',', ':')) + '\n')
+        file.flush()
+        os.fsync(file.fileno())
+    shard_state['log_lengths'][(kind, key)] = length
+    return True
+
+def remove_log(kind, key, log_path):
+    if os.path.exists(log_path):
+        os.remove(log_path)
+    shard_state['log_lengths'].pop((kind, key), None)
+
+def append_shard_log(kind, key, lines):
+    '''Description: Append the pushes in lines to the log of the shard of the
+    user with u_id key, or of data[kind] if kind is 'dreams_stats'.
+
+    Returns False if the shard is to be written whole instead.
+    '''
+    owner = data[kind] if kind in DATA_SHARDS else find_entity(kind, key)
+    if owner is None:
+        return True
+    if kind == 'user':
+        items = len(owner['notifications']) + sum(
+            len(series) for series in owner['stats'].values() if isinstance(series, list)
+        )
+    else:
+        items = sum(len(series) for series in owner.values() if isinstance(series, list))
+    return append_log(kind, key, shard_log_path(kind, key), lines, items)
+
+def append_segment_log(org_type, org_id, org, message_ids):
+    '''Description: Append the messages with message_ids of org to its segment log.
+
+    Returns False, appending nothing, if the log would be as long as the
+    history of org, for the segment to be written again instead.
+    '''
+    removed = []
+    kept = []
+    for message_id in message_ids:
+        message = find_entity('message', [org_type, org_id, message_id])
+        if message is None:
+            removed.append(['del', message_id])
+        else:
+            kept.append(message)
+    # Messages not in the segment yet are added at the end in the order of org.
+    kept.sort(key=lambda message: message_position(message['message_id']))
+    lines = removed + [['put', message] for message in kept]
+    return append_log(
+        org_type, org_id, segment_log_path(org_type, org_id), lines, len(message_ids_of(org))
+    )
+
+def write_segment(org_type, org_id, org):
+    '''Description: Write the whole segment of org and remove its log.
+    '''
+    write_json(segment_path(org_type, org_id), list(org['messages']))
+    remove_log(org_type, org_id, segment_log_path(org_type, org_id))
+
+def write_all_shards():
+    '''Description: Write every entity to its shard, removing any other shard.
+    '''
+    for kind in SHARD_KINDS:
+        kind_dir = os.path.join(config.shard_dir, kind + 's')
+        if not os.path.isdir(kind_dir):
+            continue
+        for name in os.listdir(kind_dir):
+            os.remove(os.path.join(kind_dir, name))
+    dirty = {(key, None) for key in DATA_SHARDS}
+    segments = {}
+    for kind in SHARD_KINDS:
+        for entity in data[kind + 's']:
+            dirty.add((kind, id_of(kind, entity)))
+            if kind in ORG_KINDS:
+                segments[(kind, id_of(kind, entity))] = None
+    shard_state['order'] = None
+    shard_state['log_lengths'] = {}
+    write_shards(dirty, segments)
+
+def read_shard_batch(paths):
+    '''Reads and parses the shards at paths, in a process of the load pool.
+
+    A shard that does not exist is read as None, and a segment log as
+    (ops, torn), see read_log() in src/lazy_messages.py.
+    Returns (values, seconds spent reading, seconds spent parsing).
+    '''
+    values = []
+    read_time = 0
+    parse_time = 0
+    for path in paths:
+        started = time.perf_counter()
+        if path.endswith('.log'):
+            values.append(read_log(path))
+            read_time += time.perf_counter() - started
+            continue
+        text = None
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                text = file.read()
+        read_at = time.perf_counter()
+        values.append(json.loads(text) if text is not None else None)
+        read_time += read_at - started
+        parse_time += time.perf_counter() - read_at
+    return values, read_time, parse_time
+
+def read_shards(paths):
+    '''Reads and parses the shards at paths, spread over config.load_processes
+    processes when there are at least config.parallel_load_min_shards of them.
+
+    Returns (values in the order of paths, number of processes used,
+    seconds spent reading, seconds spent parsing), times summed over processes.
+    '''
+    processes = 1
+    if config.load_processes > 1 and len(paths) >= config.parallel_load_min_shards:
+        processes = config.load_processes
+    if processes == 1:
+        results = [read_shard_batch(paths)]
+    else:
+        batch_size = -(-len(paths) // (processes * 4))
+        batches = [paths[idx:idx + batch_size] for idx in range(0, len(paths), batch_size)]
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            results = list(pool.map(read_shard_batch, batches))
+    values = []
+    read_time = 0
+    parse_time = 0
+    for batch_values, batch_read_time, batch_parse_time in results:
+        values.extend(batch_values)
+        read_time += batch_read_time
+        parse_time += batch_parse_time
+    return values, processes, read_time, parse_time
+
+def take_log(kind, key, log):
+    '''Returns (ops, torn) of a log as read by read_log(), recording its length.
+    '''
+    ops, torn = log
+    if len(ops) > 0:
+        shard_state['log_lengths'][(kind, key)] = len(ops)
+    return ops, torn
+
+def shards_load():
+    '''Description: Load data from the shards, leaving the messages of each org
+    to be read on first use if config.lazy_messages is set.
+
+    Shards stored most recent first are read whole, turned oldest first and
+    written again.
+    '''
+    order_path = os.path.join(config.shard_dir, 'order.json')
+    if not os.path.exists(order_path):
+        read_snapshot(config.backup_path)
+        build_indexes()
+        write_all_shards()
+        return
+    started = time.perf_counter()
+    with open(order_path, 'r') as file:
+        order = json.loads(file.read())
+    is_current = order.get('message_order') == MESSAGE_ORDER
+    lazy = config.lazy_messages and is_current
+    paths = [os.path.join(config.shard_dir, key + '.json') for key in DATA_SHARDS]
+    paths.append(shard_log_path('dreams_stats', None))
+    for kind in SHARD_KINDS:
+        for key in order[kind]:
+            paths.append(shard_path(kind, key))
+            if kind == 'user':
+                paths.append(shard_log_path(kind, key))
+                continue
+            if not lazy:
+                paths.append(segment_path(kind, key))
+            paths.append(segment_log_path(kind, key))
+    values, processes, read_time, parse_time = read_shards(paths)
+
+    merge_started = time.perf_counter()
+    data['dreams_stats'] = values[0]
+    data['ids'] = values[1] if values[1] is not None else {}
+    shard_state['log_lengths'] = {}
+    # Shards and segments whose log was cut short, to be written whole.
+    torn = set()
+    torn_segments = {}
+
+    ops, log_torn = take_log('dreams_stats', None, values[len(DATA_SHARDS)])
+    for path, length, item in ops:
+        push_item(data['dreams_stats'], path, length, item)
+    if log_torn:
+        torn.add(('dreams_stats', None))
+    value_idx = len(DATA_SHARDS) + 1
+    for kind in SHARD_KINDS:
+        entities = []
+        for key in order[kind]:
+            entity = values[value_idx]
+            value_idx += 1
+            entities.append(entity)
+            if kind == 'user':
+                ops, log_torn = take_log(kind, key, values[value_idx])
+                value_idx += 1
+                for path, length, item in ops:
+                    push_item(entity, path, length, item)
+                if log_torn:
+                    torn.add((kind, key))
+                continue
+            message_ids = entity.pop('message_ids', [])
+            messages = None
+            if not lazy:
+                messages = values[value_idx] if values[value_idx] is not None else []
+                value_idx += 1
+            ops, log_torn = take_log(kind, key, values[value_idx])
+            value_idx += 1
+            if log_torn:
+                torn_segments[(kind, key)] = None
+            if lazy:
+                apply_log(message_ids, ops, ids_only=True)
+                entity['messages'] = LazyMessages(
+                    segment_path(kind, key), segment_log_path(kind, key), message_ids
+                )
+            else:
+                apply_log(messages, ops)
+                entity['messages'] = messages
+        data[kind + 's'] = entities
+    shard_state['order'] = order
+    if not is_current:
+        reverse_histories()
+
+    index_started = time.perf_counter()
+    build_indexes()
+    finished = time.perf_counter()
+    print(
+        f"Loaded {len(paths)} shards with {processes} process(es) in {finished - started:.3f}s: "
+        f"read {read_time:.3f}s, parse {parse_time:.3f}s (summed over processes), "
+        f"merge {index_started - merge_started:.3f}s, index build {finished - index_started:.3f}s"
+    )
+    if not is_current:
+        write_all_shards()
+    elif len(torn) > 0 or len(torn_segments) > 0:
+        # Lines appended after a cut short one could not be read back.
+        write_shards(torn, torn_segments)
+    if lazy:
+        start_evictor()
+
+def evict_idle_messages():
+    '''Description: Drop the messages of orgs unused for config.message_idle_seconds,
+    unless they have changes still to be written.
+
+    Returns the number of orgs whose messages were dropped.
+    '''
+    evicted = 0
+    # write_lock, as the changes a flush has taken are not pending anymore
+    # until they are written.
+    with write_lock, lock:
+        pending = {(key[0], key[1]) for kind, key in changes['entities'] if kind == 'message'}
+        for kind in ORG_KINDS:
+            for org in data[kind + 's']:
+                messages = org['messages']
+                if not isinstance(messages, LazyMessages) or (kind, org[kind + '_id']) in pending:
+                    continue
+                if messages.evict(config.message_idle_seconds):
+                    forget_org_messages(org)
+                    evicted += 1
+    return evicted
+
+def evictor():
+    while True:
+        time.sleep(config.evict_interval)
+        evict_idle_messages()
+
+def start_evictor():
+    if shard_state['evictor'] is None:
+        shard_state['evictor'] = threading.Thread(target=evictor, daemon=True)
+        shard_state['evictor'].start()
+
+# ========== Entry points ==========
+
+def flush():
+    '''Description: Write what changed since the last flush.
+
+    What changed is taken under lock, and written under write_lock only,
+    so that marking changes meanwhile does not wait for the disk.
+    '''
+    if config.storage_mode == 'wal':
+        with write_lock:
+            with lock:
+                reset, entities, pushes = take_changes()
+                ops = [] if reset else collect_ops(entities, pushes)
+            if len(ops) > 0:
+                wal_append(ops)
+        # Outside of write_lock, as compact() waits for a running compaction
+        # which needs write_lock to finish.
+        if reset:
+            written = False
+            try:
+                written = compact()
+            finally:
+                if not written:
+                    # The log alone cannot replay a reset, so the next flush tries again.
+                    mark_reset()
+    elif config.storage_mode == 'sqlite':
+        with write_lock:
+            with lock:
+                reset, entities, pushes = take_changes()
+                ops = [] if reset else collect_ops(entities, pushes)
+            if reset:
+                sqlite_store.write_all(data)
+            elif len(ops) > 0:
+                sqlite_store.write_ops(ops)
+    elif config.storage_mode == 'shards':
+        with write_lock:
+            with lock:
+                reset, entities, pushes = take_changes()
+                dirty, segments, pushed = dirty_shards(entities, pushes)
+            if reset:
+                write_all_shards()
+            elif len(dirty) > 0 or len(segments) > 0 or len(pushed) > 0:
+                write_shards(dirty, segments, pushed)
+    else:
+        with write_lock:
+            reset, entities, pushes = take_changes()
+            if reset or len(entities) > 0 or len(pushes) > 0:
+                if config.fork_snapshots:
+                    background_snapshot(config.backup_path, {}, queue=True)
+                else:
+                    write_snapshot(config.backup_path, {})
+        if config.fork_snapshots and config.strict_commit:
+            wait_snapshot()
+
+def request_flush():
+    '''Description: Have what changed written by the writer thread,
+    waiting for it if config.strict_commit is set.
+    '''
+    if config.commit_window == 0:
+        commit_requested()
+        return
+    condition = writer_state['condition']
+    with condition:
+        writer_state['requested'] += 1
+        ticket = writer_state['requested']
+        if writer_state['thread'] is None:
+            writer_state['thread'] = threading.Thread(target=writer, daemon=True)
+            writer_state['thread'].start()
+        condition.notify_all()
+        if config.strict_commit:
+            while writer_state['committed'] < ticket:
+                condition.wait()
+
+def writer():
+    '''Description: Write every dump requested within config.commit_window
+    seconds of the first one in a single flush.
+    '''
+    condition = writer_state['condition']
+    while True:
+        with condition:
+            while writer_state['committed'] >= writer_state['requested']:
+                condition.wait()
+        time.sleep(config.commit_window)
+        try:
+            commit_requested()
+        except Exception as error:
+            print(f"Writing the changes of the last {config.commit_window}s failed: {error!r}")
+
+def commit_requested():
+    '''Description: Flush, covering every dump requested so far.
+    '''
+    condition = writer_state['condition']
+    with condition:
+        target = writer_state['requested']
+    try:
+        flush()
+    except Exception:
+        # What the flush took is not written, so the next one writes everything.
+        mark_reset()
+        raise
+    finally:
+        with condition:
+            writer_state['committed'] = max(writer_state['committed'], target)
+            condition.notify_all()
+
+def commit_all():
+    '''Description: Write every dump requested so far and wait for the snapshots
+    it started.
+    '''
+    commit_requested()
+    wait_snapshot()
+
+# Dumps still waiting for the writer are written before the server exits.
+atexit.register(commit_all)
+
+def load():
+    '''Description: Load data from storage.
+    '''
+    commit_all()
+    with compact_lock, write_lock, lock:
+        if config.storage_mode == 'wal':
+            wal_load()
+        elif config.storage_mode == 'sqlite':
+            sqlite_load()
+        elif config.storage_mode == 'shards':
+            shards_load()
+        else:
+            read_snapshot(config.backup_path)
+            build_indexes()
+        take_changes()
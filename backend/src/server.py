@@ -370,10 +370,14 @@ def http_channel_details():
 def http_channel_messages():
     token = request.args.get('token')
     channel_id = int(request.args.get('channel_id'))
-    start = int(request.args.get('start'))
+    start = int(request.args.get('start', 0))
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', 50, type=int)
 
     try:
-        return dumps(channel.channel_messages_v2(token, channel_id, start))
+        return dumps(channel.channel_messages_v2(token, channel_id, start, before, after, cursor, limit))
     except AccessError as err:
         raise AccessError(err) from err
     except InputError as err:
@@ -498,10 +502,14 @@ def http_dm_remove():
 def http_dm_messages():
     token = request.args.get('token')
     dm_id = int(request.args.get('dm_id'))
-    start = int(request.args.get('start'))
+    start = int(request.args.get('start', 0))
+    before = request.args.get('before', type=int)
+    after = request.args.get('after', type=int)
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit', 50, type=int)
 
     try:
-        return dumps(dm.dm_messages_v1(token, dm_id, start))
+        return dumps(dm.dm_messages_v1(token, dm_id, start, before, after, cursor, limit))
     except AccessError as err:
         raise AccessError(err) from err
     except InputError as err:
@@ -0,0 +1,400 @@
+'''SQLite storage of the data store, used when config.storage_mode is 'sqlite'.
+
+The database is where data is persisted, not what handlers query: data in
+memory stays the working set, as in the other storage modes. It is read
+whole once, when the server starts, with one query per table. Each flush
+turns the log ops of src/persistence.py into row writes inside one
+transaction, so a message sent only writes its own rows.
+
+Limitation: channel_messages_v2, dm_messages_v1, search_v2 and finding a
+message by id do not run as queries on the database. They go through
+data and src/indexes.py as in every other mode, so the whole of data is
+held in memory with 'sqlite' too. The database lags data by up to
+config.commit_window, so queries on it could miss what was just sent.
+
+Tables:
+
+    users           (u_id, email, password, name_first, name_last, handle_str,
+                     profile_img_url, permission_id, is_valid)
+    sessions        (u_id, session_id)
+    channels        (channel_id, channel_name, is_public, standup)
+    dms             (dm_id, dm_name)
+    memberships     (org_type, org_id, u_id, is_owner, position)
+    messages        (message_id, org_type, org_id, u_id, message,
+                     time_created, is_pinned)
+    reacts          (message_id, react_id, u_id, position)
+    notifications   (u_id, position, channel_id, dm_id, notification_message)
+    stats           (owner_type, owner_id, series, position, num, time_stamp)
+    ids             (name, value)       the state of src/ids.py
+
+Messages are read back in the order their rows were first inserted, and
+a react with no u_id is stored as a row whose u_id is NULL. Upserts keep
+the rowid of a row, so users, channels and dms keep their order too.
+'''
+import json
+import sqlite3
+from src import config
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS users (
+    u_id            INTEGER NOT NULL UNIQUE,
+    email           TEXT NOT NULL,
+    password        TEXT NOT NULL,
+    name_first      TEXT NOT NULL,
+    name_last       TEXT NOT NULL,
+    handle_str      TEXT NOT NULL,
+    profile_img_url TEXT,
+    permission_id   INTEGER NOT NULL,
+    is_valid        INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS users_email ON users (email);
+CREATE INDEX IF NOT EXISTS users_handle ON users (handle_str);
+CREATE TABLE IF NOT EXISTS sessions (
+    u_id            INTEGER NOT NULL,
+    session_id      INTEGER NOT NULL,
+    PRIMARY KEY (u_id, session_id)
+);
+CREATE TABLE IF NOT EXISTS channels (
+    channel_id      INTEGER NOT NULL UNIQUE,
+    channel_name    TEXT NOT NULL,
+    is_public       INTEGER NOT NULL,
+    standup         TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dms (
+    dm_id           INTEGER NOT NULL UNIQUE,
+    dm_name         TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS memberships (
+    org_type        TEXT NOT NULL,
+    org_id          INTEGER NOT NULL,
+    u_id            INTEGER NOT NULL,
+    is_owner        INTEGER NOT NULL,
+    position        INTEGER NOT NULL,
+    PRIMARY KEY (org_type, org_id, is_owner, u_id)
+);
+CREATE INDEX IF NOT EXISTS memberships_user ON memberships (u_id);
+CREATE TABLE IF NOT EXISTS messages (
+    message_id      INTEGER PRIMARY KEY,
+    org_type        TEXT NOT NULL,
+    org_id          INTEGER NOT NULL,
+    u_id            INTEGER NOT NULL,
+    message         TEXT NOT NULL,
+    time_created    REAL,
+    is_pinned       INTEGER NOT NULL,
+    seq             INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_org ON messages (org_type, org_id, seq);
+CREATE INDEX IF NOT EXISTS messages_user ON messages (u_id);
+CREATE TABLE IF NOT EXISTS reacts (
+    message_id      INTEGER NOT NULL,
+    react_id        INTEGER NOT NULL,
+    u_id            INTEGER,
+    position        INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reacts_message ON reacts (message_id);
+CREATE TABLE IF NOT EXISTS notifications (
+    u_id            INTEGER NOT NULL,
+    position        INTEGER NOT NULL,
+    channel_id      INTEGER,
+    dm_id           INTEGER,
+    notification_message TEXT NOT NULL,
+    PRIMARY KEY (u_id, position)
+);
+CREATE TABLE IF NOT EXISTS stats (
+    owner_type      TEXT NOT NULL,
+    owner_id        INTEGER NOT NULL,
+    series          TEXT NOT NULL,
+    position        INTEGER NOT NULL,
+    num             INTEGER NOT NULL,
+    time_stamp      REAL,
+    PRIMARY KEY (owner_type, owner_id, series, position)
+);
+CREATE TABLE IF NOT EXISTS ids (
+    name            TEXT PRIMARY KEY,
+    value           NOT NULL
+);
+'''
+
+TABLES = [
+    'users', 'sessions', 'channels', 'dms', 'memberships',
+    'messages', 'reacts', 'notifications', 'stats', 'ids',
+]
+
+USER_SERIES = ['channels_joined', 'dms_joined', 'messages_sent']
+DREAMS_SERIES = ['channels_exist', 'dms_exist', 'messages_exist']
+
+connection = {
+    'db'    : None,
+    'seq'   : 0,
+}
+
+def connect():
+    '''Description: Open the database at config.sqlite_path, creating the tables if needed.
+
+    Returns True if the database was empty.
+    '''
+    if connection['db'] is None:
+        connection['db'] = sqlite3.connect(config.sqlite_path, check_same_thread=False)
+        connection['db'].executescript(SCHEMA)
+        row = connection['db'].execute('SELECT MAX(seq) FROM messages').fetchone()
+        connection['seq'] = row[0] if row[0] is not None else 0
+    db = connection['db']
+    return db.execute('SELECT COUNT(*) FROM users').fetchone()[0] == 0 \
+        and db.execute('SELECT COUNT(*) FROM stats').fetchone()[0] == 0
+
+# ========== Writing ==========
+
+def write_ops(ops):
+    '''Description: Apply log ops of src/persistence.py as row writes in one transaction.
+    '''
+    connect()
+    db = connection['db']
+    with db:
+        for op in ops:
+            if op[0] == 'push':
+                write_push(db, op[1], op[2], op[3])
+            elif op[0] == 'put':
+                write_put(db, op[1], op[2], op[3])
+            else:
+                write_del(db, op[1], op[2])
+
+def write_all(snapshot):
+    '''Description: Replace the content of every table with snapshot,
+    given in the format of backup.json.
+    '''
+    connect()
+    db = connection['db']
+    with db:
+        for table in TABLES:
+            db.execute(f'DELETE FROM {table}')
+        for user in snapshot['users']:
+            write_put(db, 'user', user['auth_user_id'], user)
+            for key in USER_SERIES:
+                for position, item in enumerate(user['stats'][key]):
+                    write_push(db, ['user', user['auth_user_id'], key], position + 1, item)
+            for position, item in enumerate(user['notifications']):
+                write_push(db, ['user', user['auth_user_id'], 'notifications'], position + 1, item)
+        for org_type in ['channel', 'dm']:
+            for org in snapshot[org_type + 's']:
+                org_id = org[org_type + '_id']
+                write_put(db, org_type, org_id, org)
+                for message in org['messages']:
+                    write_put(db, 'message', [org_type, org_id, message['message_id']], message)
+        for key in DREAMS_SERIES:
+            for position, item in enumerate(snapshot['dreams_stats'][key]):
+                write_push(db, ['dreams_stats', None, key], position + 1, item)
+        write_put(db, 'ids', None, snapshot.get('ids', {}))
+
+def write_put(db, kind, key, value):
+    if kind == 'user':
+        info = value['public_info']
+        db.execute(
+            'INSERT INTO users VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (u_id) DO UPDATE SET email = excluded.email, '
+            'password = excluded.password, name_first = excluded.name_first, '
+            'name_last = excluded.name_last, handle_str = excluded.handle_str, '
+            'profile_img_url = excluded.profile_img_url, '
+            'permission_id = excluded.permission_id, is_valid = excluded.is_valid',
+            (key, info['email'], value['password'], info['name_first'], info['name_last'],
+             info['handle_str'], info.get('profile_img_url'), value['permission_id'],
+             int(value['is_valid']))
+        )
+        db.execute('DELETE FROM sessions WHERE u_id = ?', (key,))
+        db.executemany(
+            'INSERT OR IGNORE INTO sessions VALUES (?, ?)',
+            [(key, session) for session in value['sessions']]
+        )
+    elif kind == 'message':
+        org_type, org_id, message_id = key
+        connection['seq'] += 1
+        db.execute(
+            'INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?, ?) '
+            'ON CONFLICT (message_id) DO UPDATE SET u_id = excluded.u_id, '
+            'message = excluded.message, time_created = excluded.time_created, '
+            'is_pinned = excluded.is_pinned',
+            (message_id, org_type, org_id, value['u_id'], value['message'],
+             value['time_created'], int(value['is_pinned']), connection['seq'])
+        )
+        db.execute('DELETE FROM reacts WHERE message_id = ?', (message_id,))
+        rows = []
+        for react in value['reacts']:
+            rows.append((message_id, react['react_id'], None, 0))
+            for position, u_id in enumerate(react['u_ids']):
+                rows.append((message_id, react['react_id'], u_id, position + 1))
+        db.executemany('INSERT INTO reacts VALUES (?, ?, ?, ?)', rows)
+    elif kind == 'ids':
+        db.executemany(
+            'INSERT INTO ids VALUES (?, ?) ON CONFLICT (name) DO UPDATE SET value = excluded.value',
+            list(value.items())
+        )
+    else:
+        if kind == 'channel':
+            db.execute(
+                'INSERT INTO channels VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (channel_id) DO UPDATE SET channel_name = excluded.channel_name, '
+                'is_public = excluded.is_public, standup = excluded.standup',
+                (key, value['channel_name'], int(value['is_public']),
+                 json.dumps(value['standup']))
+            )
+        else:
+            db.execute(
+                'INSERT INTO dms VALUES (?, ?) '
+                'ON CONFLICT (dm_id) DO UPDATE SET dm_name = excluded.dm_name',
+                (key, value['dm_name'])
+            )
+        db.execute('DELETE FROM memberships WHERE org_type = ? AND org_id = ?', (kind, key))
+        rows = []
+        for is_owner, members_key in [(1, 'owner_members'), (0, 'all_members')]:
+            for position, member in enumerate(value[members_key]):
+                rows.append((kind, key, member['u_id'], is_owner, position))
+        db.executemany('INSERT OR IGNORE INTO memberships VALUES (?, ?, ?, ?, ?)', rows)
+
+def write_del(db, kind, key):
+    if kind == 'message':
+        db.execute('DELETE FROM messages WHERE message_id = ?', (key[2],))
+        db.execute('DELETE FROM reacts WHERE message_id = ?', (key[2],))
+        return
+    db.execute(f'DELETE FROM {kind}s WHERE {kind}_id = ?', (key,))
+    db.execute('DELETE FROM memberships WHERE org_type = ? AND org_id = ?', (kind, key))
+    db.execute(
+        'DELETE FROM reacts WHERE message_id IN '
+        '(SELECT message_id FROM messages WHERE org_type = ? AND org_id = ?)', (kind, key)
+    )
+    db.execute('DELETE FROM messages WHERE org_type = ? AND org_id = ?', (kind, key))
+
+def write_push(db, path, length, item):
+    if path[2] == 'notifications':
+        db.execute(
+            'INSERT OR IGNORE INTO notifications VALUES (?, ?, ?, ?, ?)',
+            (path[1], length, item.get('channel_id'), item.get('dm_id'),
+             item['notification_message'])
+        )
+        return
+    if path[0] == 'user':
+        owner = ('user', path[1])
+    else:
+        owner = ('dreams', 0)
+    db.execute(
+        'INSERT OR IGNORE INTO stats VALUES (?, ?, ?, ?, ?, ?)',
+        (owner[0], owner[1], path[2], length, item['num_' + path[2]], item['time_stamp'])
+    )
+
+# ========== Reading ==========
+
+def read_all():
+    '''Description: Read every table back into the format of backup.json,
+    with one query per table.
+
+    Members of orgs are the public_info of their user.
+    '''
+    db = connection['db']
+    snapshot = {
+        'users'         : [],
+        'channels'      : [],
+        'dms'           : [],
+        'dreams_stats'  : {'utilization_rate': 0},
+    }
+    users = {}
+    for row in db.execute('SELECT * FROM users ORDER BY rowid'):
+        u_id = row[0]
+        user = {
+            'password'      : row[2],
+            'auth_user_id'  : u_id,
+            'sessions'      : [],
+            'permission_id' : row[7],
+            'notifications' : [],
+            'is_valid'      : bool(row[8]),
+            'reacted_msgs'  : [],
+            'public_info'   : {
+                'u_id'      : u_id,
+                'name_first': row[3],
+                'name_last' : row[4],
+                'handle_str': row[5],
+                'email'     : row[1],
+                'profile_img_url': row[6],
+            },
+            'stats'         : {'involvement_rate': 0},
+        }
+        for key in USER_SERIES:
+            user['stats'][key] = []
+        users[u_id] = user
+        snapshot['users'].append(user)
+    for key in DREAMS_SERIES:
+        snapshot['dreams_stats'][key] = []
+
+    for u_id, session_id in db.execute('SELECT u_id, session_id FROM sessions ORDER BY rowid'):
+        users[u_id]['sessions'].append(session_id)
+    for owner_type, owner_id, series, num, time_stamp in db.execute(
+        'SELECT owner_type, owner_id, series, num, time_stamp FROM stats '
+        'ORDER BY owner_type, owner_id, series, position'):
+        if owner_type == 'user':
+            items = users[owner_id]['stats'][series]
+        else:
+            items = snapshot['dreams_stats'][series]
+        items.append({'num_' + series: num, 'time_stamp': time_stamp})
+    for u_id, channel_id, dm_id, message in db.execute(
+        'SELECT u_id, channel_id, dm_id, notification_message FROM notifications '
+        'ORDER BY u_id, position'):
+        users[u_id]['notifications'].append({
+            'notification_message'  : message,
+            'channel_id'            : channel_id,
+            'dm_id'                 : dm_id,
+        })
+
+    orgs = {}
+    for row in db.execute('SELECT * FROM channels ORDER BY rowid'):
+        snapshot['channels'].append({
+            'channel_id'    : row[0],
+            'channel_name'  : row[1],
+            'is_public'     : bool(row[2]),
+            'standup'       : json.loads(row[3]),
+        })
+    for row in db.execute('SELECT * FROM dms ORDER BY rowid'):
+        snapshot['dms'].append({
+            'dm_id'         : row[0],
+            'dm_name'       : row[1],
+        })
+    for org_type in ['channel', 'dm']:
+        for org in snapshot[org_type + 's']:
+            org['owner_members'] = []
+            org['all_members'] = []
+            org['messages'] = []
+            orgs[(org_type, org[org_type + '_id'])] = org
+
+    for org_type, org_id, u_id, is_owner in db.execute(
+        'SELECT org_type, org_id, u_id, is_owner FROM memberships '
+        'ORDER BY org_type, org_id, position'):
+        members_key = 'owner_members' if is_owner else 'all_members'
+        orgs[(org_type, org_id)][members_key].append(users[u_id]['public_info'])
+    read_messages(db, orgs)
+
+    snapshot['ids'] = dict(db.execute('SELECT name, value FROM ids').fetchall())
+    return snapshot
+
+def read_messages(db, orgs):
+    '''Description: Fill the messages of the orgs, given by (org_type, org_id),
+    oldest first, with their reacts.
+    '''
+    by_id = {}
+    for row in db.execute(
+        'SELECT message_id, org_type, org_id, u_id, message, time_created, is_pinned '
+        'FROM messages ORDER BY seq'):
+        message = {
+            'message'       : row[4],
+            'u_id'          : row[3],
+            'message_id'    : row[0],
+            'time_created'  : row[5],
+            'is_pinned'     : bool(row[6]),
+            'reacts'        : [],
+        }
+        orgs[(row[1], row[2])]['messages'].append(message)
+        by_id[row[0]] = message
+    reacts = {}
+    for message_id, react_id, u_id in db.execute(
+        'SELECT message_id, react_id, u_id FROM reacts ORDER BY message_id, position'):
+        if u_id is None:
+            react = {'react_id': react_id, 'u_ids': []}
+            reacts[(message_id, react_id)] = react
+            by_id[message_id]['reacts'].append(react)
+        else:
+            reacts[(message_id, react_id)]['u_ids'].append(u_id)
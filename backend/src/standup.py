@@ -4,7 +4,7 @@ from datetime import datetime, timezone
 from src.data import data
 from src.error import AccessError, InputError
 from src.auth import detokenise
-from src.helpers import error_check, find, randomise, insert_message, data_dump, update_user_stats, update_users_stats
+from src.helpers import error_check, find, randomise, insert_message, data_dump, update_user_stats, update_users_stats, mark_changed
 
 def standup_start_v1(token, channel_id, length):
     '''
@@ -69,6 +69,7 @@ def standup_start_v1(token, channel_id, length):
     now = datetime.now().replace(tzinfo=timezone.utc).timestamp()
     end = now + length
     org['standup']['time_finish'] = end
+    mark_changed('channel', channel_id)
 
     data_dump()
 
@@ -184,6 +185,7 @@ def standup_send_v1(token, channel_id, message):
                         + ' ' + sender['public_info']['name_last'],
     }
     org['standup']['messages'].append(to_append_msg)
+    mark_changed('channel', channel_id)
 
     return { }
 
@@ -238,6 +240,7 @@ def end_standup(auth_user_id, org):
     org['standup']['time_finish']   = None
     org['standup']['is_active']     = False
     org['standup']['messages']      = []
+    mark_changed('channel', org['channel_id'])
     if len(summary) > 0:
         print(f"Finishing standup, {summary}")
         update_user_stats([auth_user_id], 'messages', True)
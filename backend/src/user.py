@@ -5,7 +5,8 @@ from src.config import url
 from src.data import data
 from src.auth import detokenise
 from src.error import AccessError, InputError
-from src.helpers import find, error_check, data_dump
+from src.helpers import find, error_check, data_dump, mark_changed
+from src.indexes import user_position, email_position, handle_position, set_unique_info
 
 def user_profile_v2(token, u_id):
     '''
@@ -42,17 +43,11 @@ def user_profile_v2(token, u_id):
     error_check(AccessError, 'db_user', [auth_user_id, session_id])
 
     # Check for InputErrors
-    searching_domain = data['users']
-    user_idx = 0
-    while user_idx < len(searching_domain):
-        if searching_domain[user_idx]['auth_user_id'] == u_id:
-            break
-        user_idx += 1
-    if user_idx == len(searching_domain):
+    target_user_pos = find_user_inc_invalid(u_id)
+    if target_user_pos < 0:
         raise InputError(f'User with u_id {u_id} does not exist in database.')
 
     # Find the correct user
-    target_user_pos = find_user_inc_invalid(u_id)
     target_user = data['users'][target_user_pos]
     # print(f"returning from user_profile {target_user['public_info']}")
     return {
@@ -109,6 +104,7 @@ def user_profile_setname_v2(token, name_first, name_last):
     # Change the names given
     target_user['name_first'] = name_first
     target_user['name_last'] = name_last
+    mark_changed('user', auth_user_id)
 
     data_dump()
 
@@ -155,8 +151,10 @@ def user_profile_setemail_v2(token, email):
     target_user_pos = find('user', None, auth_user_id)
     target_user = data['users'][target_user_pos]['public_info']
 
-    # Change to email given
-    target_user['email'] = email
+    # Change to email given, unless someone took it meanwhile
+    if set_unique_info(target_user_pos, 'email', email) is False:
+        raise InputError("Email already in use")
+    mark_changed('user', auth_user_id)
 
     data_dump()
 
@@ -203,8 +201,10 @@ def user_profile_sethandle_v1(token, handle_str):
     target_user_pos = find('user', None, auth_user_id)
     target_user = data['users'][target_user_pos]['public_info']
 
-    # Change to new handle string
-    target_user['handle_str'] = handle_str
+    # Change to new handle string, unless someone took it meanwhile
+    if set_unique_info(target_user_pos, 'handle_str', handle_str) is False:
+        raise InputError(f"{handle_str} is alreay being used")
+    mark_changed('user', auth_user_id)
 
     data_dump()
 
@@ -335,6 +335,7 @@ def user_profile_uploadphoto(token, img_url, x_start, y_start, x_end, y_end):
     # Saving the cropped image as the user profile.
     pic_store_local = f"static/{user_name}_image.jpg"
     target_user['profile_img_url'] = url + pic_store_local
+    mark_changed('user', auth_user_id)
 
     data_dump()
 
@@ -499,10 +500,7 @@ def check_email_format(email):
 
 # Function that checks if an email already exists.
 def check_email_existence(email):
-    for user in data['users']:
-        if user['public_info']['email'] == email:
-            return True
-    return False
+    return email_position(email) >= 0
 
 # Function that checks if the handle string is too long.
 def check_len_handle(handle_str):
@@ -513,20 +511,10 @@ def check_len_handle(handle_str):
 
 # Function that checks if a handle string already exists.
 def check_dup_handle(handle_str):
-    for user in data['users']:
-        if handle_str == user['public_info']['handle_str']:
-            return False
-    return True
+    return handle_position(handle_str) < 0
 
 # Function that searches for a user in the database including
-# invalid users(removed users).
+# invalid users(removed users), returns -1 if not found.
 def find_user_inc_invalid(u_id):
-    user_idx = 0
-    users = data['users']
-    for user in users:
-        if u_id != user['auth_user_id']:
-            user_idx += 1
-        else:
-            break
-    return user_idx
+    return user_position(u_id)
             
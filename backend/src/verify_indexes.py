@@ -0,0 +1,278 @@
+'''Checks of the indexes of src/indexes.py against the content of data.
+
+check_indexes() builds each index again by going through data, and runs
+every variant of find() both through the indexes and by going through
+data the way it was done before they existed, and returns what differs.
+
+With config.verify_indexes, data_dump() calls verify() after every
+request which changes data, so that a difference stops the request it
+first shows up in. This goes through the whole of data each time, and
+reads every message history, so it is only for debugging.
+
+src/index_differential.py runs these checks after random handler calls.
+'''
+import bisect
+from src import helpers
+from src.data import data
+from src.indexes import index, index_lock, message_ids_of, TEXT_INDEXES
+
+# ========== Finds without the indexes ==========
+
+def linear_user(u_id):
+    for user_idx in range(len(data['users'])):
+        if data['users'][user_idx]['public_info']['u_id'] == u_id:
+            return user_idx
+    return -1
+
+def linear_find(string_type, position, search_object):
+    '''Same as find() in src/helpers.py, going through data instead of the indexes.
+    '''
+    return_v = -2
+    if not isinstance(position, int):
+        if string_type == 'user':
+            user_idx = linear_user(search_object)
+            if user_idx >= 0 and not data['users'][user_idx]['is_valid']:
+                user_idx = -1
+            return_v = user_idx
+        elif string_type in ['channel', 'dm']:
+            return_v = -1
+            for org_idx in range(len(data[string_type + 's'])):
+                if data[string_type + 's'][org_idx][string_type + '_id'] == search_object:
+                    return_v = org_idx
+                    break
+        elif string_type == 'handle':
+            return_v = -1
+            for user_idx in range(len(data['users'])):
+                if data['users'][user_idx]['public_info']['handle_str'] == search_object:
+                    return_v = user_idx
+                    break
+        elif string_type == 'message':
+            return_v = linear_message(search_object)
+
+    if string_type in ['channel_is_owner', 'channel_is_member', 'dm_is_owner', 'dm_is_member']:
+        org_type, _, kind = string_type.split('_')
+        key = 'owner_members' if kind == 'owner' else 'all_members'
+        return_v = -1
+        for member in data[org_type + 's'][position][key]:
+            if member['u_id'] == search_object:
+                return_v = linear_user(search_object)
+                break
+    elif string_type == 'session':
+        user = data['users'][position]
+        return_v = -1
+        if user['is_valid'] and search_object in user['sessions']:
+            return_v = position
+
+    return return_v
+
+def linear_message(message_id):
+    for org_type in ['channel', 'dm']:
+        for org in data[org_type + 's']:
+            for message in org['messages']:
+                if message['message_id'] == message_id:
+                    return message, org, org_type, org[org_type + '_id']
+    return -1
+
+def same_result(found, expected):
+    '''Returns True if the results of find() and linear_find() agree.
+
+    Messages and orgs have to be the very objects in data, not equal copies.
+    '''
+    if isinstance(found, tuple) and isinstance(expected, tuple):
+        return (
+            found[0] is expected[0] and found[1] is expected[1]
+            and found[2:] == expected[2:]
+        )
+    return found == expected
+
+# ========== Checks ==========
+
+def expected_indexes():
+    '''Returns the indexes built by going through data.
+    '''
+    expected = {
+        'users'     : {},
+        'emails'    : {},
+        'handles'   : {},
+        'sessions'  : set(),
+        'session_ids': {},
+        'channels'  : {},
+        'dms'       : {},
+        'messages'  : {},
+        'members'   : {},
+        'owners'    : {},
+        'joined'    : {},
+    }
+    for user_idx, user in enumerate(data['users']):
+        expected['users'][user['auth_user_id']] = user_idx
+        expected['emails'].setdefault(user['public_info']['email'], user_idx)
+        expected['handles'].setdefault(user['public_info']['handle_str'], user_idx)
+        if user['is_valid']:
+            for session_id in user['sessions']:
+                expected['sessions'].add((user['auth_user_id'], session_id))
+    for _, session_id in expected['sessions']:
+        expected['session_ids'][session_id] = expected['session_ids'].get(session_id, 0) + 1
+    for org_type in ['channel', 'dm']:
+        for org_idx, org in enumerate(data[org_type + 's']):
+            org_id = org[org_type + '_id']
+            expected[org_type + 's'][org_id] = org_idx
+            expected['members'][(org_type, org_id)] = {m['u_id'] for m in org['all_members']}
+            expected['owners'][(org_type, org_id)] = {o['u_id'] for o in org['owner_members']}
+            for member in org['all_members']:
+                expected['joined'].setdefault((org_type, member['u_id']), set()).add(org_id)
+            for message_id in message_ids_of(org):
+                expected['messages'][message_id] = (org_type, org_id)
+    return expected
+
+def check_structure():
+    '''Returns the differences between the indexes and the ones built from data.
+    '''
+    differences = []
+    expected = expected_indexes()
+    for name, value in expected.items():
+        if name == 'messages':
+            actual = {mid: tuple(entry[:2]) for mid, entry in index['messages'].items()}
+        elif name == 'joined':
+            # Users keep an empty set once they left every org of a type.
+            actual = {key: ids for key, ids in index['joined'].items() if len(ids) > 0}
+        else:
+            actual = index[name]
+        if actual != value:
+            differences.append(f"index['{name}'] is {describe(actual, value)}")
+    # Positions are only indexed for the orgs they were asked for.
+    for (org_type, org_id), positions in index['positions'].items():
+        org_idx = expected[org_type + 's'].get(org_id)
+        if org_idx is None:
+            differences.append(f"index['positions'] has {org_type} {org_id}, which does not exist")
+            continue
+        messages = data[org_type + 's'][org_idx]['messages']
+        value = {message['message_id']: position for position, message in enumerate(messages)}
+        order = positions['order']
+        if order != sorted(set(order)) or set(order) != set(positions['seqs'].values()):
+            differences.append(
+                f"index['positions'] of {org_type} {org_id} has 'order' {order}"
+                f" for 'seqs' {positions['seqs']}"
+            )
+            continue
+        if len(order) > 0 and positions['next'] <= order[-1]:
+            differences.append(
+                f"index['positions'] of {org_type} {org_id} has 'next' {positions['next']}"
+                f" after {order[-1]}"
+            )
+        actual = {
+            message_id: bisect.bisect_left(order, seq)
+            for message_id, seq in positions['seqs'].items()
+        }
+        if actual != value:
+            differences.append(
+                f"index['positions'] of {org_type} {org_id} is {describe(actual, value)}"
+            )
+    # Reacts are only indexed for the messages they were asked for.
+    for message_id, reacts in index['reacts'].items():
+        found = linear_message(message_id)
+        if found == -1:
+            differences.append(f"index['reacts'] has message {message_id}, which does not exist")
+            continue
+        message = found[0]
+        value = {react['react_id']: set(react['u_ids']) for react in message['reacts']}
+        if reacts != value:
+            differences.append(f"index['reacts'] of message {message_id} is {reacts}, expected {value}")
+    return differences + check_tokens(expected)
+
+def check_tokens(expected):
+    '''Returns the differences between the token and trigram indexes and the
+    text of the messages of the orgs which are tokenised.
+    '''
+    differences = []
+    for org_type, org_id in index['untokenised']:
+        if org_id not in expected[org_type + 's']:
+            differences.append(f"index['untokenised'] has {org_type} {org_id}, which does not exist")
+    messages = []
+    for org_type in ['channel', 'dm']:
+        for org in data[org_type + 's']:
+            if (org_type, org[org_type + '_id']) not in index['untokenised']:
+                messages.extend(org['messages'])
+    for postings, keys_of_message, keys_of in TEXT_INDEXES:
+        message_keys = {}
+        posting_sets = {}
+        for message in messages:
+            message_keys[message['message_id']] = keys_of(message['message'])
+            for key in message_keys[message['message_id']]:
+                posting_sets.setdefault(key, set()).add(message['message_id'])
+        if index[keys_of_message] != message_keys:
+            differences.append(
+                f"index['{keys_of_message}'] is {describe(index[keys_of_message], message_keys)}"
+            )
+        if index[postings] != posting_sets:
+            differences.append(f"index['{postings}'] is {describe(index[postings], posting_sets)}")
+    return differences
+
+def describe(actual, expected):
+    if isinstance(expected, dict):
+        missing = [key for key in expected if key not in actual]
+        extra = [key for key in actual if key not in expected]
+        wrong = [key for key in expected if key in actual and actual[key] != expected[key]]
+        return f"missing {missing[:5]}, extra {extra[:5]}, wrong {wrong[:5]}"
+    return f"missing {sorted(expected - actual)[:5]}, extra {sorted(actual - expected)[:5]}"
+
+def probes():
+    '''Returns (string_type, position, search_object) of every find() to compare.
+    '''
+    u_ids = [user['auth_user_id'] for user in data['users']]
+    absent = [-1, 0]
+    calls = []
+    for u_id in u_ids + absent:
+        calls.append(('user', None, u_id))
+    for user in data['users']:
+        calls.append(('handle', None, user['public_info']['handle_str']))
+    calls.append(('handle', None, ''))
+    for org_type in ['channel', 'dm']:
+        for org_idx, org in enumerate(data[org_type + 's']):
+            calls.append((org_type, None, org[org_type + '_id']))
+            for kind in ['owner', 'member']:
+                for u_id in u_ids + absent:
+                    calls.append((f"{org_type}_is_{kind}", org_idx, u_id))
+            for message_id in message_ids_of(org):
+                calls.append(('message', None, message_id))
+        for org_id in absent:
+            calls.append((org_type, None, org_id))
+    for message_id in absent:
+        calls.append(('message', None, message_id))
+    for user_idx, user in enumerate(data['users']):
+        for session_id in user['sessions'] + absent:
+            calls.append(('session', user_idx, session_id))
+    return calls
+
+def check_finds():
+    '''Returns the finds whose result through the indexes differs from going through data.
+    '''
+    differences = []
+    for string_type, position, search_object in probes():
+        found = helpers.find(string_type, position, search_object)
+        expected = linear_find(string_type, position, search_object)
+        if not same_result(found, expected):
+            differences.append(
+                f"find('{string_type}', {position}, {search_object!r}) "
+                f"is {short(found)}, expected {short(expected)}"
+            )
+    return differences
+
+def short(result):
+    if isinstance(result, tuple):
+        return f"message {result[0]['message_id']} in {result[2]} {result[3]}"
+    return repr(result)
+
+def check_indexes():
+    '''Returns a list of the differences between the indexes and data, empty if none.
+    '''
+    with index_lock:
+        return check_structure() + check_finds()
+
+def verify():
+    '''Description: Check the indexes against data.
+
+    Raises AssertionError listing the differences if there are any.
+    '''
+    differences = check_indexes()
+    if len(differences) > 0:
+        raise AssertionError("Indexes differ from data:\n" + "\n".join(differences))
@@ -0,0 +1,25 @@
+import io
+from src import binary_snapshot
+
+def snapshot():
+    return {
+        'channels': [
+            {
+                'channel_id': 1,
+                'messages': [{'message_id': number, 'message': f"text {number}"} for number in range(5)],
+            },
+        ],
+        'ids': {'big': 1 << 70, 'small': -(1 << 70), 'text': 'é✓'},
+    }
+
+def test_roundtrip():
+    file = io.BytesIO()
+    binary_snapshot.write_object(file, snapshot())
+    file.seek(0)
+    assert binary_snapshot.read_object(file) == snapshot()
+
+def test_only_keys_in_table():
+    encoder = binary_snapshot.Encoder()
+    for channel in snapshot()['channels']:
+        encoder.encode_item(channel)
+    assert set(encoder.strings) == {'channel_id', 'messages', 'message_id', 'message'}
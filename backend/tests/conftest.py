@@ -0,0 +1,17 @@
+import os
+import tempfile
+from src import config
+
+# Whatever the tests and the dumps left at exit write goes to a directory
+# of its own, never to the storage under src/.
+storage_dir = tempfile.mkdtemp()
+config.storage_mode = 'json'
+config.snapshot_format = 'json'
+config.backup_path = os.path.join(storage_dir, 'backup.json')
+config.initial_backup_path = os.path.join(os.path.dirname(__file__), '..', 'src', 'backup.json')
+config.wal_path = os.path.join(storage_dir, 'backup.wal')
+config.sqlite_path = os.path.join(storage_dir, 'backup.db')
+config.shard_dir = os.path.join(storage_dir, 'backup')
+config.commit_window = 0
+config.fork_snapshots = False
+config.lazy_messages = False
@@ -0,0 +1,50 @@
+import pytest
+from src import ids
+from src import persistence
+from src.data import data
+from src.indexes import rebuild_indexes
+
+@pytest.fixture
+def empty_data():
+    '''data with only the users given by the test, and a fresh allocator.
+    '''
+    saved = dict(data)
+    data['users'] = []
+    data['channels'] = []
+    data['dms'] = []
+    data['ids'] = ids.new_state()
+    yield data
+    data.update(saved)
+    rebuild_indexes()
+    persistence.take_changes()
+
+def user_with_sessions(u_id, sessions):
+    return {
+        'auth_user_id'  : u_id,
+        'is_valid'      : True,
+        'sessions'      : sessions,
+        'public_info'   : {
+            'u_id'      : u_id,
+            'email'     : f"{u_id}@example.com",
+            'handle_str': f"user{u_id}",
+        },
+    }
+
+def next_id(kind):
+    low, high, _ = ids.RANGES[kind]
+    key = bytes.fromhex(data['ids']['key'])
+    return low + ids.permute(key, kind, high - low + 1, data['ids'][kind])
+
+def test_session_id_in_use_is_skipped(empty_data):
+    taken = next_id('session_id')
+    data['users'].append(user_with_sessions(1000001, [taken]))
+    rebuild_indexes()
+    assert ids.allocate('session_id') != taken
+    assert data['ids']['session_id'] == 2
+
+def test_ids_past_former_ceilings(empty_data):
+    rebuild_indexes()
+    for kind in ['session_id', 'message_id', 'dm_id', 'channel_id']:
+        data['ids'][kind] = 100000000
+        new_id = ids.allocate(kind)
+        assert ids.RANGES[kind][0] <= new_id <= ids.MAX_ID
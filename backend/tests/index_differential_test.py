@@ -0,0 +1,23 @@
+import os
+import pytest
+from src import config
+from src import persistence
+from src.index_differential import run
+from src.verify_indexes import verify
+
+BACKUP = os.path.join(os.path.dirname(__file__), '..', 'src', 'backup.json')
+
+@pytest.fixture
+def differential_config(monkeypatch):
+    '''Puts back the config run() changes.
+    '''
+    for name in ['storage_mode', 'snapshot_format', 'commit_window', 'fork_snapshots',
+                 'verify_indexes', 'backup_path', 'initial_backup_path']:
+        monkeypatch.setattr(config, name, getattr(config, name))
+    yield
+    persistence.take_changes()
+
+@pytest.mark.parametrize('seed', [1, 2, 3, 4, 5])
+def test_index_differential(differential_config, seed):
+    assert run(BACKUP, 200, seed) == []
+    verify()
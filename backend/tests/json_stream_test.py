@@ -0,0 +1,28 @@
+import pytest
+from src import json_stream
+
+def test_encode_again_once_changed():
+    calls = []
+    def changed_once(value):
+        calls.append(value)
+        if len(calls) == 1:
+            raise RuntimeError("dictionary changed size during iteration")
+        return 'encoded'
+    assert json_stream.encode_changing(changed_once, {}) == 'encoded'
+    assert len(calls) == 2
+
+def test_give_up_if_always_changed():
+    calls = []
+    def always_changed(value):
+        calls.append(value)
+        raise RuntimeError("dictionary changed size during iteration")
+    with pytest.raises(RuntimeError):
+        json_stream.encode_changing(always_changed, {})
+    assert len(calls) == json_stream.ENCODE_ATTEMPTS
+
+def test_nested_too_deep_raises_at_once():
+    value = []
+    for _ in range(100000):
+        value = [value]
+    with pytest.raises(RecursionError):
+        json_stream.encode(value)
@@ -0,0 +1,68 @@
+import pytest
+from src import persistence
+from src.auth import auth_register_v2
+from src.channels import channels_create_v2
+from src.channel import channel_messages_v2
+from src.message import message_send_v2, message_remove_v1
+from src.other import clear_v1
+from src.data import data
+from src.verify_indexes import verify
+
+@pytest.fixture
+def channel_history():
+    '''A channel with the messages '0' to '9', and the token of their sender.
+    '''
+    clear_v1()
+    token = auth_register_v2('pages.test@example.com', 'password', 'Pag', 'Es')['token']
+    channel_id = channels_create_v2(token, 'pages', True)['channel_id']
+    message_ids = [message_send_v2(token, channel_id, str(number))['message_id'] for number in range(10)]
+    yield token, channel_id, message_ids
+    clear_v1()
+    persistence.take_changes()
+
+def texts(page):
+    return [message['message'] for message in page['messages']]
+
+def test_cursor_after_its_message_is_removed(channel_history):
+    token, channel_id, message_ids = channel_history
+    page = channel_messages_v2(token, channel_id, 0, before=message_ids[9], limit=3)
+    assert texts(page) == ['8', '7', '6']
+    message_remove_v1(token, message_ids[6])
+    page = channel_messages_v2(token, channel_id, 0, cursor=page['next_cursor'], limit=3)
+    assert texts(page) == ['5', '4', '3']
+
+    page = channel_messages_v2(token, channel_id, 0, after=message_ids[0], limit=3)
+    assert texts(page) == ['3', '2', '1']
+    message_remove_v1(token, message_ids[3])
+    page = channel_messages_v2(token, channel_id, 0, cursor=page['next_cursor'], limit=3)
+    assert texts(page) == ['7', '5', '4']
+    verify()
+
+def test_positions_after_removals(channel_history):
+    token, channel_id, message_ids = channel_history
+    channel_messages_v2(token, channel_id, 0, before=message_ids[9], limit=1)
+    for number in [2, 5, 9]:
+        message_remove_v1(token, message_ids[number])
+    message_ids.append(message_send_v2(token, channel_id, '10')['message_id'])
+    page = channel_messages_v2(token, channel_id, 0, before=message_ids[10], limit=50)
+    assert texts(page) == ['8', '7', '6', '4', '3', '1', '0']
+    verify()
+
+def test_cursor_after_removing_a_message_sent_at_the_same_time(channel_history):
+    token, channel_id, message_ids = channel_history
+    messages = data['channels'][0]['messages']
+    # As messages sent later at the same time_sent are.
+    for message in messages[3:6]:
+        message['time_created'] = messages[6]['time_created']
+
+    page = channel_messages_v2(token, channel_id, 0, before=message_ids[9], limit=4)
+    assert texts(page) == ['8', '7', '6', '5']
+    message_remove_v1(token, message_ids[5])
+    page = channel_messages_v2(token, channel_id, 0, cursor=page['next_cursor'], limit=4)
+    assert texts(page) == ['4', '3', '2', '1']
+
+    page = channel_messages_v2(token, channel_id, 0, after=message_ids[0], limit=4)
+    assert texts(page) == ['4', '3', '2', '1']
+    message_remove_v1(token, message_ids[4])
+    page = channel_messages_v2(token, channel_id, 0, cursor=page['next_cursor'], limit=4)
+    assert texts(page) == ['9', '8', '7', '6']
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+import pytest
+from src import config
+from src import persistence
+from src import sqlite_store
+from src.data import data
+from src.helpers import data_load
+from src.auth import auth_register_v2
+from src.other import clear_v1
+
+@pytest.fixture
+def wal_storage(tmp_path, monkeypatch):
+    '''Storage in 'wal' mode with forked snapshots, under tmp_path.
+    '''
+    monkeypatch.setattr(config, 'storage_mode', 'wal')
+    monkeypatch.setattr(config, 'snapshot_format', 'json')
+    monkeypatch.setattr(config, 'backup_path', str(tmp_path / 'backup.json'))
+    monkeypatch.setattr(config, 'wal_path', str(tmp_path / 'backup.wal'))
+    monkeypatch.setattr(config, 'fork_snapshots', True)
+    monkeypatch.setattr(config, 'verify_indexes', False)
+    yield tmp_path
+    persistence.commit_all()
+    persistence.take_changes()
+    if persistence.wal_state['file'] is not None:
+        persistence.wal_state['file'].close()
+    persistence.wal_state['file'] = None
+    # Nothing left for the compactor to write once the paths are restored.
+    persistence.wal_state['snapshot_seq'] = persistence.wal_state['seq']
+
+def restart():
+    '''Drop data and load it again from storage, as a restarted server does.
+    '''
+    for key in ['users', 'channels', 'dms']:
+        data[key] = []
+    data_load()
+
+def hold_snapshot(path, seconds):
+    '''Mark a snapshot as being written to path for seconds, from a forked child.
+    '''
+    with open(path, 'w') as file:
+        file.write('{}')
+    condition = persistence.snapshot_state['condition']
+    with condition:
+        pid = os.fork()
+        if pid == 0:
+            time.sleep(seconds)
+            os._exit(0)
+        persistence.snapshot_state['pid'] = pid
+        persistence.snapshot_state['started'] = time.time()
+        persistence.snapshot_state['path'] = path
+        threading.Thread(target=persistence.reap_snapshot, args=(pid,), daemon=True).start()
+
+def test_wal_restart_keeps_changes(wal_storage):
+    data_load()
+    users = len(data['users'])
+    auth_register_v2('persistence.test@example.com', 'password', 'Persis', 'Tence')
+    restart()
+    assert len(data['users']) == users + 1
+
+def test_wal_clear_while_snapshot_running(wal_storage):
+    data_load()
+    auth_register_v2('persistence.test@example.com', 'password', 'Persis', 'Tence')
+    assert len(data['users']) > 0
+    hold_snapshot(str(wal_storage / 'other.json'), 0.5)
+    clear_v1()
+    restart()
+    assert data['users'] == []
+    assert data['channels'] == []
+    assert data['dms'] == []
+
+@pytest.mark.parametrize('mode, module, write', [
+    ('json', persistence, 'write_snapshot'),
+    ('wal', persistence, 'wal_append'),
+    ('sqlite', sqlite_store, 'write_ops'),
+    ('shards', persistence, 'write_shards'),
+])
+def test_mark_changed_during_flush(monkeypatch, mode, module, write):
+    monkeypatch.setattr(config, 'storage_mode', mode)
+    writing = threading.Event()
+    def slow_write(*args):
+        writing.set()
+        time.sleep(0.5)
+    monkeypatch.setattr(module, write, slow_write)
+    persistence.take_changes()
+    persistence.mark_changed('user', -1)
+    flusher = threading.Thread(target=persistence.flush)
+    flusher.start()
+    try:
+        assert writing.wait(5)
+        started = time.perf_counter()
+        persistence.mark_changed('user', -2)
+        assert time.perf_counter() - started < 0.1
+    finally:
+        flusher.join()
+        persistence.take_changes()